@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,17 +40,20 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 
     'rest_framework',
+    'django_filters',
     'drf_spectacular',
 
     'main',
 ]
 
 MIDDLEWARE = [
+    'main.middleware.metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main.middleware.profiling_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -135,6 +139,135 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 DRON_BATTERY_THRESHOLD = 25
 
+# Backends of the low battery notifications sent by the command "check_drones_battery"
+DRONE_BATTERY_NOTIFIERS = [
+    {
+        'BACKEND': 'main.notifications.LogNotifier',
+    },
+]
+
+DRONE_BATTERY_NOTIFICATIONS = {
+    'WORKERS': 4,
+    'BATCH_SIZE': 100,
+    'MAX_RETRIES': 3,
+    'RETRY_DELAY': 1.0,
+}
+
+# Default and maximum page size of the API listings
+API_PAGE_SIZE = 100
+
+API_MAX_PAGE_SIZE = 1000
+
+# Maximum number of battery readings by telemetry request
+TELEMETRY_MAX_READINGS = 10000
+
+# Readings dated further ahead than the clock of the server are rejected, one in the future would
+# make every newer real reading of the drone stale
+TELEMETRY_MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+# Write-behind buffer of the battery telemetry, only the newest reading of every drone is written
+# to the database every "FLUSH_INTERVAL" seconds or when "MAX_PENDING" drones are waiting
+BATTERY_WRITE_BEHIND = {
+    'ENABLED': False,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_PENDING': 5000,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Cache (alias of "CACHES") of the serialized drone detail and loaded medication items, reused for
+# "TIMEOUT" seconds until the drone or its medication items change. The "default" local-memory cache
+# is per process, with many processes use a shared backend (e.g. file based or Redis).
+DRONE_RESPONSE_CACHE = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# Dispatcher of the pending medication items (command "dispatch_medications"): a cycle every "INTERVAL"
+# seconds, at most "MAX_ITEMS_PER_TRANSACTION" items loaded into a drone by transaction, the changed items
+# are read again for "CHECKPOINT_OVERLAP" (the longest transaction saving medication items)
+DISPATCHER = {
+    'INTERVAL': 1.0,
+    'MAX_ITEMS_PER_TRANSACTION': 50,
+    'CHECKPOINT_OVERLAP': timedelta(seconds=5),
+}
+
+# Retention of the battery history: the raw readings are downsampled to minute buckets after
+# "RAW_RETENTION", the minute buckets to hour buckets after "MINUTE_RETENTION" and the hour buckets
+# are deleted after "HOUR_RETENTION" (command "rollup_battery_history"). The history endpoint serves
+# raw readings for windows up to "RAW_MAX_WINDOW" and up to "MAX_POINTS" minute buckets.
+BATTERY_HISTORY = {
+    'RAW_RETENTION': timedelta(days=1),
+    'MINUTE_RETENTION': timedelta(days=30),
+    'HOUR_RETENTION': timedelta(days=365),
+    'RAW_MAX_WINDOW': timedelta(hours=6),
+    'MAX_POINTS': 2000,
+}
+
+# The battery drain rate of the drones is estimated from their readings of the last "WINDOW",
+# with at least "MIN_READINGS" readings
+BATTERY_FORECAST = {
+    'WINDOW': timedelta(minutes=30),
+    'MIN_READINGS': 3,
+}
+
+# Variants generated for every medication image, next to the original, by a pool of
+# "MEDICATION_IMAGE_WORKERS" processes (0 to generate them in the request thread)
+MEDICATION_IMAGE_VARIANTS = {
+    'thumbnail': {'SIZE': (128, 128), 'FORMAT': 'WEBP', 'QUALITY': 80},
+    'web': {'SIZE': (1024, 1024), 'FORMAT': 'WEBP', 'QUALITY': 85},
+}
+
+MEDICATION_IMAGE_WORKERS = 2
+
+# Accepted formats and maximum width or height (pixels) of the medication images
+MEDICATION_IMAGE_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+
+MEDICATION_IMAGE_MAX_DIMENSION = 8000
+
+# The media files of the deleted medication items are queued and deleted in batches of "BATCH_SIZE",
+# by a background thread woken up on commit ("BACKGROUND") or the command "cleanup_media". The files
+# saved or reused by an upload in the last "REUSE_GRACE_PERIOD" stay queued. The command also deletes
+# the files of "SWEEP_DIRECTORIES" not used anymore and older than "ORPHAN_GRACE_PERIOD".
+MEDIA_CLEANUP = {
+    'BACKGROUND': True,
+    'BATCH_SIZE': 500,
+    'REUSE_GRACE_PERIOD': timedelta(minutes=5),
+    'SWEEP_DIRECTORIES': ['uploads/medications'],
+    'ORPHAN_GRACE_PERIOD': timedelta(hours=1),
+}
+
+# Metrics of the requests (latency and SQL queries by view) and of the drones, served under "/metrics"
+# in the Prometheus text format. Upper bounds of the buckets of the latency (seconds) and of the
+# number of SQL queries by request.
+METRICS = {
+    'ENABLED': True,
+    'LATENCY_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'QUERY_COUNT_BUCKETS': (0, 1, 2, 5, 10, 20, 50, 100),
+}
+
+# Profiling of single requests with "cProfile", with their SQL queries (up to "MAX_QUERIES"). A request
+# is profiled if it has the header "HEADER" with the value "SECRET" (or any value from a staff user),
+# or randomly with the probability "SAMPLE_RATE". The newest "MAX_PROFILES" profiles are kept in
+# "DIRECTORY" (command "profiles"). The middleware isn't installed if it's not "ENABLED".
+PROFILING = {
+    'ENABLED': False,
+    'HEADER': 'X-Profile',
+    'SECRET': '',
+    'SAMPLE_RATE': 0.0,
+    'DIRECTORY': BASE_DIR / 'profiles',
+    'MAX_PROFILES': 100,
+    'MAX_QUERIES': 1000,
+}
+
+# Number of rows fetched from the database by round trip on the exports
+EXPORT_CHUNK_SIZE = 2000
+
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
@@ -17,6 +17,7 @@ from django.contrib import admin
 from django.urls import path, re_path, include
 from django.conf import settings
 from django.views import static
+from main.views import metrics_view
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
 
@@ -25,6 +26,8 @@ urlpatterns = [
 
     path('api/main/', include('main.urls')),
 
+    path('metrics', metrics_view, name='metrics'),
+
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
 
     path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
@@ -6,5 +6,11 @@ class MainConfig(AppConfig):
     name = 'main'
 
     def ready(self) -> None:
+        from django.db.backends.signals import connection_created
+
         from .signals import post_delete_medication
+        from .metrics import install_sql_execute_wrapper
+
+        # Time the SQL queries of the requests
+        connection_created.connect(install_sql_execute_wrapper, dispatch_uid='main.metrics')
         return super().ready()
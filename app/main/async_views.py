@@ -0,0 +1,183 @@
+"""
+Async versions of the read-heavy endpoints of the drones, served under ASGI without taking a
+thread of the pool per request. They use the same URLs and responses as the viewset, which
+still serves the other methods and the browsable API.
+
+The async views don't run the authentication, permissions, throttling and content negotiation
+of REST framework, so they only serve the requests those policies would let through unchanged:
+the viewset allows any client and has no throttles, the request has no credentials and accepts
+JSON. Every other request is served by the viewset.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.mediatypes import media_type_matches
+
+from .conditional import (
+    acollection_version,
+    ainstance_version,
+    conditional_response,
+    query_variant,
+    set_version_headers
+)
+from .models import Drone, Medication
+from .response_cache import aget_or_set_response, request_variant
+from .serializers import DronBatterySerializer, DroneSerializer, MedicationSerializer
+from .views import DroneViewset
+
+
+def _viewset_view(actions: dict, **initkwargs):
+    return DroneViewset.as_view(actions, basename='drone', **initkwargs)
+
+
+def _json_response(data, status_code=status.HTTP_200_OK) -> HttpResponse:
+    """
+    Render the data like the viewset, with the JSON renderer of REST framework
+    """
+    response = HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def _not_found() -> HttpResponse:
+    return _json_response({'detail': NotFound.default_detail}, status.HTTP_404_NOT_FOUND)
+
+
+def _viewset_policies_allow_any() -> bool:
+    """
+    The viewset lets every request through without checks the async views would skip
+    """
+    return not DroneViewset.throttle_classes and all(
+        issubclass(permission_class, AllowAny) for permission_class in DroneViewset.permission_classes
+    )
+
+
+def _served_by_viewset(request) -> bool:
+    if request.method != 'GET' or not _viewset_policies_allow_any():
+        return True
+
+    # The credentials are validated by the authentication of the viewset (401 if wrong)
+    if 'Authorization' in request.headers or 'format' in request.GET:
+        return True
+
+    accept = request.headers.get('Accept', '')
+
+    # The browsable API
+    if 'text/html' in accept:
+        return True
+
+    # Content negotiation: the viewset answers 406 if JSON isn't accepted
+    media_types = [media_type.strip() for media_type in accept.split(',') if media_type.strip()]
+    return bool(media_types) and not any(
+        media_type_matches(JSONRenderer.media_type, media_type) for media_type in media_types
+    )
+
+
+def async_read_view(sync_view):
+    """
+    Serve the GET requests of JSON clients with the decorated coroutine and delegate the other methods,
+    the browsable API and the requests that need the policies of REST framework, to the sync view
+    of the viewset
+
+        Parameters:
+            sync_view: View of the viewset for the same URL
+    """
+    async_sync_view = sync_to_async(sync_view)
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if _served_by_viewset(request):
+                return await async_sync_view(request, *args, **kwargs)
+
+            try:
+                return await view(request, *args, **kwargs)
+            except ValidationError as err:
+                # Invalid parameters of the request (e.g. "fields")
+                return _json_response(err.detail, status.HTTP_400_BAD_REQUEST)
+
+        # The decorator "csrf_exempt" of Django 4.1 doesn't support coroutines
+        wrapper.csrf_exempt = True
+        wrapper.sync_view = sync_view
+        return wrapper
+
+    return decorator
+
+
+@async_read_view(_viewset_view(
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}, detail=True
+))
+async def drone_detail(request, pk):
+    """
+    Get a drone
+    """
+    version = await ainstance_version(Drone.objects.all(), pk, query_variant(request))
+    response = conditional_response(request, version)
+
+    if response is not None:
+        return response
+
+    async def build():
+        drone = await Drone.objects.aget(pk=pk)
+        return dict(DroneSerializer(drone, context={'request': request}).data)
+
+    try:
+        data = await aget_or_set_response(pk, 'detail', build, request_variant(request))
+    except Drone.DoesNotExist:
+        return _not_found()
+
+    return set_version_headers(_json_response(data), version)
+
+
+@async_read_view(_viewset_view({'get': 'get_battery'}, detail=True, **DroneViewset.get_battery.kwargs))
+async def drone_get_battery(request, pk):
+    """
+    Get batterry lavel of the drone
+    """
+    version = await ainstance_version(Drone.objects.all(), pk, query_variant(request))
+    response = conditional_response(request, version)
+
+    if response is not None:
+        return response
+
+    try:
+        drone = await Drone.objects.only('battery_capacity', 'battery_updated_at').aget(pk=pk)
+    except Drone.DoesNotExist:
+        return _not_found()
+
+    serializer = DronBatterySerializer(drone, context={'request': request})
+    return set_version_headers(_json_response(serializer.data), version)
+
+
+@async_read_view(_viewset_view(
+    {'get': 'get_loaded_medication_items'}, detail=True, **DroneViewset.get_loaded_medication_items.kwargs
+))
+async def drone_get_loaded_medication_items(request, pk):
+    """
+    Get loaded medication items of a drone
+    """
+    medications = Medication.objects.filter(drone_id=pk)
+    version = await acollection_version(medications, f'drone{pk}', query_variant(request))
+
+    if version.last_modified is None and not await Drone.objects.filter(pk=pk).aexists():
+        return _not_found()
+
+    response = conditional_response(request, version)
+
+    if response is not None:
+        return response
+
+    async def build():
+        serializer = MedicationSerializer(
+            [medication async for medication in medications], many=True, context={'request': request}
+        )
+        return list(serializer.data)
+
+    data = await aget_or_set_response(pk, 'loaded_medication_items', build, request_variant(request))
+    return set_version_headers(_json_response(data), version)
@@ -0,0 +1,208 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .telemetry import update_batteries
+from .battery_history import record_battery_readings
+
+logger = logging.getLogger(__name__)
+
+
+class BatteryWriteBuffer:
+    """
+    In-process write-behind buffer of the battery readings, keeps only the newest reading of every drone
+    and writes them to the database in a single transaction every "flush_interval" seconds or when
+    "max_pending" drones are waiting.
+    """
+
+    def __init__(self, flush_interval: float = 1.0, max_pending: int = 5000) -> None:
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending = {}
+        # Readings being written, visible until their transaction is committed
+        self._inflight = {}
+        self._history = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.received = 0
+        self.written = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+
+    def add(self, latest: dict, history: list = (), received: int = None) -> None:
+        """
+        Buffer the newest readings of the drones.
+
+            Parameters:
+                latest (dict): Drone ID to its newest BatteryTelemetry
+                history (list): Readings to append to the battery history, as (drone ID, timestamp, battery capacity)
+                received (int): Number of readings coalesced into "latest", its length by default
+        """
+        with self._lock:
+            self._merge(latest)
+            self._history.extend(history)
+            self.received += len(latest) if received is None else received
+            pending = len(self._pending)
+
+        self._start()
+
+        if pending >= self.max_pending:
+            self.flush()
+
+    def get(self, drone_id: int):
+        """
+        Get the buffered BatteryTelemetry of a drone (pending or being written), None if there isn't any
+        """
+        pending = self._pending.get(drone_id)
+        inflight = self._inflight.get(drone_id)
+
+        if pending is None or (inflight is not None and inflight.timestamp > pending.timestamp):
+            return inflight
+
+        return pending
+
+    def get_battery_capacity(self, drone: 'Drone') -> float:
+        """
+        Battery capacity of the drone, the buffered one if it is newer than the stored one
+        """
+        return self.get_newest_battery_capacity(drone.pk, drone.battery_capacity, drone.battery_updated_at)
+
+    def get_newest_battery_capacity(self, drone_id: int, battery_capacity: float, battery_updated_at) -> float:
+        """
+        Like "get_battery_capacity", from the stored values of the drone (e.g. a "values()" row)
+        """
+        reading = self.get(drone_id)
+
+        if reading is not None and (battery_updated_at is None or reading.timestamp > battery_updated_at):
+            return reading.battery_capacity
+
+        return battery_capacity
+
+    def flush(self) -> int:
+        """
+        Write the buffered readings to the database
+
+            Returns:
+                int: Number of updated drones
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                history, self._history = self._history, []
+                self._inflight.update(pending)
+
+            if not pending and not history:
+                return 0
+
+            start = time.perf_counter()
+
+            try:
+                with transaction.atomic():
+                    updated = update_batteries(pending)
+                    record_battery_readings(history)
+                    # The readings are read from the buffer until they can be read from the database
+                    transaction.on_commit(lambda: self._release_inflight(pending))
+            except Exception:
+                logger.exception('Failed to write %s buffered battery readings', len(pending))
+
+                # Keep the readings for the next flush, unless newer ones arrived meanwhile
+                with self._lock:
+                    self._merge(pending)
+                    self._history[:0] = history
+                self._release_inflight(pending)
+                return 0
+
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.written += len(pending)
+                self.flushes += 1
+                self.flush_seconds_total += elapsed
+                self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+
+            return updated
+
+    def close(self) -> None:
+        """
+        Stop the flush thread and write the pending readings
+        """
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'received': self.received,
+                'written': self.written,
+                'coalescing_ratio': self.received / self.written if self.written else None,
+                'flushes': self.flushes,
+                'flush_seconds_avg': self.flush_seconds_total / self.flushes if self.flushes else None,
+                'flush_seconds_max': self.flush_seconds_max,
+            }
+
+    def _release_inflight(self, readings: dict) -> None:
+        with self._lock:
+            for drone_id, reading in readings.items():
+                # Unless a later flush is writing a newer reading
+                if self._inflight.get(drone_id) is reading:
+                    del self._inflight[drone_id]
+
+    def _merge(self, latest: dict) -> None:
+        for drone_id, reading in latest.items():
+            buffered = self._pending.get(drone_id)
+
+            if buffered is None or reading.timestamp > buffered.timestamp:
+                self._pending[drone_id] = reading
+
+    def _start(self) -> None:
+        if self._thread is not None or self.flush_interval is None:
+            return
+
+        with self._lock:
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._run, name='battery-write-buffer', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_battery_buffer():
+    """
+    Buffer of the battery telemetry, None if the setting "BATTERY_WRITE_BEHIND" disables it
+    """
+    global _buffer
+
+    config = settings.BATTERY_WRITE_BEHIND
+
+    if not config['ENABLED']:
+        return None
+
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = BatteryWriteBuffer(flush_interval=config['FLUSH_INTERVAL'], max_pending=config['MAX_PENDING'])
+                # Drain the buffer when the process exits
+                atexit.register(_buffer.close)
+
+    return _buffer
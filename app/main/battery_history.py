@@ -0,0 +1,269 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, ExpressionWrapper, F, FloatField, Max, Min, Sum
+from django.db.models.functions import TruncHour, TruncMinute
+from django.utils import timezone
+
+from .models import BatteryReading, BatteryRollup
+
+RESOLUTION_RAW = 'RAW'
+
+RESOLUTION_CHOICES = (
+    (RESOLUTION_RAW, 'Raw'),
+    *BatteryRollup.RESOLUTION_CHOICES,
+)
+
+TRUNC_FUNCTIONS = {
+    BatteryRollup.RESOLUTION_MINUTE: TruncMinute,
+    BatteryRollup.RESOLUTION_HOUR: TruncHour,
+}
+
+# Number of rows written by statement
+BATCH_SIZE = 500
+
+
+def record_battery_readings(readings: list) -> None:
+    """
+    Append battery readings to the history.
+
+        Parameters:
+            readings (list): Tuples of drone ID, timestamp and battery capacity
+    """
+    BatteryReading.objects.bulk_create(
+        [
+            BatteryReading(drone_id=drone_id, ts=ts, battery_capacity=battery_capacity)
+            for drone_id, ts, battery_capacity in readings
+        ],
+        batch_size=BATCH_SIZE
+    )
+
+
+def _combine(bucket: tuple, other: tuple) -> tuple:
+    """
+    Combine two buckets (min, avg, max, count) in a single one
+    """
+    count = bucket[3] + other[3]
+
+    return (
+        min(bucket[0], other[0]),
+        (bucket[1] * bucket[3] + other[1] * other[3]) / count,
+        max(bucket[2], other[2]),
+        count,
+    )
+
+
+def _raw_buckets(queryset, resolution: str):
+    """
+    Downsample raw readings to buckets of the resolution, computed by the database
+    """
+    return queryset.annotate(
+        bucket=TRUNC_FUNCTIONS[resolution]('ts')
+    ).order_by().values('drone_id', 'bucket').annotate(
+        min_value=Min('battery_capacity'),
+        avg_value=Avg('battery_capacity'),
+        max_value=Max('battery_capacity'),
+        count=Count('id'),
+    ).values_list('drone_id', 'bucket', 'min_value', 'avg_value', 'max_value', 'count')
+
+
+def _rollup_buckets(queryset, resolution: str):
+    """
+    Downsample rollups of a finer resolution to buckets of the resolution, computed by the database
+    """
+    return queryset.annotate(
+        target_bucket=TRUNC_FUNCTIONS[resolution]('bucket'),
+        weighted_sum=ExpressionWrapper(F('avg_battery_capacity') * F('count'), output_field=FloatField()),
+    ).order_by().values('drone_id', 'target_bucket').annotate(
+        min_value=Min('min_battery_capacity'),
+        avg_value=ExpressionWrapper(Sum('weighted_sum') / Sum('count'), output_field=FloatField()),
+        max_value=Max('max_battery_capacity'),
+        total=Sum('count'),
+    ).values_list('drone_id', 'target_bucket', 'min_value', 'avg_value', 'max_value', 'total')
+
+
+def _write_rollups(resolution: str, rows: list) -> None:
+    """
+    Insert the buckets (drone ID, bucket, min, avg, max, count), merged with the existing ones
+    """
+    existing = BatteryRollup.objects.filter(
+        resolution=resolution,
+        drone_id__in={row[0] for row in rows},
+        bucket__gte=min(row[1] for row in rows),
+        bucket__lte=max(row[1] for row in rows),
+    ).values_list('drone_id', 'bucket', 'min_battery_capacity', 'avg_battery_capacity', 'max_battery_capacity', 'count')
+
+    buckets = {(drone_id, bucket): values for drone_id, bucket, *values in existing}
+
+    for drone_id, bucket, *values in rows:
+        key = (drone_id, bucket)
+        buckets[key] = _combine(buckets[key], values) if key in buckets else tuple(values)
+
+    BatteryRollup.objects.bulk_create(
+        [
+            BatteryRollup(
+                drone_id=drone_id,
+                resolution=resolution,
+                bucket=bucket,
+                min_battery_capacity=min_value,
+                avg_battery_capacity=avg_value,
+                max_battery_capacity=max_value,
+                count=count
+            )
+            for (drone_id, bucket), (min_value, avg_value, max_value, count) in buckets.items()
+        ],
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['drone', 'resolution', 'bucket'],
+        update_fields=['min_battery_capacity', 'avg_battery_capacity', 'max_battery_capacity', 'count'],
+    )
+
+
+def _rollup(source_queryset, downsample, resolution: str) -> int:
+    """
+    Write the buckets of the source rows to the rollups of the resolution and delete the source rows
+
+        Parameters:
+            source_queryset (QuerySet): Rows to downsample
+            downsample (function): "_raw_buckets" or "_rollup_buckets"
+            resolution (str): Resolution of the buckets
+
+        Returns:
+            int: Number of written buckets
+    """
+    written = 0
+
+    with transaction.atomic():
+        # Only the rows up to the last one present now are downsampled and deleted, the rows written
+        # meanwhile (late readings) are kept for the next run
+        last_pk = source_queryset.aggregate(last_pk=Max('pk'))['last_pk']
+
+        if last_pk is None:
+            return 0
+
+        source_queryset = source_queryset.filter(pk__lte=last_pk)
+        buckets = downsample(source_queryset, resolution)
+        batch = []
+
+        for row in buckets.iterator(chunk_size=BATCH_SIZE):
+            batch.append(row)
+
+            if len(batch) >= BATCH_SIZE:
+                _write_rollups(resolution, batch)
+                written += len(batch)
+                batch = []
+
+        if batch:
+            _write_rollups(resolution, batch)
+            written += len(batch)
+
+        source_queryset.delete()
+
+    return written
+
+
+def rollup_battery_history(now=None) -> dict:
+    """
+    Downsample the readings older than "RAW_RETENTION" to minute buckets, the minute buckets older
+    than "MINUTE_RETENTION" to hour buckets and delete the hour buckets older than "HOUR_RETENTION"
+    (setting "BATTERY_HISTORY").
+
+        Returns:
+            dict: Number of minute and hour buckets written, and hour buckets deleted
+    """
+    config = settings.BATTERY_HISTORY
+    now = now or timezone.now()
+
+    # Cutoffs aligned to the bucket start, so a bucket is never split between two runs
+    raw_cutoff = (now - config['RAW_RETENTION']).replace(second=0, microsecond=0)
+    minute_cutoff = (now - config['MINUTE_RETENTION']).replace(minute=0, second=0, microsecond=0)
+    hour_cutoff = now - config['HOUR_RETENTION']
+
+    old_readings = BatteryReading.objects.filter(ts__lt=raw_cutoff)
+    minute_buckets = _rollup(old_readings, _raw_buckets, BatteryRollup.RESOLUTION_MINUTE)
+
+    old_minute_rollups = BatteryRollup.objects.filter(resolution=BatteryRollup.RESOLUTION_MINUTE, bucket__lt=minute_cutoff)
+    hour_buckets = _rollup(old_minute_rollups, _rollup_buckets, BatteryRollup.RESOLUTION_HOUR)
+
+    deleted, _ = BatteryRollup.objects.filter(resolution=BatteryRollup.RESOLUTION_HOUR, bucket__lt=hour_cutoff).delete()
+
+    return {'minute_buckets': minute_buckets, 'hour_buckets': hour_buckets, 'deleted_hour_buckets': deleted}
+
+
+def select_resolution(start, end, now=None) -> str:
+    """
+    The finest resolution still stored for the start of the window whose number of points
+    stays under "MAX_POINTS" (setting "BATTERY_HISTORY")
+    """
+    config = settings.BATTERY_HISTORY
+    now = now or timezone.now()
+    window = (end - start).total_seconds()
+
+    if start >= now - config['RAW_RETENTION'] and window <= config['RAW_MAX_WINDOW'].total_seconds():
+        return RESOLUTION_RAW
+
+    if start >= now - config['MINUTE_RETENTION'] and window / 60 <= config['MAX_POINTS']:
+        return BatteryRollup.RESOLUTION_MINUTE
+
+    return BatteryRollup.RESOLUTION_HOUR
+
+
+def _bucket_start(value, resolution: str):
+    """
+    Start of the bucket of the resolution containing a date/time, in the current time zone like
+    the truncations of the database
+    """
+    value = timezone.localtime(value)
+
+    if resolution == BatteryRollup.RESOLUTION_MINUTE:
+        return value.replace(second=0, microsecond=0)
+
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def get_battery_history(drone_id: int, start, end, resolution: str) -> list:
+    """
+    Battery history of a drone in the window [start, end).
+
+    For a rollup resolution the stored buckets are merged with the not yet downsampled data of the
+    window (raw readings, and minute buckets for the hour resolution), computed by the database.
+    The start is aligned down to the start of its bucket, so the bucket containing it is returned whole.
+
+        Returns:
+            list: Dicts with "ts" and "battery_capacity" for the raw resolution, or "bucket", "min",
+            "avg", "max" and "count" for the rollup resolutions
+    """
+    if resolution == RESOLUTION_RAW:
+        readings = BatteryReading.objects.filter(drone_id=drone_id, ts__gte=start, ts__lt=end).order_by('ts')
+        return [
+            {'ts': ts, 'battery_capacity': battery_capacity}
+            for ts, battery_capacity in readings.values_list('ts', 'battery_capacity')
+        ]
+
+    # A stored bucket starting before "start" still covers it
+    start = _bucket_start(start, resolution)
+
+    sources = [
+        _raw_buckets(BatteryReading.objects.filter(drone_id=drone_id, ts__gte=start, ts__lt=end), resolution),
+        BatteryRollup.objects.filter(
+            drone_id=drone_id, resolution=resolution, bucket__gte=start, bucket__lt=end
+        ).values_list('drone_id', 'bucket', 'min_battery_capacity', 'avg_battery_capacity', 'max_battery_capacity', 'count'),
+    ]
+
+    if resolution == BatteryRollup.RESOLUTION_HOUR:
+        sources.append(_rollup_buckets(
+            BatteryRollup.objects.filter(
+                drone_id=drone_id, resolution=BatteryRollup.RESOLUTION_MINUTE, bucket__gte=start, bucket__lt=end
+            ),
+            resolution
+        ))
+
+    buckets = {}
+
+    for source in sources:
+        for _, bucket, *values in source:
+            buckets[bucket] = _combine(buckets[bucket], values) if bucket in buckets else tuple(values)
+
+    return [
+        {'bucket': bucket, 'min': min_value, 'avg': avg_value, 'max': max_value, 'count': count}
+        for bucket, (min_value, avg_value, max_value, count) in sorted(buckets.items())
+    ]
@@ -0,0 +1,186 @@
+"""
+Conditional requests (ETag, Last-Modified) of the drones and medication items, derived from
+"updated_at" with cheap version queries instead of the serialization of the response.
+"""
+import hashlib
+from collections import namedtuple
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .battery_buffer import get_battery_buffer
+from .models import Drone, Medication
+
+Version = namedtuple('Version', ['etag', 'last_modified'])
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def _buffer_marker(model, pk=None) -> tuple:
+    """
+    Part of the version of the drones represented with the readings of the write-behind buffer, which
+    don't change "updated_at" until they are written
+    """
+    battery_buffer = get_battery_buffer()
+
+    if model is not Drone or battery_buffer is None:
+        return None, ()
+
+    if pk is None:
+        return None, (battery_buffer.received,)
+
+    reading = battery_buffer.get(pk)
+    return (reading.timestamp, (reading.timestamp.timestamp(),)) if reading is not None else (None, ())
+
+
+def query_variant(request) -> str:
+    """
+    Normalized query string of a read (filters, cursor, "fields", ...), so the responses to different
+    queries of the same rows get different versions. None without parameters.
+    """
+    if not request.GET:
+        return None
+
+    # Sorted by parameter, the order of the values of a parameter is kept
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    return hashlib.sha256(query.encode()).hexdigest()[:16]
+
+
+def make_version(model, key, updated_at, count=None, variant=None) -> Version:
+    """
+    Version of a row ("key" is its primary key) or a collection ("count" rows changed at most at "updated_at"),
+    for the query "variant" ("query_variant")
+    """
+    buffered_at, marker = _buffer_marker(model, key if count is None else None)
+    last_modified = max(filter(None, (updated_at, buffered_at)), default=None)
+    parts = [model._meta.model_name, key, count, updated_at.timestamp() if updated_at else 0, *marker, variant]
+    return Version(
+        quote_etag('-'.join(str(part) for part in parts if part is not None)),
+        int(last_modified.timestamp()) if last_modified else None
+    )
+
+
+def instance_version(queryset, pk, lock: bool = False, variant=None) -> Version:
+    """
+    Version of a row, None if it doesn't exist
+
+        Parameters:
+            queryset (QuerySet): Rows of the model
+            pk: Primary key of the row
+            lock (bool): Lock the row until the end of the transaction (writes)
+            variant (str): Query of the read ("query_variant")
+    """
+    if lock:
+        queryset = queryset.select_for_update()
+
+    try:
+        updated_at = queryset.filter(pk=pk).values_list('updated_at', flat=True).first()
+    except (TypeError, ValueError):
+        # Malformed primary key, the view responds "404 Not Found"
+        return None
+
+    return make_version(queryset.model, pk, updated_at, variant=variant) if updated_at is not None else None
+
+
+async def ainstance_version(queryset, pk, variant=None) -> Version:
+    updated_at = await queryset.filter(pk=pk).values_list('updated_at', flat=True).afirst()
+    return make_version(queryset.model, pk, updated_at, variant=variant) if updated_at is not None else None
+
+
+def collection_version(queryset, key='all', variant=None) -> Version:
+    """
+    Version of the rows of the queryset, from the last "updated_at" and the number of rows (deletes).
+    The filters of the query ("variant") aren't applied: any change of the rows changes the version.
+    """
+    aggregate = queryset.aggregate(updated_at=Max('updated_at'), count=Count('pk'))
+    return make_version(queryset.model, key, aggregate['updated_at'], aggregate['count'], variant)
+
+
+async def acollection_version(queryset, key='all', variant=None) -> Version:
+    aggregate = await queryset.aaggregate(updated_at=Max('updated_at'), count=Count('pk'))
+    return make_version(queryset.model, key, aggregate['updated_at'], aggregate['count'], variant)
+
+
+def set_version_headers(response, version: Version):
+    """
+    Set the headers "ETag" and "Last-Modified" of a successful response
+    """
+    if version is not None and 200 <= response.status_code < 300:
+        response.headers['ETag'] = version.etag
+
+        if version.last_modified is not None:
+            response.headers['Last-Modified'] = http_date(version.last_modified)
+
+    return response
+
+
+def conditional_response(request, version: Version):
+    """
+    Response "304 Not Modified" or "412 Precondition Failed" of the conditional request, None to process it
+    """
+    if version is None:
+        return None
+
+    return get_conditional_response(request, etag=version.etag, last_modified=version.last_modified)
+
+
+def conditional(version_func):
+    """
+    Make conditional the requests of a viewset method. The safe ones get "304 Not Modified" when the
+    version hasn't changed, the writes are processed in a transaction holding the version ("If-Match")
+    and get "412 Precondition Failed" when it has changed.
+
+        Parameters:
+            version_func: Version of the resource, called as version_func(viewset, lock, **kwargs)
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method in SAFE_METHODS:
+                version = version_func(self, False, **kwargs)
+                response = conditional_response(request, version)
+                return response or set_version_headers(method(self, request, *args, **kwargs), version)
+
+            with transaction.atomic():
+                response = conditional_response(request, version_func(self, True, **kwargs))
+
+                if response is not None:
+                    return response
+
+                response = method(self, request, *args, **kwargs)
+
+            return set_version_headers(response, version_func(self, False, **kwargs))
+
+        return wrapper
+
+    return decorator
+
+
+def detail_version(viewset, lock: bool, pk=None, **kwargs) -> Version:
+    # The writes hold the version of the row whatever their query, the reads depend on it (e.g. "fields")
+    return instance_version(viewset.get_queryset(), pk, lock, None if lock else query_variant(viewset.request))
+
+
+def list_version(viewset, lock: bool, **kwargs) -> Version:
+    return collection_version(viewset.get_queryset(), variant=query_variant(viewset.request))
+
+
+def loaded_medication_items_version(viewset, lock: bool, pk=None, **kwargs) -> Version:
+    """
+    Version of the medication items loaded in a drone, None if the drone doesn't exist
+    """
+    try:
+        version = collection_version(
+            Medication.objects.filter(drone_id=pk), f'drone{pk}', query_variant(viewset.request)
+        )
+
+        if version.last_modified is None and not Drone.objects.filter(pk=pk).exists():
+            return None
+    except (TypeError, ValueError):
+        return None
+
+    return version
@@ -0,0 +1,234 @@
+"""
+Continuous dispatch of the pending (unassigned) medication items to the drones as they become
+eligible for load, by priority, age and weight.
+"""
+import heapq
+import logging
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db.models import Max
+
+from .exceptions import AppBaseException
+from .models import Drone, Medication
+from .planner import LoadPlan, apply_load_plan
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """
+    Keep the pending medication items in a priority heap, refreshed incrementally from "updated_at",
+    and assign them every cycle to the drones available for load, indexed by free capacity. Every
+    drone is loaded in its own small transaction.
+
+    The items heavier than the weight limit of every drone are moved to a dead letter map, out of the
+    queue, until they change or a drone able to carry them is registered.
+    """
+
+    def __init__(self, max_items_per_transaction: int = None) -> None:
+        self.max_items_per_transaction = (
+            max_items_per_transaction or settings.DISPATCHER['MAX_ITEMS_PER_TRANSACTION']
+        )
+
+        # Heap of (-priority, created_at, -weight, ID), the outdated entries are skipped when popped
+        self._heap = []
+        self._pending = {}
+        self._dead_letter = {}
+        self._max_weight_limit = None
+        self._checkpoint = None
+
+        self.cycles = 0
+        self.assigned = 0
+        self.failed_transactions = 0
+        self.started_at = time.monotonic()
+        self.last_cycle = {}
+
+    @staticmethod
+    def _entry(pk: int, priority: int, created_at, weight: float) -> tuple:
+        return (-priority, created_at, -weight, pk)
+
+    def refresh(self) -> None:
+        """
+        Read the medication items changed since the previous refresh into the heap
+        """
+        items = Medication.objects.all()
+
+        if self._checkpoint is not None:
+            # The items saved before the checkpoint but committed after it are read by the overlap
+            items = items.filter(updated_at__gte=self._checkpoint - settings.DISPATCHER['CHECKPOINT_OVERLAP'])
+
+        # Before reading the items, the ones changed while reading are read again by the next refresh
+        checkpoint = Medication.objects.aggregate(updated_at=Max('updated_at'))['updated_at']
+
+        for pk, priority, created_at, weight, drone_id in items.values_list(
+            'pk', 'priority', 'created_at', 'weight', 'drone_id'
+        ).iterator():
+            if drone_id is not None:
+                self._pending.pop(pk, None)
+                self._dead_letter.pop(pk, None)
+                continue
+
+            entry = self._entry(pk, priority, created_at, weight)
+
+            if self._dead_letter.get(pk) == entry:
+                continue
+
+            # Changed, it may fit now
+            self._dead_letter.pop(pk, None)
+
+            if self._pending.get(pk) != entry:
+                self._pending[pk] = entry
+                heapq.heappush(self._heap, entry)
+
+        self._checkpoint = checkpoint or self._checkpoint
+
+        # The deleted items are never read again, they are dropped once the database has less pending
+        # items than the dispatcher
+        if Medication.objects.filter(drone__isnull=True).count() < len(self._pending) + len(self._dead_letter):
+            self._drop_deleted()
+
+    def _drop_deleted(self) -> None:
+        pending_ids = set(Medication.objects.filter(drone__isnull=True).values_list('pk', flat=True).iterator())
+
+        for items in (self._pending, self._dead_letter):
+            for pk in [pk for pk in items if pk not in pending_ids]:
+                del items[pk]
+
+    def _refresh_max_weight_limit(self) -> None:
+        """
+        Queue again the dead letters fitting in a drone registered (or changed) since the previous cycle
+        """
+        max_weight_limit = Drone.objects.aggregate(max_weight_limit=Max('weight_limit'))['max_weight_limit']
+
+        if max_weight_limit is not None and (self._max_weight_limit is None or max_weight_limit > self._max_weight_limit):
+            for pk, entry in list(self._dead_letter.items()):
+                if -entry[2] <= max_weight_limit:
+                    del self._dead_letter[pk]
+                    self._pending[pk] = entry
+                    heapq.heappush(self._heap, entry)
+
+        self._max_weight_limit = max_weight_limit
+
+    def _drone_index(self) -> list:
+        """
+        Drones available for load as (free capacity, ID), sorted by free capacity
+        """
+        return sorted(
+            (free_capacity, pk) for pk, free_capacity in
+            Drone.objects.available_for_load().values_list('pk', 'free_capacity')
+        )
+
+    def _pop_pending(self):
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+
+            # Outdated entry, the item was loaded or changed its priority or weight
+            if self._pending.get(entry[3]) == entry:
+                return entry
+
+        return None
+
+    def _still_pending(self, entries: list) -> list:
+        pending_ids = set(Medication.objects.filter(
+            pk__in=[entry[3] for entry in entries], drone__isnull=True
+        ).values_list('pk', flat=True))
+
+        for entry in entries:
+            if entry[3] not in pending_ids:
+                self._pending.pop(entry[3], None)
+
+        return [entry for entry in entries if entry[3] in pending_ids]
+
+    def run_once(self) -> dict:
+        """
+        Refresh the pending items and assign them, by priority, to the drones with the smallest free
+        capacity still fitting them (best fit)
+
+            Returns:
+                dict: Metrics of the cycle
+        """
+        start = time.monotonic()
+        self.refresh()
+        self._refresh_max_weight_limit()
+
+        drones = self._drone_index()
+        assignments = {}
+        skipped = []
+
+        while drones:
+            entry = self._pop_pending()
+
+            if entry is None:
+                break
+
+            weight = -entry[2]
+            index = bisect_left(drones, (weight, -1))
+
+            if index == len(drones):
+                if self._max_weight_limit is not None and weight > self._max_weight_limit:
+                    # Never fits, out of the queue
+                    self._dead_letter[entry[3]] = self._pending.pop(entry[3])
+                    continue
+
+                # Too heavy for the drones available now, the lighter items can still be dispatched
+                skipped.append(entry)
+                continue
+
+            free_capacity, pk = drones.pop(index)
+            assignments.setdefault(pk, []).append(entry)
+
+            if len(assignments[pk]) < self.max_items_per_transaction and free_capacity - weight > 0:
+                insort(drones, (free_capacity - weight, pk))
+
+        assigned = 0
+        failed = 0
+
+        for pk, entries in assignments.items():
+            try:
+                apply_load_plan(LoadPlan({pk: [entry[3] for entry in entries]}, [], 1))
+            except AppBaseException as err:
+                # The drone or the items changed since they were read, the items still pending are
+                # retried in the next cycle
+                logger.info('Dispatch to drone %s failed: %s', pk, err.message)
+                failed += 1
+                skipped.extend(self._still_pending(entries))
+                continue
+
+            for entry in entries:
+                del self._pending[entry[3]]
+
+            assigned += len(entries)
+
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+
+        elapsed = time.monotonic() - start
+
+        self.cycles += 1
+        self.assigned += assigned
+        self.failed_transactions += failed
+        self.last_cycle = {
+            'assigned': assigned,
+            'drones_loaded': len(assignments) - failed,
+            'failed_transactions': failed,
+            'queue_depth': len(self._pending),
+            'dead_letter': len(self._dead_letter),
+            'seconds': elapsed,
+            'throughput': assigned / elapsed if elapsed else None,
+        }
+
+        return self.last_cycle
+
+    def stats(self) -> dict:
+        uptime = time.monotonic() - self.started_at
+
+        return {
+            'cycles': self.cycles,
+            'assigned': self.assigned,
+            'failed_transactions': self.failed_transactions,
+            'queue_depth': len(self._pending),
+            'dead_letter': len(self._dead_letter),
+            'throughput': self.assigned / uptime if uptime else None,
+        }
@@ -28,3 +28,11 @@ class DroneInvalidStateError(AppBaseException):
 
 class DroneBatteryTooLowError(AppBaseException):
     message = "The dron's battery is too low to fly."
+
+
+class LoadPlanOutdatedError(AppBaseException):
+    """
+    Exception if the drones or medication items of a load plan changed since it was computed.
+    """
+
+    message = "The load plan is outdated, the drones or medication items have changed."
@@ -0,0 +1,111 @@
+import csv
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+from .models import Drone, Medication
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+
+FORMAT_CHOICES = (
+    (FORMAT_NDJSON, 'NDJSON'),
+    (FORMAT_CSV, 'CSV'),
+)
+
+CONTENT_TYPES = {
+    FORMAT_NDJSON: 'application/x-ndjson',
+    FORMAT_CSV: 'text/csv',
+}
+
+DRONE_EXPORT_FIELDS = (
+    'id', 'serial_number', 'model', 'weight_limit', 'battery_capacity', 'state', 'current_weight',
+    'created_at', 'updated_at'
+)
+
+MEDICATION_EXPORT_FIELDS = (
+    'id', 'name', 'weight', 'code', 'priority', 'image', 'drone_id', 'created_at', 'updated_at'
+)
+
+
+class _Echo:
+    """
+    File-like object that returns the written value instead of buffering it, for "csv.writer"
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def drone_export_rows(chunk_size: int = None):
+    """
+    Stream the drones as tuples of "DRONE_EXPORT_FIELDS", without building model instances
+    """
+    return Drone.objects.order_by('id').annotate(
+        current_weight=F('payload_weight')
+    ).values_list(*DRONE_EXPORT_FIELDS).iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+
+
+def medication_export_rows(chunk_size: int = None):
+    """
+    Stream the medication items as tuples of "MEDICATION_EXPORT_FIELDS", without building model instances
+    """
+    return Medication.objects.order_by('id').values_list(
+        *MEDICATION_EXPORT_FIELDS
+    ).iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+
+
+def export_lines(rows, fields: tuple, export_format: str, chunk_size: int = None):
+    """
+    Encode the rows in NDJSON or CSV, yielding the lines grouped in chunks of "chunk_size" rows
+
+        Parameters:
+            rows (iterable): Tuples with the values of "fields"
+            fields (tuple): Names of the fields, CSV header and NDJSON keys
+            export_format (str): One of "FORMAT_CHOICES"
+            chunk_size (int): Number of rows encoded by chunk
+
+        Returns:
+            generator: Chunks of encoded lines
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+
+    if export_format == FORMAT_CSV:
+        writer = csv.writer(_Echo())
+        encode = writer.writerow
+        yield writer.writerow(fields)
+    else:
+        encoder = DjangoJSONEncoder()
+
+        def encode(row):
+            return encoder.encode(dict(zip(fields, row))) + '\n'
+
+    chunk = []
+
+    for row in rows:
+        chunk.append(encode(row))
+
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+
+    if chunk:
+        yield ''.join(chunk)
+
+
+EXPORTS = {
+    'drone': (drone_export_rows, DRONE_EXPORT_FIELDS),
+    'medication': (medication_export_rows, MEDICATION_EXPORT_FIELDS),
+}
+
+
+def export_table(table: str, export_format: str, chunk_size: int = None):
+    """
+    Stream a whole table ("drone" or "medication") encoded in NDJSON or CSV
+
+        Returns:
+            generator: Chunks of encoded lines
+    """
+    rows_function, fields = EXPORTS[table]
+    return export_lines(rows_function(chunk_size), fields, export_format, chunk_size)
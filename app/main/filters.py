@@ -0,0 +1,45 @@
+from django_filters import rest_framework as filters
+
+from .models import Drone, Medication
+
+
+class DroneFilter(filters.FilterSet):
+    """
+    Filters of the drones, served by the indexes of "Drone.Meta.indexes": the state and the model,
+    the serial number and the free capacity. The battery capacity range only uses the index of
+    (state, battery_capacity) together with the state filter, on its own the table is scanned.
+    """
+
+    state = filters.MultipleChoiceFilter(choices=Drone.STATE_CHOICES, help_text='One or more states')
+    model = filters.MultipleChoiceFilter(choices=Drone.MODEL_CHOICES, help_text='One or more models')
+    battery_capacity = filters.RangeFilter(help_text='Battery capacity range ("_min" and "_max")')
+    min_free_capacity = filters.NumberFilter(
+        method='filter_min_free_capacity',
+        help_text='Minimum weight (grams) the drone can still carry'
+    )
+
+    class Meta:
+        model = Drone
+        fields = ['serial_number', 'state', 'model', 'battery_capacity']
+
+    def filter_min_free_capacity(self, queryset, name, value):
+        return queryset.with_free_capacity().filter(free_capacity__gte=value)
+
+
+class MedicationFilter(filters.FilterSet):
+    """
+    Filters of the medication items, served by the index of the code ("Medication.Meta.indexes")
+    and the one of the drone (foreign key)
+    """
+
+    code = filters.CharFilter(help_text='Medication code')
+    code__in = filters.BaseInFilter(field_name='code', help_text='Medication codes separated by commas')
+    drone = filters.NumberFilter(field_name='drone_id', help_text='ID of the drone carrying the medication item')
+    loaded = filters.BooleanFilter(
+        field_name='drone', lookup_expr='isnull', exclude=True,
+        help_text='Only the medication items loaded (true) or pending (false)'
+    )
+
+    class Meta:
+        model = Medication
+        fields = ['code', 'drone']
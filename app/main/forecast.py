@@ -0,0 +1,145 @@
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, F, FloatField, Func, Sum, Value
+from django.utils import timezone
+
+from .models import BatteryReading
+
+BatteryForecast = namedtuple('BatteryForecast', ['drain_rate', 'time_to_threshold'])
+
+# Maximum number of drones filtered by ID when reading the battery history
+IN_CLAUSE_MAX_SIZE = 500
+
+
+class Epoch(Func):
+    """
+    Seconds since the Unix epoch of a date/time
+    """
+
+    template = 'EXTRACT(EPOCH FROM %(expressions)s)'
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Whole seconds of the text without the fraction, plus the fraction of the text: "julianday()" and
+        # "strftime('%f')" round to milliseconds (and "%s" doesn't round with them)
+        template = (
+            "(CAST(strftime('%%%%s', substr(%(expressions)s, 1, 19)) AS REAL)"
+            " + CAST(substr(%(expressions)s, 20) AS REAL))"
+        )
+        return self.as_sql(compiler, connection, template=template, **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='UNIX_TIMESTAMP(%(expressions)s)', **extra_context)
+
+
+def window_sums(now=None, group_by: tuple = ('drone_id',)):
+    """
+    Sums of the least squares fit of the battery readings of the last "WINDOW" by drone, computed by
+    the database: one row by drone instead of every reading. The time is relative to the start of
+    the window, to keep the squares small.
+
+        Returns:
+            QuerySet: Rows of "drone_id", "count", "sum_t", "sum_y", "sum_tt" and "sum_ty"
+    """
+    now = now or timezone.now()
+    start = now - settings.BATTERY_FORECAST['WINDOW']
+    t = Epoch('ts') - Value(start.timestamp())
+
+    return BatteryReading.objects.filter(ts__gte=start, ts__lte=now).values(*group_by).annotate(
+        count=Count('*'),
+        sum_t=Sum(t),
+        sum_y=Sum('battery_capacity'),
+        sum_tt=Sum(t * t),
+        sum_ty=Sum(t * F('battery_capacity')),
+    ).order_by()
+
+
+def fit_drain_rates(count, sum_t, sum_y, sum_tt, sum_ty):
+    """
+    Drain rates (percentage by second, positive while draining) from the sums of the readings of
+    every drone, NaN for the drones without enough readings
+    """
+    count = np.asarray(count, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = sum_ty - sum_t * sum_y / count
+        variance = sum_tt - sum_t * sum_t / count
+        slope = covariance / variance
+
+    valid = (count >= settings.BATTERY_FORECAST['MIN_READINGS']) & (variance > 0)
+
+    return np.where(valid, -slope, np.nan)
+
+
+def draining_before(min_seconds: float, now=None):
+    """
+    IDs of the drones predicted to reach the battery threshold in less than "min_seconds", as a
+    query to filter by in the database. The drain rate is -Ncov / D (with D > 0), so the time to
+    threshold "(battery - threshold) / drain rate" is compared without divisions.
+
+        Returns:
+            QuerySet: Values of "drone_id"
+    """
+    n = F('count')
+    covariance = n * F('sum_ty') - F('sum_t') * F('sum_y')
+    variance = n * F('sum_tt') - F('sum_t') * F('sum_t')
+    margin = F('drone__battery_capacity') - Value(float(settings.DRON_BATTERY_THRESHOLD))
+
+    return window_sums(now, group_by=('drone_id', 'drone__battery_capacity')).annotate(
+        covariance=covariance,
+        variance=variance,
+        overdue=margin * variance + Value(float(min_seconds)) * covariance,
+    ).filter(
+        count__gte=settings.BATTERY_FORECAST['MIN_READINGS'],
+        variance__gt=0,
+        covariance__lt=0,
+        overdue__lt=0,
+    ).values('drone_id')
+
+
+def forecast_battery(drones: dict, now=None) -> dict:
+    """
+    Predict when the drones will reach the battery threshold ("DRON_BATTERY_THRESHOLD"),
+    from the drain rate of their readings of the last "WINDOW" (setting "BATTERY_FORECAST"),
+    fit from the sums aggregated by the database ("window_sums").
+
+        Parameters:
+            drones (dict): Drone ID to its current battery capacity
+
+        Returns:
+            dict: Drone ID to its BatteryForecast, the time to threshold (seconds) is None
+            if the drone is not draining or there aren't enough readings
+    """
+    forecasts = dict.fromkeys(drones, BatteryForecast(None, None))
+    sums = window_sums(now)
+
+    # For a big part of the fleet it's cheaper to aggregate the whole window than a huge "IN" clause
+    if len(drones) <= IN_CLAUSE_MAX_SIZE:
+        sums = sums.filter(drone_id__in=list(drones))
+
+    rows = list(sums.values_list('drone_id', 'count', 'sum_t', 'sum_y', 'sum_tt', 'sum_ty'))
+
+    if not rows:
+        return forecasts
+
+    columns = np.array([row[1:] for row in rows], dtype=np.float64)
+    unique_ids = np.array([row[0] for row in rows])
+    drain_rates = fit_drain_rates(*columns.T)
+
+    current = np.array([drones.get(drone_id, np.nan) for drone_id in unique_ids.tolist()], dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        times = np.maximum(current - settings.DRON_BATTERY_THRESHOLD, 0) / drain_rates
+
+    for drone_id, drain_rate, time_to_threshold in zip(unique_ids.tolist(), drain_rates.tolist(), times.tolist()):
+        if drone_id not in forecasts or np.isnan(drain_rate):
+            continue
+
+        forecasts[drone_id] = BatteryForecast(
+            drain_rate,
+            time_to_threshold if drain_rate > 0 else None
+        )
+
+    return forecasts
@@ -0,0 +1,136 @@
+"""
+Generation of the variants (thumbnails, web optimized) of the medication images.
+
+The variants are generated by a pool of processes, off the request path. The worker processes
+import this module without Django set up and only run "generate_image_variants" (Pillow and the
+file system), so the module must not import the models: the functions of the server process get
+the storage of the images from the caller, and importing the database connections needs no setup.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_name(name: str, variant: str, image_format: str) -> str:
+    """
+    Name of a variant, next to the original image: "uploads/x.png" -> "uploads/x.thumbnail.webp"
+    """
+    root, _ = os.path.splitext(name)
+    return f'{root}.{variant}.{EXTENSIONS[image_format]}'
+
+
+def image_variant_names(name: str) -> dict:
+    """
+    Names of all the variants of an image, generated or not, from the setting "MEDICATION_IMAGE_VARIANTS"
+    """
+    return {
+        variant: variant_name(name, variant, config['FORMAT'])
+        for variant, config in settings.MEDICATION_IMAGE_VARIANTS.items()
+    }
+
+
+def generate_image_variants(path: str, name: str, variants: dict) -> dict:
+    """
+    Generate the variants of an image, executed by the worker processes.
+
+        Parameters:
+            path (str): Path of the original image on disk
+            name (str): Name of the original image on the storage
+            variants (dict): Variant name to its "SIZE", "FORMAT" and "QUALITY"
+
+        Returns:
+            dict: Variant name to the storage name of the generated image
+    """
+    generated = {}
+
+    with Image.open(path) as original:
+        largest_size = max((config['SIZE'] for config in variants.values()), key=lambda size: size[0] * size[1])
+        # Let the JPEG decoder downscale while decoding, much faster for big photos
+        original.draft('RGB', largest_size)
+        original = ImageOps.exif_transpose(original)
+
+        for variant, config in variants.items():
+            image = original.copy()
+            image.thumbnail(config['SIZE'])
+
+            if config['FORMAT'] == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+
+            generated_name = variant_name(name, variant, config['FORMAT'])
+            generated_path = variant_name(path, variant, config['FORMAT'])
+
+            # Written to a temporary file first, so a half written variant is never served
+            temporary_path = f'{generated_path}.tmp'
+            image.save(temporary_path, config['FORMAT'], quality=config['QUALITY'], optimize=True)
+            os.replace(temporary_path, generated_path)
+
+            generated[variant] = generated_name
+
+    return generated
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=settings.MEDICATION_IMAGE_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+
+    return _executor
+
+
+def _run_callback(callback, future) -> None:
+    try:
+        callback(future.result())
+    except Exception:
+        logger.exception('Failed to generate the variants of an image')
+    finally:
+        # The callback runs in a thread of the pool, with its own database connection
+        connections.close_all()
+
+
+def schedule_image_variants(storage, name: str, callback) -> None:
+    """
+    Generate the variants of an image in the pool of processes and call "callback" with them
+    ("generate_image_variants" result). If the setting "MEDICATION_IMAGE_WORKERS" is 0, they are
+    generated right away in the current thread.
+
+        Parameters:
+            storage (Storage): Storage of the image, on the local file system
+            name (str): Name of the image on the storage
+            callback: Function called with the generated variants
+    """
+    args = (storage.path(name), name, settings.MEDICATION_IMAGE_VARIANTS)
+
+    if not settings.MEDICATION_IMAGE_WORKERS:
+        callback(generate_image_variants(*args))
+        return
+
+    future = _get_executor().submit(generate_image_variants, *args)
+    future.add_done_callback(lambda future: _run_callback(callback, future))
+
+
+def delete_image_variants(storage, variants: dict) -> None:
+    for name in variants.values():
+        storage.delete(name)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the statistics of the query planner (ANALYZE). Without them SQLite doesn\'t use the free '
+        'capacity index for the best-fit lookups, run it after loading the drones and periodically'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f'ANALYZE is not supported for the "{connection.vendor}" database')
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        self.stdout.write(self.style.SUCCESS('The statistics of the database were refreshed'))
@@ -0,0 +1,106 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from main.models import Drone, Medication
+from main.row_serializers import DroneRowSerializer, MedicationRowSerializer
+from main.serializers import DroneSerializer, MedicationSerializer
+
+TABLES = {
+    'drone': (Drone, DroneSerializer, DroneRowSerializer),
+    'medication': (Medication, MedicationSerializer, MedicationRowSerializer),
+}
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the list serialization of the model serializers with the row serializers of the '
+        '"values()" rows, checking both render the same JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', choices=TABLES, action='append', default=None,
+                            help='Table to benchmark, all of them by default (can be repeated)')
+        parser.add_argument('--rows', type=int, default=0,
+                            help='Temporary rows added to every table, rolled back at the end')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of every serializer, the best one is taken')
+        parser.add_argument('--fields', default=None, help='Sparse fieldset, like the "fields" parameter')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['rows']:
+                    self.create_rows(options['rows'])
+
+                for table in options['table'] or TABLES:
+                    self.benchmark(table, options['repeat'], options['fields'])
+
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def create_rows(self, rows: int) -> None:
+        drones = Drone.objects.bulk_create(
+            Drone(serial_number=f'BENCHMARK-{i}', model=Drone.MODEL_HEAVYWEIGHT, weight_limit=500,
+                  battery_capacity=100)
+            for i in range(rows)
+        )
+        Medication.objects.bulk_create(
+            Medication(name=f'BENCHMARK-{i}', weight=10, code=f'BENCHMARK_{i}', drone=drones[i % len(drones)])
+            for i in range(rows)
+        )
+
+    def benchmark(self, table: str, repeat: int, fields: str) -> None:
+        model, serializer_class, row_serializer_class = TABLES[table]
+        query = {'fields': fields} if fields else {}
+        request = Request(RequestFactory().get('/', query))
+        context = {'request': request}
+
+        try:
+            field_names = list(serializer_class(context=context).fields)
+        except ValidationError as err:
+            raise CommandError(err.detail['fields'])
+
+        if not row_serializer_class.supports(field_names):
+            raise CommandError(f'The row serializer of "{table}" doesn\'t support the fields')
+
+        queryset = model.objects.order_by('pk')
+        row_serializer = row_serializer_class(field_names, context)
+
+        def model_serializer():
+            return serializer_class(queryset.all(), many=True, context=context).data
+
+        def row_serializer_data():
+            return row_serializer.to_representation(queryset.values(*row_serializer.columns))
+
+        model_seconds, model_data = self.best_time(model_serializer, repeat)
+        row_seconds, row_data = self.best_time(row_serializer_data, repeat)
+
+        if JSONRenderer().render(model_data) != JSONRenderer().render(row_data):
+            raise CommandError(f'The serializers of "{table}" render different JSON')
+
+        self.stdout.write(
+            f'{table:<10} {len(row_data):>7} rows  model {model_seconds * 1000:>9.2f} ms  '
+            f'rows {row_seconds * 1000:>9.2f} ms  {model_seconds / row_seconds if row_seconds else 0:>6.1f}x'
+        )
+
+    @staticmethod
+    def best_time(serialize, repeat: int):
+        best = None
+
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            data = serialize()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        return best, data
@@ -1,19 +1,87 @@
+import time
+
 from django.core.management.base import BaseCommand
 from django.conf import settings
+from django.db.models import Count, Q
 
 from main.models import Drone
+from main.notifications import (
+    LEVEL_CRITICAL,
+    LEVEL_LOW,
+    BatteryNotification,
+    NotificationDispatcher
+)
 
 
 class Command(BaseCommand):
     help = 'Check drones battery'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', type=float, metavar='SECONDS', help='Check the drones again every SECONDS')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Drones fetched from the database by round trip')
+
     def handle(self, *args, **options):
-        # Here we can send a notification to users by an email, sms, a whatsapp message, slack, telegram, etc.
-        # For now is only a console output
-        for drone in Drone.objects.all():
-            if drone.battery_capacity < settings.DRON_BATTERY_THRESHOLD:
-                self.stdout.write(self.style.WARNING(f'Drone {drone.serial_number} has low battery'))
-            elif drone.battery_capacity < (settings.DRON_BATTERY_THRESHOLD // 3):
-                self.stdout.write(self.style.ERROR(f'Drone {drone.serial_number} has critical battery'))
+        dispatcher = NotificationDispatcher.from_settings()
+        # Level notified by drone ID, a drone is notified again only when its level changes
+        self.notified = {}
+
+        try:
+            while True:
+                self.check(dispatcher, options)
+
+                if options['watch'] is None:
+                    break
+
+                time.sleep(options['watch'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dispatcher.close()
+
+        if dispatcher.failed:
+            self.stderr.write(self.style.ERROR(f'{dispatcher.failed} notifications could not be sent'))
+
+    def check(self, dispatcher: NotificationDispatcher, options: dict) -> None:
+        low_threshold = settings.DRON_BATTERY_THRESHOLD
+        critical_threshold = settings.DRON_BATTERY_THRESHOLD // 3
+
+        # Count all the drones by battery level in a single query
+        summary = Drone.objects.aggregate(
+            critical=Count('pk', filter=Q(battery_capacity__lt=critical_threshold)),
+            low=Count('pk', filter=Q(battery_capacity__gte=critical_threshold, battery_capacity__lt=low_threshold)),
+            enough=Count('pk', filter=Q(battery_capacity__gte=low_threshold)),
+        )
+
+        drones = Drone.objects.order_by('pk')
+
+        # The drones with enough battery are only listed on verbose output
+        if options['verbosity'] < 2:
+            drones = drones.filter(battery_capacity__lt=low_threshold)
+
+        drones = drones.values_list('pk', 'serial_number', 'battery_capacity').iterator(chunk_size=options['chunk_size'])
+
+        levels = {}
+
+        for pk, serial_number, battery_capacity in drones:
+            if battery_capacity < critical_threshold:
+                self.stdout.write(self.style.ERROR(f'Drone {serial_number} has critical battery'))
+                levels[pk] = LEVEL_CRITICAL
+            elif battery_capacity < low_threshold:
+                self.stdout.write(self.style.WARNING(f'Drone {serial_number} has low battery'))
+                levels[pk] = LEVEL_LOW
             else:
-                self.stdout.write(self.style.SUCCESS(f'Drone {drone.serial_number} has enough battery to fly'))
+                self.stdout.write(self.style.SUCCESS(f'Drone {serial_number} has enough battery to fly'))
+                continue
+
+            if self.notified.get(pk) != levels[pk]:
+                dispatcher.notify(BatteryNotification(pk, serial_number, battery_capacity, levels[pk]))
+
+        dispatcher.flush()
+
+        # The drones charged (or deleted) since the previous check are forgotten, notified again if they drop
+        self.notified = levels
+
+        self.stdout.write(
+            f"{summary['critical']} drones with critical battery, {summary['low']} with low battery, "
+            f"{summary['enough']} with enough battery to fly"
+        )
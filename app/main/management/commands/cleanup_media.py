@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.media_cleanup import process_media_cleanup, sweep_media_orphans
+
+
+class Command(BaseCommand):
+    help = 'Delete the queued media files of the deleted medication items, optionally sweeping the orphan files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Queued files processed per batch')
+        parser.add_argument(
+            '--watch', type=float, default=None, metavar='SECONDS',
+            help='Keep processing the queue every SECONDS seconds'
+        )
+        parser.add_argument(
+            '--sweep', action='store_true',
+            help='Also delete the files not used by any medication item (e.g. left by a crash)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only list the orphan files of the sweep')
+
+    def handle(self, *args, **options):
+        while True:
+            if not options['dry_run']:
+                deleted = process_media_cleanup(options['batch_size'])
+                self.stdout.write(self.style.SUCCESS(f'{deleted} queued files deleted'))
+
+            if options['sweep']:
+                orphans = sweep_media_orphans(dry_run=options['dry_run'])
+
+                for name in orphans:
+                    self.stdout.write(name, style_func=self.style.WARNING)
+
+                action = 'found' if options['dry_run'] else 'deleted'
+                self.stdout.write(self.style.SUCCESS(f'{len(orphans)} orphan files {action}'))
+
+            if options['watch'] is None:
+                return
+
+            time.sleep(options['watch'])
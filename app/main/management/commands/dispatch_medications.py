@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.dispatcher import Dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Continuously assign the pending medication items to the drones as they become eligible for load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single dispatch cycle')
+        parser.add_argument(
+            '--interval', type=float, default=None,
+            help='Seconds between the dispatch cycles, setting DISPATCHER["INTERVAL"] by default'
+        )
+        parser.add_argument(
+            '--max-items-per-transaction', type=int, default=None,
+            help='Items loaded into a drone by transaction'
+        )
+
+    def handle(self, *args, **options):
+        dispatcher = Dispatcher(options['max_items_per_transaction'])
+        interval = options['interval'] if options['interval'] is not None else settings.DISPATCHER['INTERVAL']
+
+        try:
+            while True:
+                cycle = dispatcher.run_once()
+
+                # Only the cycles doing something, or all of them with a higher verbosity
+                if cycle['assigned'] or cycle['failed_transactions'] or options['verbosity'] >= 2 or options['once']:
+                    self.stdout.write(
+                        f"{cycle['assigned']} items assigned to {cycle['drones_loaded']} drones "
+                        f"({cycle['failed_transactions']} failed transactions) in {cycle['seconds']:.3f} seconds, "
+                        f"{cycle['queue_depth']} items pending"
+                    )
+
+                if options['once']:
+                    return
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stats = dispatcher.stats()
+            self.stdout.write(self.style.SUCCESS(
+                f"{stats['assigned']} items assigned in {stats['cycles']} cycles "
+                f"({stats['throughput'] or 0:.1f} items/s), {stats['queue_depth']} items pending, "
+                f"{stats['dead_letter']} items too heavy for every drone"
+            ))
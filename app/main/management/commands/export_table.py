@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from main.exports import EXPORTS, FORMAT_CHOICES, FORMAT_NDJSON, export_table
+
+
+class Command(BaseCommand):
+    help = 'Export all the drones or medication items in NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=list(EXPORTS))
+        parser.add_argument('--format', dest='export_format', choices=[value for value, _ in FORMAT_CHOICES], default=FORMAT_NDJSON)
+        parser.add_argument('--output', help='Output file, by default the standard output')
+        parser.add_argument('--chunk-size', type=int, help='Rows fetched from the database by round trip')
+
+    def handle(self, *args, **options):
+        chunks = export_table(options['table'], options['export_format'], options['chunk_size'])
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,104 @@
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import AsyncRequestFactory, RequestFactory
+
+from main import async_views
+from main.models import Drone
+
+ENDPOINTS = {
+    'detail': ('/api/main/drone/{pk}/', async_views.drone_detail),
+    'get_battery': ('/api/main/drone/{pk}/get_battery/', async_views.drone_get_battery),
+    'get_loaded_medication_items': (
+        '/api/main/drone/{pk}/get_loaded_medication_items/', async_views.drone_get_loaded_medication_items
+    ),
+}
+
+
+def percentile(latencies: list, value: float) -> float:
+    """
+    Nearest-rank percentile of the sorted latencies
+    """
+    return latencies[max(math.ceil(value / 100 * len(latencies)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the requests/sec and p99 latency of the async read endpoints of the drones with the '
+        'sync (WSGI) views of the viewset, calling both in-process at the same concurrency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drone', type=int, default=None, help='Drone requested, the first one by default')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per endpoint and path')
+        parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight')
+        parser.add_argument(
+            '--endpoint', choices=ENDPOINTS, action='append', default=None,
+            help='Endpoint to test, all of them by default (can be repeated)'
+        )
+
+    def handle(self, *args, **options):
+        pk = options['drone'] or Drone.objects.order_by('pk').values_list('pk', flat=True).first()
+
+        if pk is None or not Drone.objects.filter(pk=pk).exists():
+            raise CommandError('There is no drone to request')
+
+        for endpoint in options['endpoint'] or ENDPOINTS:
+            url, async_view = ENDPOINTS[endpoint]
+            url = url.format(pk=pk)
+
+            for label, run in (('sync', self.run_sync), ('async', self.run_async)):
+                elapsed, latencies = run(url, async_view, pk, options['requests'], options['concurrency'])
+                latencies.sort()
+
+                self.stdout.write(
+                    f'{endpoint:<28} {label:<5} {len(latencies) / elapsed:>9.1f} req/s  '
+                    f'p50 {percentile(latencies, 50) * 1000:>7.2f} ms  p99 {percentile(latencies, 99) * 1000:>7.2f} ms'
+                )
+
+    def run_sync(self, url, async_view, pk, requests, concurrency):
+        """
+        Call the view of the viewset from a pool of threads, like a WSGI server
+        """
+        # The view of the viewset, the one serving the other methods of the same URL
+        view = async_view.sync_view
+        factory = RequestFactory()
+
+        def call(_):
+            start = time.perf_counter()
+            response = view(factory.get(url, HTTP_ACCEPT='application/json'), pk=pk)
+            response.render()
+            latency = time.perf_counter() - start
+            close_old_connections()
+            return latency
+
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = list(executor.map(call, range(requests)))
+
+        return time.perf_counter() - start, latencies
+
+    def run_async(self, url, async_view, pk, requests, concurrency):
+        """
+        Call the async view from an event loop, like an ASGI server
+        """
+        factory = AsyncRequestFactory()
+
+        async def call(semaphore):
+            async with semaphore:
+                start = time.perf_counter()
+                await async_view(factory.get(url, HTTP_ACCEPT='application/json'), pk=pk)
+                return time.perf_counter() - start
+
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(call(semaphore) for _ in range(requests)))
+
+        start = time.perf_counter()
+        latencies = list(asyncio.run(main()))
+        return time.perf_counter() - start, latencies
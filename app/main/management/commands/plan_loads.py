@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.exceptions import AppBaseException
+from main.planner import MODE_CHOICES, MODE_FIRST_FIT_DECREASING, apply_load_plan, plan_loads
+
+
+class Command(BaseCommand):
+    help = 'Plan the loads of the unassigned medication items into the available drones, minimizing the drones used'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode', choices=[mode for mode, _ in MODE_CHOICES], default=MODE_FIRST_FIT_DECREASING,
+            help='"ffd" (first-fit decreasing) or "exact" (branch and bound, small batches)'
+        )
+        parser.add_argument('--apply', action='store_true', help='Load the items into the drones')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        plan = plan_loads(mode=options['mode'])
+        elapsed = time.perf_counter() - start
+
+        if options['verbosity'] >= 2:
+            for pk, item_ids in plan.assignments.items():
+                self.stdout.write(f'Drone {pk}: {", ".join(str(item_id) for item_id in item_ids)}')
+
+        self.stdout.write(
+            f'{sum(len(item_ids) for item_ids in plan.assignments.values())} items planned into '
+            f'{len(plan.assignments)} drones ({plan.drones_used} drones used), '
+            f'{len(plan.unassigned)} items left out, in {elapsed:.3f} seconds'
+        )
+
+        if not options['apply']:
+            return
+
+        try:
+            apply_load_plan(plan)
+        except AppBaseException as err:
+            raise CommandError(err.message)
+
+        self.stdout.write(self.style.SUCCESS('The plan has been applied'))
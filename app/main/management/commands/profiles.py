@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.profiling import list_profiles, load_profile, summarize_profile
+
+SORT_CHOICES = ('cumulative', 'tottime', 'calls')
+
+
+class Command(BaseCommand):
+    help = 'List the stored profiles of the requests (setting "PROFILING"), or summarise one of them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', default=None, help='Profile to summarise')
+        parser.add_argument('--sort', choices=SORT_CHOICES, default='cumulative', help='Order of the functions')
+        parser.add_argument('--limit', type=int, default=25, help='Functions and SQL queries shown')
+        parser.add_argument('--slowest', action='store_true', help='List the profiles by duration, the slowest first')
+
+    def handle(self, *args, **options):
+        if options['profile_id'] is None:
+            self.list(options['slowest'], options['limit'] if options['slowest'] else None)
+        else:
+            self.summarize(options['profile_id'], options['sort'], options['limit'])
+
+    def list(self, slowest: bool, limit: int) -> None:
+        profiles = list_profiles()
+
+        if slowest:
+            profiles = sorted(profiles, key=lambda profile: profile['seconds'], reverse=True)[:limit]
+
+        for profile in profiles:
+            self.stdout.write(
+                f'{profile["id"]}  {profile["created_at"]}  {profile["status"]}  '
+                f'{profile["seconds"] * 1000:>9.2f} ms  {profile["query_count"]:>4} queries '
+                f'{profile["query_seconds"] * 1000:>9.2f} ms  {profile["method"]} {profile["path"]}'
+            )
+
+    def summarize(self, profile_id: str, sort: str, limit: int) -> None:
+        try:
+            profile = load_profile(profile_id)
+        except FileNotFoundError:
+            raise CommandError(f'There is no profile "{profile_id}"')
+
+        self.stdout.write(
+            f'{profile["method"]} {profile["path"]} ({profile["view"]}) -> {profile["status"]} '
+            f'in {profile["seconds"] * 1000:.2f} ms'
+        )
+        self.stdout.write(
+            f'{profile["query_count"]} SQL queries in {profile["query_seconds"] * 1000:.2f} ms, the slowest:'
+        )
+
+        for query in sorted(profile['queries'], key=lambda query: query['seconds'], reverse=True)[:limit]:
+            self.stdout.write(f'{query["seconds"] * 1000:>9.2f} ms  {query["sql"]}')
+
+        self.stdout.write(summarize_profile(profile_id, sort, limit))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from main.models import Drone
+
+
+class Command(BaseCommand):
+    help = 'Recompute from scratch the payload weight and items of the drones'
+
+    BATCH_SIZE = 500
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drones with a wrong payload')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drifted_drones = Drone.objects.annotate(
+                actual_weight=Sum('medications__weight', default=0.0),
+                actual_count=Count('medications'),
+            ).filter(
+                ~Q(payload_weight=F('actual_weight')) | ~Q(payload_count=F('actual_count'))
+            ).values_list('pk', 'serial_number')
+
+            drifted_drones = list(drifted_drones)
+
+            for _, serial_number in drifted_drones:
+                self.stdout.write(self.style.WARNING(f'Drone {serial_number} has a wrong payload'))
+
+            if not options['dry_run']:
+                drifted_ids = [pk for pk, _ in drifted_drones]
+
+                for i in range(0, len(drifted_ids), self.BATCH_SIZE):
+                    Drone.objects.filter(pk__in=drifted_ids[i:i + self.BATCH_SIZE]).recompute_payload()
+
+        self.stdout.write(self.style.SUCCESS(f'{len(drifted_drones)} drones with a wrong payload'))
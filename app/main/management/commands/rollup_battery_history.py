@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main.battery_history import rollup_battery_history
+
+
+class Command(BaseCommand):
+    help = 'Downsample the old battery readings to minute and hour buckets and apply the retention'
+
+    def handle(self, *args, **options):
+        result = rollup_battery_history()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['minute_buckets']} minute buckets and {result['hour_buckets']} hour buckets written, "
+            f"{result['deleted_hour_buckets']} expired hour buckets deleted"
+        ))
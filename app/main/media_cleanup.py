@@ -0,0 +1,246 @@
+import logging
+import os
+import posixpath
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from .images import delete_image_variants
+from .models import MediaCleanup, Medication
+
+logger = logging.getLogger(__name__)
+
+
+# Entries queued by the block of "batch_media_cleanup", None outside of it
+_batch = ContextVar('media_cleanup_batch', default=None)
+
+
+def queue_media_cleanup(name: str, variants: dict) -> None:
+    """
+    Queue the deletion of a media file and its variants. The entry is written in the current
+    transaction, so it's discarded if the transaction is rolled back, and the background
+    worker is woken up once the transaction is committed.
+    """
+    batch = _batch.get()
+
+    if batch is not None:
+        batch.append(MediaCleanup(name=name, variants=variants))
+        return
+
+    MediaCleanup.objects.create(name=name, variants=variants)
+
+    if settings.MEDIA_CLEANUP['BACKGROUND']:
+        transaction.on_commit(get_media_cleanup_worker().wake)
+
+
+@contextmanager
+def batch_media_cleanup():
+    """
+    Queue the media files of the block (e.g. a bulk delete of medication items) with a single
+    INSERT, in the same transaction as the block
+    """
+    if _batch.get() is not None:
+        yield
+        return
+
+    batch = []
+    token = _batch.set(batch)
+
+    try:
+        with transaction.atomic():
+            yield
+
+            if batch:
+                MediaCleanup.objects.bulk_create(batch, batch_size=settings.MEDIA_CLEANUP['BATCH_SIZE'])
+
+                if settings.MEDIA_CLEANUP['BACKGROUND']:
+                    transaction.on_commit(get_media_cleanup_worker().wake)
+    finally:
+        _batch.reset(token)
+
+
+def _check_names(names: set, storage) -> tuple:
+    """
+    Names referenced by a medication item, and names saved (or reused) too recently: the row
+    referencing them may not be committed yet
+    """
+    referenced = set(Medication.objects.filter(image__in=names).values_list('image', flat=True))
+    newest = time.time() - settings.MEDIA_CLEANUP['REUSE_GRACE_PERIOD'].total_seconds()
+    recent = set()
+
+    for name in names - referenced:
+        try:
+            if os.path.getmtime(storage.path(name)) > newest:
+                recent.add(name)
+        except FileNotFoundError:
+            pass
+
+    return referenced, recent
+
+
+def process_media_cleanup(batch_size: int = None) -> int:
+    """
+    Delete the queued media files in batches, except the ones used again by a medication item.
+    The references are checked under the lock of the storage, just before deleting, so an upload
+    of the same content can't reuse the file in the meantime. The files saved too recently stay
+    queued for a later run.
+
+        Returns:
+            int: Number of deleted files (without the variants)
+    """
+    batch_size = batch_size or settings.MEDIA_CLEANUP['BATCH_SIZE']
+    storage = Medication._meta.get_field('image').storage
+    deleted = 0
+    last_pk = 0
+
+    while True:
+        entries = list(
+            MediaCleanup.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'name', 'variants')[:batch_size]
+        )
+
+        if not entries:
+            return deleted
+
+        last_pk = entries[-1][0]
+        processed = []
+
+        with storage.lock():
+            # A single query for the whole batch, a file can be shared by many medication items
+            referenced, recent = _check_names({name for _, name, _ in entries}, storage)
+
+            for pk, name, variants in entries:
+                if name in recent:
+                    continue
+
+                processed.append(pk)
+
+                if name in referenced:
+                    continue
+
+                delete_image_variants(storage, variants)
+                storage.delete(name)
+                # Deleted once, even if queued many times in the batch
+                referenced.add(name)
+                deleted += 1
+
+        MediaCleanup.objects.filter(pk__in=processed).delete()
+
+
+def _file_root(name: str) -> str:
+    """
+    Name without the extensions, shared by an image and its variants: "uploads/x.png" and
+    "uploads/x.thumbnail.webp" -> "uploads/x"
+    """
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, filename.split('.', 1)[0])
+
+
+def _referenced_roots(roots: set) -> set:
+    """
+    Roots of the names used by a medication item, as image or as one of its variants
+    """
+    query = reduce(or_, (Q(image__startswith=f'{root}.') for root in roots))
+    return {_file_root(name) for name in Medication.objects.filter(query).values_list('image', flat=True)}
+
+
+def sweep_media_orphans(grace_period=None, dry_run: bool = False) -> list:
+    """
+    Reconcile the media directories of the medication images with the database, deleting the
+    files not used by any medication item and older than the grace period (uploads in progress).
+    Like "process_media_cleanup", the candidates are checked again in the database and on disk
+    under the lock of the storage, just before deleting, in batches.
+
+        Returns:
+            list: Names of the orphan files
+    """
+    grace_period = grace_period or settings.MEDIA_CLEANUP['ORPHAN_GRACE_PERIOD']
+    batch_size = settings.MEDIA_CLEANUP['BATCH_SIZE']
+    storage = Medication._meta.get_field('image').storage
+    oldest = time.time() - grace_period.total_seconds()
+
+    referenced = set()
+
+    for name, variants in Medication.objects.exclude(image='').values_list('image', 'image_variants').iterator():
+        referenced.add(name)
+        referenced.update(variants.values())
+
+    candidates = []
+
+    for directory in settings.MEDIA_CLEANUP['SWEEP_DIRECTORIES']:
+        for root, _, filenames in os.walk(storage.path(directory)):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+
+                if name in referenced or os.path.getmtime(path) > oldest:
+                    continue
+
+                candidates.append(name)
+
+    orphans = []
+
+    for i in range(0, len(candidates), batch_size):
+        batch = candidates[i:i + batch_size]
+
+        with storage.lock():
+            # Used (or reused, touching the file) since the files were listed
+            referenced_roots = _referenced_roots({_file_root(name) for name in batch})
+
+            for name in batch:
+                try:
+                    if _file_root(name) in referenced_roots or os.path.getmtime(storage.path(name)) > oldest:
+                        continue
+                except FileNotFoundError:
+                    continue
+
+                orphans.append(name)
+
+                if not dry_run:
+                    storage.delete(name)
+
+    return orphans
+
+
+class MediaCleanupWorker:
+    """
+    Background thread that processes the media cleanup queue when woken up
+    """
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def wake(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='media-cleanup', daemon=True)
+                self._thread.start()
+
+        self._event.set()
+
+    def _run(self) -> None:
+        while True:
+            self._event.wait()
+            self._event.clear()
+
+            try:
+                process_media_cleanup()
+            except Exception:
+                logger.exception('Failed to process the media cleanup queue')
+            finally:
+                close_old_connections()
+
+
+_worker = MediaCleanupWorker()
+
+
+def get_media_cleanup_worker() -> MediaCleanupWorker:
+    return _worker
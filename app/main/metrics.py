@@ -0,0 +1,316 @@
+"""
+Metrics of the process in the Prometheus text exposition format: latency, SQL queries and SQL time
+by view, and counters of the drones domain. The values are kept in memory, every worker process
+of the server exposes its own.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+
+from .exceptions import AppBaseException
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Label of the requests not matching any URL, the paths would make unbounded label values
+UNMATCHED_VIEW = '<unmatched>'
+
+_registry = []
+_collectors = []
+
+# Functions called with (SQL, seconds) for every query executed in the current context
+_sql_observers = ContextVar('sql_observers', default=())
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+
+    if extra:
+        labels.append(extra)
+
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Counter by label values, safe to increment from many threads
+
+        Parameters:
+            name (str): Name of the metric
+            documentation (str): Help of the metric
+            labelnames (tuple): Names of the labels
+    """
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def inc_on_commit(self, *labelvalues, amount: float = 1) -> None:
+        """
+        Increment once the current transaction is committed, nothing if it's rolled back
+        """
+        transaction.on_commit(lambda: self.inc(*labelvalues, amount=amount))
+
+    def value(self, *labelvalues) -> float:
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for labelvalues, value in values:
+            yield f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}'
+
+
+class Histogram:
+    """
+    Histogram by label values, with fixed upper bounds of the buckets
+
+        Parameters:
+            name (str): Name of the metric
+            documentation (str): Help of the metric
+            labelnames (tuple): Names of the labels
+            buckets (tuple): Sorted upper bounds of the buckets, "+Inf" is added
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *labelvalues) -> None:
+        # Only the bucket of the value is counted, the cumulative counts are computed on render
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            values = self._values.get(labelvalues)
+
+            if values is None:
+                values = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0]
+
+            values[0][index] += 1
+            values[1] += value
+
+    def count(self, *labelvalues) -> int:
+        with self._lock:
+            values = self._values.get(labelvalues)
+            return sum(values[0]) if values else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labelvalues, (list(counts), total)) for labelvalues, (counts, total) in self._values.items())
+
+        for labelvalues, (counts, total) in values:
+            cumulative = 0
+
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{_format_value(bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative}'
+
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+def register_collector(collect) -> None:
+    """
+    Register a function called on every render, returning the values read at that moment as
+    (name, type, documentation, value), e.g. the statistics kept by other modules
+    """
+    _collectors.append(collect)
+
+
+def render() -> str:
+    """
+    All the metrics in the Prometheus text exposition format
+    """
+    lines = []
+
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.samples())
+
+    for collect in _collectors:
+        for name, metric_type, documentation, value in collect():
+            if value is None:
+                continue
+
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.append(f'{name} {_format_value(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def observe_sql(observer):
+    """
+    Call "observer" with (SQL, seconds) for every query executed in the block, also from the
+    threads of "sync_to_async" (they run in a copy of the context)
+    """
+    token = _sql_observers.set((*_sql_observers.get(), observer))
+
+    try:
+        yield
+    finally:
+        _sql_observers.reset(token)
+
+
+def sql_execute_wrapper(execute, sql, params, many, context):
+    """
+    Execute wrapper of the database connections, installed on connection ("connection_created")
+    """
+    observers = _sql_observers.get()
+
+    if not observers:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+
+        for observer in observers:
+            observer(sql, elapsed)
+
+
+def install_sql_execute_wrapper(sender, connection, **kwargs) -> None:
+    # The signal is sent again when the connection is reopened
+    if sql_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_execute_wrapper)
+
+
+REQUESTS = Counter(
+    'drones_http_requests_total', 'Requests served, by view, method and status code', ('view', 'method', 'status')
+)
+REQUEST_DURATION = Histogram(
+    'drones_http_request_duration_seconds', 'Latency of the requests, by view and method', ('view', 'method'),
+    settings.METRICS['LATENCY_BUCKETS']
+)
+REQUEST_QUERIES = Histogram(
+    'drones_http_request_queries', 'SQL queries executed by request, by view and method', ('view', 'method'),
+    settings.METRICS['QUERY_COUNT_BUCKETS']
+)
+QUERY_DURATION = Counter(
+    'drones_db_query_duration_seconds_total', 'Time spent in SQL queries, by view and method', ('view', 'method')
+)
+STATE_TRANSITIONS = Counter(
+    'drones_state_transitions_total', 'Committed state transitions of the drones', ('from_state', 'to_state')
+)
+REJECTIONS = Counter(
+    'drones_rejections_total', 'Operations on the drones rejected, by operation and error', ('operation', 'error')
+)
+MEDICATION_ITEMS_LOADED = Counter(
+    'drones_medication_items_loaded_total', 'Committed loads of medication items into the drones'
+)
+
+
+def count_rejections(operation: str):
+    """
+    Decorator counting the application errors raised by an operation of the drones
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except AppBaseException as err:
+                REJECTIONS.inc(operation, type(err).__name__)
+                raise
+
+        return wrapper
+
+    return decorator
+
+
+class RequestQueries:
+    """
+    SQL observer counting the queries of a request and their time
+    """
+
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, sql: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+
+
+def record_request(request, response, queries: RequestQueries, elapsed: float) -> None:
+    """
+    Record the latency and the SQL queries of a request, by its resolved view
+    """
+    resolver_match = getattr(request, 'resolver_match', None)
+    view = resolver_match.view_name if resolver_match is not None else UNMATCHED_VIEW
+
+    REQUESTS.inc(view, request.method, str(response.status_code))
+    REQUEST_DURATION.observe(elapsed, view, request.method)
+    REQUEST_QUERIES.observe(queries.count, view, request.method)
+
+    if queries.seconds:
+        QUERY_DURATION.inc(view, request.method, amount=queries.seconds)
+
+
+def _collect_stats():
+    from . import response_cache
+    from .battery_buffer import get_battery_buffer
+
+    cache_stats = response_cache.stats()
+    yield 'drones_response_cache_hits_total', 'counter', 'Hits of the response cache', cache_stats['hits']
+    yield 'drones_response_cache_misses_total', 'counter', 'Misses of the response cache', cache_stats['misses']
+    yield (
+        'drones_response_cache_invalidations_total', 'counter', 'Invalidations of the response cache',
+        cache_stats['invalidations']
+    )
+
+    battery_buffer = get_battery_buffer()
+
+    if battery_buffer is not None:
+        buffer_stats = battery_buffer.stats()
+        yield 'drones_battery_buffer_pending', 'gauge', 'Drones with a buffered battery reading', buffer_stats['pending']
+        yield 'drones_battery_buffer_received_total', 'counter', 'Battery readings received', buffer_stats['received']
+        yield 'drones_battery_buffer_written_total', 'counter', 'Battery readings written', buffer_stats['written']
+        yield 'drones_battery_buffer_flushes_total', 'counter', 'Flushes of the battery buffer', buffer_stats['flushes']
+
+
+register_collector(_collect_stats)
@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from .metrics import RequestQueries, observe_sql, record_request
+from .profiling import aprofile_request, ashould_profile, profile_request, should_profile
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Record the latency and the SQL queries of every request (setting "METRICS"). The latency of the
+    streaming responses is measured until their first byte.
+    """
+    if not settings.METRICS['ENABLED']:
+        raise MiddlewareNotUsed()
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            queries = RequestQueries()
+            start = time.perf_counter()
+
+            with observe_sql(queries):
+                response = await get_response(request)
+
+            record_request(request, response, queries, time.perf_counter() - start)
+            return response
+    else:
+        def middleware(request):
+            queries = RequestQueries()
+            start = time.perf_counter()
+
+            with observe_sql(queries):
+                response = get_response(request)
+
+            record_request(request, response, queries, time.perf_counter() - start)
+            return response
+
+    return middleware
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """
+    Profile the requests asking for it, or sampled (setting "PROFILING"), the ID of the stored
+    profile is returned in the header "X-Profile-Id". Not installed at all when disabled.
+    """
+    if not settings.PROFILING['ENABLED']:
+        raise MiddlewareNotUsed()
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not await ashould_profile(request):
+                return await get_response(request)
+
+            response, profile_id = await aprofile_request(request, get_response)
+
+            if profile_id is not None:
+                response['X-Profile-Id'] = profile_id
+
+            return response
+    else:
+        def middleware(request):
+            if not should_profile(request):
+                return get_response(request)
+
+            response, profile_id = profile_request(request, get_response)
+            response['X-Profile-Id'] = profile_id
+            return response
+
+    return middleware
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:42
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def compute_drone_payload(apps, schema_editor):
+    Drone = apps.get_model('main', 'Drone')
+    Medication = apps.get_model('main', 'Medication')
+
+    totals = Medication.objects.filter(drone=OuterRef('pk')).order_by().values('drone')
+
+    Drone.objects.update(
+        payload_weight=Coalesce(
+            Subquery(totals.annotate(total=Sum('weight')).values('total')),
+            Value(0.0),
+            output_field=models.FloatField()
+        ),
+        payload_count=Coalesce(
+            Subquery(totals.annotate(total=Count('id')).values('total')),
+            Value(0),
+            output_field=models.PositiveIntegerField()
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_alter_medication_drone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drone',
+            name='payload_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Payload items'),
+        ),
+        migrations.AddField(
+            model_name='drone',
+            name='payload_weight',
+            field=models.FloatField(default=0, editable=False, verbose_name='Payload weight (grams)'),
+        ),
+        migrations.RunPython(compute_drone_payload, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_drone_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drone',
+            name='battery_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Battery reading date'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_drone_battery_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatteryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('MINUTE', 'Minute'), ('HOUR', 'Hour')], max_length=6)),
+                ('bucket', models.DateTimeField(verbose_name='Bucket start date')),
+                ('min_battery_capacity', models.FloatField()),
+                ('avg_battery_capacity', models.FloatField()),
+                ('max_battery_capacity', models.FloatField()),
+                ('count', models.PositiveIntegerField(verbose_name='Number of readings')),
+                ('drone', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='battery_rollups', to='main.drone')),
+            ],
+            options={
+                'verbose_name': 'battery rollup',
+                'verbose_name_plural': 'battery rollups',
+            },
+        ),
+        migrations.CreateModel(
+            name='BatteryReading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ts', models.DateTimeField(verbose_name='Reading date')),
+                ('battery_capacity', models.FloatField(verbose_name='Battery capacity (percentage)')),
+                ('drone', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='battery_readings', to='main.drone')),
+            ],
+            options={
+                'verbose_name': 'battery reading',
+                'verbose_name_plural': 'battery readings',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='batteryrollup',
+            index=models.Index(fields=['resolution', 'bucket'], name='main_batteryrollup_bucket'),
+        ),
+        migrations.AddConstraint(
+            model_name='batteryrollup',
+            constraint=models.UniqueConstraint(fields=('drone', 'resolution', 'bucket'), name='main_batteryrollup_unique_bucket'),
+        ),
+        migrations.AddIndex(
+            model_name='batteryreading',
+            index=models.Index(fields=['drone', 'ts'], name='main_batteryreading_drone_ts'),
+        ),
+        migrations.AddIndex(
+            model_name='batteryreading',
+            index=models.Index(fields=['ts'], name='main_batteryreading_ts'),
+        ),
+    ]
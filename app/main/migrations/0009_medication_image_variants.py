@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_battery_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medication',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
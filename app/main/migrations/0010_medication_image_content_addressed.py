@@ -0,0 +1,19 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:53
+
+from django.db import migrations, models
+import main.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_medication_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='medication',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, storage=main.storage.ContentAddressedStorage(), upload_to='uploads/medications/'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_medication_image_content_addressed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaCleanup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('variants', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'media cleanup',
+                'verbose_name_plural': 'media cleanups',
+            },
+        ),
+    ]
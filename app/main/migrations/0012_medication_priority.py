@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_media_cleanup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medication',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Dispatch priority, the highest first'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:04
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_medication_priority'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(django.db.models.expressions.CombinedExpression(models.F('weight_limit'), '-', models.F('payload_weight')), name='drone_free_capacity_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_drone_free_capacity_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='drone',
+            name='serial_number',
+            field=models.CharField(max_length=100, unique=True, verbose_name='Serial number'),
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(fields=['state', 'battery_capacity'], name='drone_state_battery_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(fields=['model', 'state'], name='drone_model_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(fields=['updated_at', 'id'], name='drone_updated_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medication',
+            index=models.Index(fields=['code'], name='medication_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medication',
+            index=models.Index(fields=['updated_at', 'id'], name='medication_updated_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def analyze(apps, schema_editor):
+    # The query planner picks the free capacity index only with the statistics of the tables, they
+    # are refreshed by the command "analyze_database" as the fleet grows
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('ANALYZE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(analyze, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,19 @@
+from collections import defaultdict
+
 from django.conf import settings
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.core.validators import (
     MaxValueValidator,
     MinValueValidator,
     RegexValidator
 )
 
+from .storage import ContentAddressedStorage
+from .response_cache import invalidate_all_drones, invalidate_drones
+from .metrics import MEDICATION_ITEMS_LOADED, STATE_TRANSITIONS, count_rejections
 from .exceptions import (
     WeightExceededError,
     DroneInvalidStateError,
@@ -21,6 +28,147 @@ class TimestampModel(models.Model):
         abstract = True
 
 
+def _invert_transitions(transitions: dict) -> dict:
+    """
+    Map every state to the states that can be followed by it
+    """
+    sources = defaultdict(set)
+
+    for source, targets in transitions.items():
+        for target in targets:
+            sources[target].add(source)
+
+    return {target: frozenset(states) for target, states in sources.items()}
+
+
+class DroneQuerySet(models.QuerySet):
+    """
+    Queryset with the fleet wide queries of the drones
+    """
+
+    def with_free_capacity(self) -> 'DroneQuerySet':
+        """
+        Annotate every drone with the weight it can still carry ("free_capacity")
+        """
+        return self.annotate(free_capacity=F('weight_limit') - F('payload_weight'))
+
+    def adjust_payload(self, weight: float, count: int) -> int:
+        """
+        Atomically add (or subtract, with negative values) weight and items to the payload of the drones.
+
+            Returns:
+                int: Number of updated drones
+        """
+        return self.update(
+            payload_weight=F('payload_weight') + weight,
+            payload_count=F('payload_count') + count,
+            updated_at=timezone.now()
+        )
+
+    def reserve_payload(self, weight: float, count: int) -> int:
+        """
+        Like "adjust_payload" but only for the drones that can still carry the extra weight,
+        the check and the update are done by a single conditional UPDATE.
+
+            Returns:
+                int: Number of updated drones
+        """
+        return self.filter(payload_weight__lte=F('weight_limit') - weight).adjust_payload(weight, count)
+
+    def recompute_payload(self) -> int:
+        """
+        Recompute from scratch the payload of the drones from their loaded medication items.
+
+            Returns:
+                int: Number of updated drones
+        """
+        totals = Medication.objects.filter(drone=OuterRef('pk')).order_by().values('drone')
+
+        updated = self.update(
+            payload_weight=Coalesce(
+                Subquery(totals.annotate(total=Sum('weight')).values('total')),
+                Value(0.0),
+                output_field=models.FloatField()
+            ),
+            payload_count=Coalesce(
+                Subquery(totals.annotate(total=Count('id')).values('total')),
+                Value(0),
+                output_field=models.PositiveIntegerField()
+            )
+        )
+
+        invalidate_all_drones()
+        return updated
+
+    def bulk_set_state(self, new_state: str) -> tuple:
+        """
+        Set a new state to many drones with a single UPDATE, the drones that can't follow
+        to the new state are skipped.
+
+            Parameters:
+                new_state (str): The new state of the drones
+
+            Returns:
+                tuple: List of updated drone IDs and dict of skipped drone IDs with the reason
+        """
+        sources = Drone.STATE_SOURCES[new_state]
+        skipped = {}
+
+        with transaction.atomic():
+            # Locks the rows where supported, on SQLite "select_for_update" is a no-op and the rows can change
+            # before the UPDATE: its predicate decides, the states read are only for the counters
+            states = dict(self.select_for_update().values_list('pk', 'state'))
+            updated_at = timezone.now()
+            queryset = Drone.objects.filter(pk__in=states, state__in=sources)
+
+            if new_state == Drone.STATE_LOADING:
+                queryset = queryset.filter(battery_capacity__gte=settings.DRON_BATTERY_THRESHOLD)
+
+            updated_ids = []
+
+            if queryset.update(state=new_state, updated_at=updated_at):
+                # The rows written by the UPDATE, a state is never a source of itself
+                updated_ids = list(
+                    Drone.objects.filter(pk__in=states, state=new_state, updated_at=updated_at)
+                    .values_list('pk', flat=True)
+                )
+                invalidate_drones(updated_ids)
+
+                for pk in updated_ids:
+                    STATE_TRANSITIONS.inc_on_commit(states[pk], new_state)
+
+            # The reason of the skipped drones, read after the UPDATE (drones deleted meanwhile have none)
+            not_updated = Drone.objects.filter(pk__in=states).exclude(pk__in=updated_ids)
+
+            for pk, state in not_updated.values_list('pk', 'state'):
+                if state not in sources:
+                    skipped[pk] = DroneInvalidStateError.message
+                else:
+                    skipped[pk] = DroneBatteryTooLowError.message
+
+        return updated_ids, skipped
+
+    def available_for_load(self, min_free_capacity: float = None) -> 'DroneQuerySet':
+        """
+        Drones that can be loaded: state IDLE or LOADING, enough battery and free capacity.
+
+            Parameters:
+                min_free_capacity (float): Optional minimum weight (grams) the drone must still be able to carry
+
+            Returns:
+                DroneQuerySet: Annotated queryset, evaluated in a single query
+        """
+        queryset = self.filter(
+            state__in=[Drone.STATE_IDLE, Drone.STATE_LOADING],
+            battery_capacity__gte=settings.DRON_BATTERY_THRESHOLD,
+        ).with_free_capacity().filter(free_capacity__gt=0)
+
+        if min_free_capacity is not None:
+            queryset = queryset.filter(free_capacity__gte=min_free_capacity)
+
+        return queryset
+
+
 class Drone(TimestampModel):
     """
     Drone model
@@ -54,7 +202,20 @@ class Drone(TimestampModel):
         (STATE_RETURNING, 'Returning'),
     )
 
-    serial_number = models.CharField('Serial number', max_length=100)
+    # Some kind of finite state machine to check the flow state of the drone
+    STATE_TRANSITIONS = {
+        STATE_IDLE: frozenset([STATE_LOADING]),
+        STATE_LOADING: frozenset([STATE_LOADED, STATE_IDLE]),
+        STATE_LOADED: frozenset([STATE_DELIVERING, STATE_LOADING, STATE_IDLE]),
+        STATE_DELIVERING: frozenset([STATE_DELIVERED, STATE_RETURNING]),
+        STATE_DELIVERED: frozenset([STATE_RETURNING]),
+        STATE_RETURNING: frozenset([STATE_IDLE]),
+    }
+
+    # Inverse of "STATE_TRANSITIONS", the states that can be followed by a state
+    STATE_SOURCES = _invert_transitions(STATE_TRANSITIONS)
+
+    serial_number = models.CharField('Serial number', max_length=100, unique=True)
     model = models.CharField(choices=MODEL_CHOICES, default=MODEL_LIGHTWEIGHT, max_length=2)
 
     weight_limit = models.FloatField(
@@ -77,33 +238,65 @@ class Drone(TimestampModel):
 
     state = models.CharField(choices=STATE_CHOICES, default=STATE_IDLE, max_length=10)
 
+    # Timestamp of the last battery reading sent by the drone, older readings are dropped
+    battery_updated_at = models.DateTimeField('Battery reading date', null=True, blank=True, editable=False)
+
+    # Denormalized weight and number of the loaded medication items, only written by atomic
+    # updates (see "DroneQuerySet.adjust_payload"), never from the in-memory instance
+    payload_weight = models.FloatField('Payload weight (grams)', default=0, editable=False)
+    payload_count = models.PositiveIntegerField('Payload items', default=0, editable=False)
+
+    PAYLOAD_FIELDS = ('payload_weight', 'payload_count')
+
+    LOAD_RESULT_LOADED = 'LOADED'
+    LOAD_RESULT_ALREADY_LOADED = 'ALREADY_LOADED'
+    LOAD_RESULT_NOT_FOUND = 'NOT_FOUND'
+
+    objects = DroneQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'drone'
         verbose_name_plural = 'drones'
+        indexes = [
+            # Remaining capacity, the "free_capacity" of "with_free_capacity", for the best-fit lookups
+            models.Index(F('weight_limit') - F('payload_weight'), name='drone_free_capacity_idx'),
+            # Availability for load (state and battery threshold)
+            models.Index(fields=['state', 'battery_capacity'], name='drone_state_battery_idx'),
+            models.Index(fields=['model', 'state'], name='drone_model_state_idx'),
+            # Listing of the drones changed since a checkpoint ("changed_since")
+            models.Index(fields=['updated_at', 'id'], name='drone_updated_at_id_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.serial_number
     
+    def save(self, *args, **kwargs) -> None:
+        # Never overwrite the payload of an existing drone with the in-memory values
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.PAYLOAD_FIELDS
+            ]
+
+        super().save(*args, **kwargs)
+
     @property
     def current_weight(self):
-        return self.medications.aggregate(Sum('weight'))['weight__sum'] or 0
+        return self.payload_weight
 
+    @count_rejections('set_state')
     def set_state(self, new_state: str) -> None:
         """
-        Set a valid new state for the drone 
-        """
-        # Some kind of finite state machine to check the flow state of the drone
-        fsm_transition_states = {
-            Drone.STATE_IDLE: [Drone.STATE_LOADING],
-            Drone.STATE_LOADING: [Drone.STATE_LOADED, Drone.STATE_IDLE],
-            Drone.STATE_LOADED: [Drone.STATE_DELIVERING, Drone.STATE_LOADING, Drone.STATE_IDLE],
-            Drone.STATE_DELIVERING: [Drone.STATE_DELIVERED, Drone.STATE_RETURNING],
-            Drone.STATE_DELIVERED: [Drone.STATE_RETURNING],
-            Drone.STATE_RETURNING: [Drone.STATE_IDLE]
-        }
+        Set a valid new state for the drone, only if the drone is still in the state
+        it had when it was read (compare-and-swap)
 
+            Exceptions:
+                DroneInvalidStateError: If the drone can't follow to the new state
+                DroneBatteryTooLowError: If the new state is LOADING and the battery is too low
+                Drone.DoesNotExist: If the drone was deleted since it was read
+        """
         # If the new state is not inside the valid states that can fallow the current state
-        if new_state not in fsm_transition_states.get(self.state):
+        if new_state not in Drone.STATE_TRANSITIONS[self.state]:
             # Don't let user change the state
             raise DroneInvalidStateError()
         
@@ -112,9 +305,31 @@ class Drone(TimestampModel):
             # Don't let user change the state
             raise DroneBatteryTooLowError()
 
+        queryset = Drone.objects.filter(pk=self.pk, state=self.state)
+
+        if new_state == Drone.STATE_LOADING:
+            queryset = queryset.filter(battery_capacity__gte=settings.DRON_BATTERY_THRESHOLD)
+
+        # Only the state and the modification date are written
+        updated_at = timezone.now()
+
+        if not queryset.update(state=new_state, updated_at=updated_at):
+            # Another writer changed the drone in the meantime
+            previous_state = self.state
+
+            self.refresh_from_db(fields=['state', 'battery_capacity', 'updated_at'])
+
+            if self.state == previous_state:
+                raise DroneBatteryTooLowError()
+
+            raise DroneInvalidStateError()
+
+        invalidate_drones([self.pk])
+        STATE_TRANSITIONS.inc_on_commit(self.state, new_state)
         self.state = new_state
-        self.save()
+        self.updated_at = updated_at
     
+    @count_rejections('load_medication_item')
     def load_medication_item(self, medication_item: 'Medication') -> None:
         """
         Load medication item to the drone, throw an exception in case of error.
@@ -133,11 +348,110 @@ class Drone(TimestampModel):
         if isinstance(medication_item, Medication) is False:
             raise TypeError('medication_item must be an instance of Medication model.')
 
-        if self.current_weight + medication_item.weight > self.weight_limit:
-            raise WeightExceededError()
+        with transaction.atomic():
+            while True:
+                if medication_item.drone_id == self.pk:
+                    return
+
+                previous_drone_id, weight = medication_item.drone_id, medication_item.weight
+                updated_at = timezone.now()
+
+                # Move the item only if it's still where it was read (compare-and-swap), a concurrent
+                # load of the same item can't account its weight twice
+                if Medication.objects.filter(pk=medication_item.pk, drone_id=previous_drone_id, weight=weight).update(
+                    drone=self, updated_at=updated_at
+                ):
+                    break
+
+                # Moved (or changed) by another writer in the meantime, try again from its current drone
+                medication_item.refresh_from_db(fields=['drone', 'weight', 'updated_at'])
+
+            # Check and reserve the weight in the same statement, two concurrent loads can't both pass the check
+            if not Drone.objects.filter(pk=self.pk).reserve_payload(weight, 1):
+                raise WeightExceededError()
+
+            if previous_drone_id is not None:
+                Drone.objects.filter(pk=previous_drone_id).adjust_payload(-weight, -1)
+
+            invalidate_drones([self.pk, previous_drone_id])
+            MEDICATION_ITEMS_LOADED.inc_on_commit()
 
         medication_item.drone = self
-        medication_item.save()
+        medication_item.updated_at = updated_at
+        # The payload is already accounted
+        medication_item._accounted_payload = (self.pk, weight)
+
+        self.refresh_from_db(fields=[*self.PAYLOAD_FIELDS, 'updated_at'])
+
+    @count_rejections('load_medication_items')
+    def load_medication_items(self, medication_item_ids: list) -> dict:
+        """
+        Load many medication items to the drone in a single transaction, all of them or none.
+
+            Parameters:
+                medication_item_ids (list): IDs of the medication items to load
+
+            Exceptions:
+                WeightExceededError: If the total weight of the medication items exceeds the maximum drone's weight
+
+            Returns:
+                dict: Result of every medication item ID, one of "LOAD_RESULT_*"
+        """
+
+        medication_item_ids = list(dict.fromkeys(medication_item_ids))
+        results = dict.fromkeys(medication_item_ids, Drone.LOAD_RESULT_NOT_FOUND)
+
+        with transaction.atomic():
+            medication_items = Medication.objects.select_for_update().filter(
+                pk__in=medication_item_ids
+            ).values_list('pk', 'weight', 'drone_id')
+
+            to_load = []
+            total_weight = 0
+            # Weight and number of items to release by the drones where the items are currently loaded
+            to_release = defaultdict(lambda: [0, 0])
+
+            for pk, weight, drone_id in medication_items:
+                if drone_id == self.pk:
+                    results[pk] = Drone.LOAD_RESULT_ALREADY_LOADED
+                    continue
+
+                results[pk] = Drone.LOAD_RESULT_LOADED
+                to_load.append(pk)
+                total_weight += weight
+
+                if drone_id is not None:
+                    to_release[drone_id][0] += weight
+                    to_release[drone_id][1] += 1
+
+            if not to_load:
+                return results
+
+            if not Drone.objects.filter(pk=self.pk).reserve_payload(total_weight, len(to_load)):
+                raise WeightExceededError()
+
+            for drone_id, (weight, count) in to_release.items():
+                Drone.objects.filter(pk=drone_id).adjust_payload(-weight, -count)
+
+            # The payload is already accounted, the bulk update doesn't send "post_save" signals
+            Medication.objects.filter(pk__in=to_load).update(drone=self, updated_at=timezone.now())
+            invalidate_drones([self.pk, *to_release])
+            MEDICATION_ITEMS_LOADED.inc_on_commit(amount=len(to_load))
+
+        self.refresh_from_db(fields=[*self.PAYLOAD_FIELDS, 'updated_at'])
+
+        return results
+
+
+class MedicationQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Delete the medication items, queuing the cleanup of their images with a single INSERT
+        """
+        from .media_cleanup import batch_media_cleanup
+
+        with batch_media_cleanup():
+            return super().delete()
 
 
 class Medication(TimestampModel):
@@ -154,12 +468,95 @@ class Medication(TimestampModel):
         validators=[RegexValidator(r'^[A-Z0-9\_]*$')],
         help_text='Only uppercase alphanumeric characters and underscores'
     )
-    image = models.ImageField(upload_to='uploads/medications/%Y/%m/%d/', blank=True)
+    # Stored by content hash, identical images are shared by the medication items
+    image = models.ImageField(
+        upload_to='uploads/medications/',
+        storage=ContentAddressedStorage(),
+        blank=True,
+        db_index=True
+    )
+    # Variant name ("thumbnail", "web", ...) to the name of the image on the storage, generated in background
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     drone = models.ForeignKey(Drone, on_delete=models.SET_NULL, null=True, blank=True, related_name='medications')
+    priority = models.PositiveSmallIntegerField(default=0, help_text='Dispatch priority, the highest first')
+
+    objects = MedicationQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'medication'
         verbose_name_plural = 'medications'
+        indexes = [
+            models.Index(fields=['code'], name='medication_code_idx'),
+            # Listing of the medication items changed since a checkpoint ("changed_since", dispatcher)
+            models.Index(fields=['updated_at', 'id'], name='medication_updated_at_id_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.name
+
+
+class BatteryReading(models.Model):
+    """
+    Battery level reported by a drone, append only
+    """
+
+    # Indexed by the composite index "(drone, ts)"
+    drone = models.ForeignKey(Drone, on_delete=models.CASCADE, related_name='battery_readings', db_index=False)
+    ts = models.DateTimeField('Reading date')
+    battery_capacity = models.FloatField('Battery capacity (percentage)')
+
+    class Meta:
+        verbose_name = 'battery reading'
+        verbose_name_plural = 'battery readings'
+        indexes = [
+            models.Index(fields=['drone', 'ts'], name='main_batteryreading_drone_ts'),
+            models.Index(fields=['ts'], name='main_batteryreading_ts'),
+        ]
+
+
+class BatteryRollup(models.Model):
+    """
+    Minimum, average and maximum battery level of a drone by minute or hour, downsampled from the readings
+    """
+
+    RESOLUTION_MINUTE = 'MINUTE'
+    RESOLUTION_HOUR = 'HOUR'
+
+    RESOLUTION_CHOICES = (
+        (RESOLUTION_MINUTE, 'Minute'),
+        (RESOLUTION_HOUR, 'Hour'),
+    )
+
+    # Indexed by the unique constraint "(drone, resolution, bucket)"
+    drone = models.ForeignKey(Drone, on_delete=models.CASCADE, related_name='battery_rollups', db_index=False)
+    resolution = models.CharField(choices=RESOLUTION_CHOICES, max_length=6)
+    bucket = models.DateTimeField('Bucket start date')
+    min_battery_capacity = models.FloatField()
+    avg_battery_capacity = models.FloatField()
+    max_battery_capacity = models.FloatField()
+    count = models.PositiveIntegerField('Number of readings')
+
+    class Meta:
+        verbose_name = 'battery rollup'
+        verbose_name_plural = 'battery rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['drone', 'resolution', 'bucket'], name='main_batteryrollup_unique_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'bucket'], name='main_batteryrollup_bucket'),
+        ]
+
+
+class MediaCleanup(models.Model):
+    """
+    Media file (and its variants) to delete once no medication item uses it anymore, queued
+    in the same transaction that deletes the medication item
+    """
+
+    name = models.CharField(max_length=255)
+    variants = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'media cleanup'
+        verbose_name_plural = 'media cleanups'
@@ -0,0 +1,150 @@
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+LEVEL_LOW = 'LOW'
+LEVEL_CRITICAL = 'CRITICAL'
+
+BatteryNotification = namedtuple('BatteryNotification', ['drone_id', 'serial_number', 'battery_capacity', 'level'])
+
+
+class BaseNotifier:
+    """
+    Base class of the battery notification backends, an email, sms, a whatsapp message, slack, telegram, etc.
+    """
+
+    def __init__(self, **options) -> None:
+        self.options = options
+
+    def send(self, notifications: list) -> None:
+        """
+        Send a batch of notifications, raise an exception in case of error so the batch is retried.
+
+            Parameters:
+                notifications (list): List of BatteryNotification
+        """
+        raise NotImplementedError('Subclasses of BaseNotifier must provide a send() method.')
+
+
+class LogNotifier(BaseNotifier):
+    """
+    Write the notifications to the "main.notifications" logger
+    """
+
+    def send(self, notifications: list) -> None:
+        for notification in notifications:
+            logger.warning(
+                'Drone %s has %s battery (%s%%)',
+                notification.serial_number, notification.level.lower(), notification.battery_capacity
+            )
+
+
+class FileNotifier(BaseNotifier):
+    """
+    Append the notifications as JSON lines to a local file ("PATH" option), useful for testing
+    """
+
+    _lock = threading.Lock()
+
+    def send(self, notifications: list) -> None:
+        lines = ''.join(json.dumps(notification._asdict()) + '\n' for notification in notifications)
+
+        with self._lock, open(self.options['PATH'], 'a') as output:
+            output.write(lines)
+
+
+def get_notifiers() -> list:
+    """
+    Build the notification backends of the setting "DRONE_BATTERY_NOTIFIERS"
+    """
+    return [
+        import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        for config in settings.DRONE_BATTERY_NOTIFIERS
+    ]
+
+
+class NotificationDispatcher:
+    """
+    Send the notifications in batches to every backend from a bounded thread pool, retrying the
+    failed batches. When too many batches are pending, "notify" blocks until a worker is free,
+    so a slow backend can't make the pending batches grow without limit.
+    """
+
+    def __init__(self, notifiers: list, workers: int = 4, batch_size: int = 100,
+                 max_retries: int = 3, retry_delay: float = 1.0) -> None:
+        self.notifiers = notifiers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='notifier')
+        self._pending = threading.BoundedSemaphore(workers * 2)
+        self._batch = []
+        self._lock = threading.Lock()
+
+        self.sent = 0
+        self.failed = 0
+
+    @classmethod
+    def from_settings(cls) -> 'NotificationDispatcher':
+        config = settings.DRONE_BATTERY_NOTIFICATIONS
+
+        return cls(
+            get_notifiers(),
+            workers=config['WORKERS'],
+            batch_size=config['BATCH_SIZE'],
+            max_retries=config['MAX_RETRIES'],
+            retry_delay=config['RETRY_DELAY']
+        )
+
+    def notify(self, notification: BatteryNotification) -> None:
+        self._batch.append(notification)
+
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Dispatch the notifications not sent yet, without waiting for them
+        """
+        batch, self._batch = self._batch, []
+
+        if not batch:
+            return
+
+        for notifier in self.notifiers:
+            self._pending.acquire()
+            future = self._executor.submit(self._send, notifier, batch)
+            future.add_done_callback(lambda _: self._pending.release())
+
+    def close(self) -> None:
+        """
+        Dispatch the notifications not sent yet and wait for all of them
+        """
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def _send(self, notifier: BaseNotifier, batch: list) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                notifier.send(batch)
+            except Exception:
+                logger.exception('Notifier %s failed (attempt %s)', type(notifier).__name__, attempt + 1)
+
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+            else:
+                with self._lock:
+                    self.sent += len(batch)
+                return
+
+        with self._lock:
+            self.failed += len(batch)
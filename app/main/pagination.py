@@ -0,0 +1,159 @@
+import datetime
+import json
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+class ChangedSinceCursorPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination ordered by "id" or the ordering of the view ("ordering" parameter),
+    or by "(updated_at, id)" when only the rows changed since a checkpoint are requested with the
+    "changed_since" parameter.
+
+    Unlike "CursorPagination", the position of the cursor is the value of every ordering field, not
+    only the first one, so the pages are sought by a composite key instead of skipping the ties
+    with an offset (a scan of the ties, e.g. all the drones in the same state).
+    """
+
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    ordering = ('id',)
+
+    changed_since_query_param = 'changed_since'
+    changed_since_ordering = ('updated_at', 'id')
+
+    def get_changed_since(self, request):
+        value = request.query_params.get(self.changed_since_query_param)
+
+        if value is None:
+            return None
+
+        try:
+            changed_since = parse_datetime(value)
+        except ValueError:
+            changed_since = None
+
+        if changed_since is None:
+            raise ValidationError({self.changed_since_query_param: 'Enter a valid date/time.'})
+
+        # A checkpoint without offset is in UTC
+        if timezone.is_naive(changed_since):
+            changed_since = timezone.make_aware(changed_since, datetime.timezone.utc)
+
+        return changed_since
+
+    def get_ordering(self, request, queryset, view):
+        if self.changed_since_query_param in request.query_params:
+            return self.changed_since_ordering
+
+        # The ordering requested to the ordering filter of the view, if any
+        ordering = tuple(super().get_ordering(request, queryset, view))
+
+        # "id" breaks the ties, the position of every row is unique
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering += ('-id',) if ordering[0].startswith('-') else ('id',)
+
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        changed_since = self.get_changed_since(request)
+
+        if changed_since is not None:
+            # Rows changed at the checkpoint itself are included, a sync job can get a row twice but never miss it
+            queryset = queryset.filter(updated_at__gte=changed_since)
+
+        self.page_size = self.get_page_size(request)
+
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        current_position = self.cursor.position if self.cursor is not None else None
+
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+
+        if current_position is not None:
+            queryset = queryset.filter(self.get_position_filter(current_position, reverse))
+
+        # The positions are unique ("id" is always in the ordering), no offset is needed within the ties
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = (
+            self._get_position_from_instance(results[-1], self.ordering) if len(results) > len(self.page) else None
+        )
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_position_filter(self, position: str, reverse: bool) -> Q:
+        """
+        Rows after the position in the ordering (before it for the previous pages), compared field by
+        field: (a > x) or (a = x and b > y) or ...
+        """
+        try:
+            values = json.loads(position)
+        except ValueError:
+            values = None
+
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            # A cursor of another ordering
+            raise NotFound(self.invalid_cursor_message)
+
+        conditions = []
+        equal = Q()
+
+        for field, value in zip(self.ordering, values):
+            lookup = 'lt' if field.startswith('-') != reverse else 'gt'
+            field = field.lstrip('-')
+            conditions.append(equal & Q(**{f'{field}__{lookup}': value}))
+            equal &= Q(**{field: value})
+
+        return reduce(or_, conditions)
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+
+        for field in ordering:
+            field = field.lstrip('-')
+            values.append(str(instance[field] if isinstance(instance, dict) else getattr(instance, field)))
+
+        return json.dumps(values)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append({
+            'name': self.changed_since_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Only the rows changed since this date/time (ISO 8601), ordered by modification date',
+            'schema': {
+                'type': 'string',
+                'format': 'date-time',
+            },
+        })
+        return parameters
@@ -0,0 +1,237 @@
+"""
+Planner of the loads: packing of the unassigned medication items into the drones available
+for load, minimizing the number of drones used.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+
+from .exceptions import LoadPlanOutdatedError
+from .models import Drone, Medication
+
+LoadPlan = namedtuple('LoadPlan', ['assignments', 'unassigned', 'drones_used'])
+
+MODE_FIRST_FIT_DECREASING = 'ffd'
+MODE_EXACT = 'exact'
+
+MODE_CHOICES = (
+    (MODE_FIRST_FIT_DECREASING, 'First-fit decreasing'),
+    (MODE_EXACT, 'Exact (branch and bound)'),
+)
+
+# The exact mode falls back to first-fit decreasing for bigger batches
+EXACT_MAX_ITEMS = 20
+
+# Maximum number of nodes explored by the branch and bound, the best packing found is returned
+EXACT_MAX_NODES = 200000
+
+
+class _MaxSegmentTree:
+    """
+    Maximum of the free capacities of the drones, to find the first drone fitting an item in O(log n)
+    """
+
+    def __init__(self, values: list) -> None:
+        self.size = 1
+
+        while self.size < len(values):
+            self.size *= 2
+
+        self.tree = [float('-inf')] * (2 * self.size)
+        self.tree[self.size:self.size + len(values)] = values
+
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def first_at_least(self, value: float):
+        """
+        Index of the first value greater than or equal to "value", None if there isn't any
+        """
+        if self.tree[1] < value:
+            return None
+
+        i = 1
+
+        while i < self.size:
+            i = 2 * i if self.tree[2 * i] >= value else 2 * i + 1
+
+        return i - self.size
+
+    def subtract(self, index: int, value: float) -> None:
+        i = index + self.size
+        self.tree[i] -= value
+        i //= 2
+
+        while i:
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+            i //= 2
+
+
+def _order_drones(drones: list) -> list:
+    # The drones already carrying items are used first (they are already flying), then the biggest ones
+    return sorted(drones, key=lambda drone: (not drone[2], -drone[1], drone[0]))
+
+
+def _plan(assignments: dict, unassigned: list, loaded: set) -> LoadPlan:
+    assignments = {pk: item_ids for pk, item_ids in assignments.items() if item_ids}
+    return LoadPlan(assignments, unassigned, len(loaded | set(assignments)))
+
+
+def first_fit_decreasing(items: list, drones: list) -> LoadPlan:
+    """
+    Pack the items, heaviest first, into the first drone where they fit
+
+        Parameters:
+            items (list): Medication items as (ID, weight)
+            drones (list): Drones as (ID, free capacity, carrying items)
+
+        Returns:
+            LoadPlan: IDs of the items by drone ID, IDs of the items that don't fit and number of drones used
+    """
+    drones = _order_drones(drones)
+    tree = _MaxSegmentTree([free_capacity for _, free_capacity, _ in drones])
+    assignments = {}
+    unassigned = []
+
+    for pk, weight in sorted(items, key=lambda item: (-item[1], item[0])):
+        index = tree.first_at_least(weight)
+
+        if index is None:
+            unassigned.append(pk)
+            continue
+
+        tree.subtract(index, weight)
+        assignments.setdefault(drones[index][0], []).append(pk)
+
+    return _plan(assignments, unassigned, {pk for pk, _, loaded in drones if loaded})
+
+
+def branch_and_bound(items: list, drones: list, max_nodes: int = EXACT_MAX_NODES) -> LoadPlan:
+    """
+    Search the packing with the fewest items left out, then the fewest drones used, starting from
+    the first-fit decreasing packing. The drones with the same free capacity are interchangeable,
+    only one of them is tried for every item.
+
+        Parameters:
+            items (list): Medication items as (ID, weight)
+            drones (list): Drones as (ID, free capacity, carrying items)
+            max_nodes (int): Maximum number of explored nodes
+
+        Returns:
+            LoadPlan: Like "first_fit_decreasing"
+    """
+    best = first_fit_decreasing(items, drones)
+    drones = _order_drones(drones)
+    items = sorted(items, key=lambda item: (-item[1], item[0]))
+    remaining = [free_capacity for _, free_capacity, _ in drones]
+    used = [loaded for _, _, loaded in drones]
+    placement = [None] * len(items)
+    best_score = [(len(best.unassigned), best.drones_used)]
+    best_placement = [None]
+    nodes = [0]
+
+    def search(i: int, unassigned: int, drones_used: int) -> None:
+        nodes[0] += 1
+
+        if (unassigned, drones_used) >= best_score[0] or nodes[0] > max_nodes:
+            return
+
+        if i == len(items):
+            best_score[0] = (unassigned, drones_used)
+            best_placement[0] = list(placement)
+            return
+
+        weight = items[i][1]
+        tried = set()
+
+        for index, free_capacity in enumerate(remaining):
+            if free_capacity < weight or (used[index], free_capacity) in tried:
+                continue
+
+            tried.add((used[index], free_capacity))
+            opened = not used[index]
+            remaining[index] -= weight
+            used[index] = True
+            placement[i] = index
+
+            search(i + 1, unassigned, drones_used + opened)
+
+            remaining[index] += weight
+            used[index] = not opened
+
+        placement[i] = None
+        search(i + 1, unassigned + 1, drones_used)
+
+    search(0, 0, sum(used))
+
+    if best_placement[0] is None:
+        return best
+
+    assignments = {}
+    unassigned = []
+
+    for (pk, _), index in zip(items, best_placement[0]):
+        if index is None:
+            unassigned.append(pk)
+        else:
+            assignments.setdefault(drones[index][0], []).append(pk)
+
+    return _plan(assignments, unassigned, {pk for pk, _, loaded in drones if loaded})
+
+
+def plan_loads(medication_items=None, drones=None, mode: str = MODE_FIRST_FIT_DECREASING) -> LoadPlan:
+    """
+    Plan the loads of the unassigned medication items into the drones available for load
+
+        Parameters:
+            medication_items (QuerySet): Candidate medication items, all of them by default
+            drones (QuerySet): Candidate drones, all of them by default
+            mode (str): One of "MODE_*", the exact mode is only used for up to "EXACT_MAX_ITEMS" items
+
+        Returns:
+            LoadPlan: The planned loads
+    """
+    if medication_items is None:
+        medication_items = Medication.objects.all()
+
+    if drones is None:
+        drones = Drone.objects.all()
+
+    items = list(medication_items.filter(drone__isnull=True).values_list('pk', 'weight'))
+    drones = list(drones.available_for_load().values_list('pk', 'free_capacity', 'payload_count'))
+    drones = [(pk, free_capacity, payload_count > 0) for pk, free_capacity, payload_count in drones]
+
+    if mode == MODE_EXACT and len(items) <= EXACT_MAX_ITEMS:
+        return branch_and_bound(items, drones)
+
+    return first_fit_decreasing(items, drones)
+
+
+def apply_load_plan(plan: LoadPlan) -> None:
+    """
+    Load the planned medication items into the drones, all of them or none. The idle drones are
+    set to "LOADING" first.
+
+        Exceptions:
+            LoadPlanOutdatedError: If a drone was deleted or a medication item loaded since the plan
+            DroneInvalidStateError: If a drone can't be set to "LOADING" anymore
+            DroneBatteryTooLowError: If the battery of a drone dropped below the threshold
+            WeightExceededError: If a drone can't carry its items anymore
+    """
+    item_ids = [pk for pks in plan.assignments.values() for pk in pks]
+
+    with transaction.atomic():
+        drones = Drone.objects.select_for_update().in_bulk(list(plan.assignments))
+        # The bulk load would move the items loaded in the meantime to another drone
+        available_items = Medication.objects.select_for_update().filter(pk__in=item_ids, drone__isnull=True)
+
+        if len(drones) != len(plan.assignments) or available_items.count() != len(item_ids):
+            raise LoadPlanOutdatedError()
+
+        for pk, drone_item_ids in plan.assignments.items():
+            drone = drones[pk]
+
+            if drone.state != Drone.STATE_LOADING:
+                drone.set_state(Drone.STATE_LOADING)
+
+            drone.load_medication_items(drone_item_ids)
@@ -0,0 +1,265 @@
+"""
+Profiling of single requests on demand (setting "PROFILING"): the request runs under "cProfile"
+and its SQL queries are recorded with their timings. Every profile is stored as a pair of files in
+a ring directory keeping the newest "MAX_PROFILES": "<ID>.prof" (pstats) and "<ID>.json" (request
+and SQL queries).
+
+Under ASGI "cProfile" profiles the thread of the event loop: the profile of an async request also
+has the other tasks running meanwhile, and not the sync code it runs in threads ("sync_to_async").
+A single async request is profiled at a time, "cProfile" can't nest in a thread.
+"""
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .metrics import observe_sql
+
+_sequence_lock = threading.Lock()
+_sequence = 0
+
+# Name of the metadata of a profile, "<time>-<process>-<sequence>.json"
+_PROFILE_NAME = re.compile(r'^(\d+)-(\d+)-(\d+)\.json$')
+
+# Whether an async request is being profiled in the event loop of the thread
+_async_profiling = threading.local()
+
+
+def should_profile(request) -> bool:
+    """
+    The request is profiled if it has the header of the setting with the secret, or with any
+    value from a staff user, or if it's sampled
+    """
+    config = settings.PROFILING
+    value = request.headers.get(config['HEADER'])
+
+    if value is not None:
+        if config['SECRET'] and hmac.compare_digest(value.encode(), config['SECRET'].encode()):
+            return True
+
+        user = getattr(request, 'user', None)
+
+        if user is not None and user.is_staff:
+            return True
+
+    return config['SAMPLE_RATE'] > 0 and random.random() < config['SAMPLE_RATE']
+
+
+async def ashould_profile(request) -> bool:
+    """
+    "should_profile" for the async requests, the user is only loaded (in a thread) if the header is set
+    """
+    if request.headers.get(settings.PROFILING['HEADER']) is None:
+        return should_profile(request)
+
+    return await sync_to_async(should_profile)(request)
+
+
+class QueryRecorder:
+    """
+    SQL observer keeping the first "max_queries" queries of a request, and the totals of all of them
+    """
+
+    def __init__(self, max_queries: int) -> None:
+        self.max_queries = max_queries
+        self.queries = []
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, sql: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+
+        if len(self.queries) < self.max_queries:
+            self.queries.append({'sql': sql, 'seconds': seconds})
+
+
+def _new_profile_id() -> str:
+    global _sequence
+
+    with _sequence_lock:
+        _sequence += 1
+        sequence = _sequence
+
+    # Sorted by time, unique across the processes and threads of the server
+    return f'{time.time_ns()}-{os.getpid()}-{sequence}'
+
+
+def _store_request_profile(request, response, profiler: cProfile.Profile, recorder: QueryRecorder,
+                           elapsed: float) -> str:
+    resolver_match = getattr(request, 'resolver_match', None)
+
+    return store_profile(profiler, {
+        'created_at': timezone.now().isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view': resolver_match.view_name if resolver_match is not None else None,
+        'status': response.status_code,
+        'seconds': elapsed,
+        'query_count': recorder.count,
+        'query_seconds': recorder.seconds,
+        'queries': recorder.queries,
+    })
+
+
+def profile_request(request, get_response):
+    """
+    Run the request under "cProfile" and store its profile
+
+        Returns:
+            tuple: The response and the ID of the stored profile
+    """
+    recorder = QueryRecorder(settings.PROFILING['MAX_QUERIES'])
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+
+    with observe_sql(recorder):
+        profiler.enable()
+
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+
+    elapsed = time.perf_counter() - start
+
+    return response, _store_request_profile(request, response, profiler, recorder, elapsed)
+
+
+async def aprofile_request(request, get_response):
+    """
+    Await the request under "cProfile" and store its profile. If another async request is being
+    profiled, the request is served without profiling.
+
+        Returns:
+            tuple: The response and the ID of the stored profile (None if not profiled)
+    """
+    if getattr(_async_profiling, 'active', False):
+        return await get_response(request), None
+
+    recorder = QueryRecorder(settings.PROFILING['MAX_QUERIES'])
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    _async_profiling.active = True
+
+    try:
+        with observe_sql(recorder):
+            profiler.enable()
+
+            try:
+                response = await get_response(request)
+            finally:
+                profiler.disable()
+    finally:
+        _async_profiling.active = False
+
+    elapsed = time.perf_counter() - start
+    profile_id = await sync_to_async(_store_request_profile)(request, response, profiler, recorder, elapsed)
+
+    return response, profile_id
+
+
+def store_profile(profiler: cProfile.Profile, info: dict) -> str:
+    """
+    Write a profile to the ring directory and delete the oldest ones over "MAX_PROFILES"
+
+        Returns:
+            str: ID of the profile
+    """
+    directory = settings.PROFILING['DIRECTORY']
+    os.makedirs(directory, exist_ok=True)
+    profile_id = _new_profile_id()
+
+    # The metadata is written last and atomically, the profiles are only listed by it
+    profiler.dump_stats(os.path.join(directory, f'{profile_id}.prof'))
+    temporary_path = os.path.join(directory, f'.{profile_id}.json')
+
+    with open(temporary_path, 'w') as f:
+        json.dump(info, f)
+
+    os.replace(temporary_path, os.path.join(directory, f'{profile_id}.json'))
+    prune_profiles()
+
+    return profile_id
+
+
+def _profile_ids() -> list:
+    directory = settings.PROFILING['DIRECTORY']
+
+    if not os.path.isdir(directory):
+        return []
+
+    # Other files of the directory (and the metadata being written, ".<ID>.json") are skipped
+    matches = filter(None, map(_PROFILE_NAME.match, os.listdir(directory)))
+    return [
+        match.string[:-5] for match in sorted(matches, key=lambda match: tuple(int(part) for part in match.groups()))
+    ]
+
+
+def prune_profiles() -> int:
+    """
+    Delete the oldest profiles over "MAX_PROFILES"
+
+        Returns:
+            int: Number of deleted profiles
+    """
+    directory = settings.PROFILING['DIRECTORY']
+    profile_ids = _profile_ids()
+    to_delete = profile_ids[:max(len(profile_ids) - settings.PROFILING['MAX_PROFILES'], 0)]
+
+    for profile_id in to_delete:
+        for extension in ('json', 'prof'):
+            try:
+                os.remove(os.path.join(directory, f'{profile_id}.{extension}'))
+            except FileNotFoundError:
+                # Deleted by another process
+                pass
+
+    return len(to_delete)
+
+
+def load_profile(profile_id: str) -> dict:
+    """
+    Metadata of a stored profile, with its ID
+
+        Exceptions:
+            FileNotFoundError: If the profile doesn't exist (or was deleted from the ring)
+    """
+    with open(os.path.join(settings.PROFILING['DIRECTORY'], f'{profile_id}.json')) as f:
+        return {'id': profile_id, **json.load(f)}
+
+
+def list_profiles() -> list:
+    """
+    Metadata of the stored profiles, the oldest first
+    """
+    profiles = []
+
+    for profile_id in _profile_ids():
+        try:
+            profiles.append(load_profile(profile_id))
+        except FileNotFoundError:
+            continue
+
+    return profiles
+
+
+def summarize_profile(profile_id: str, sort: str = 'cumulative', limit: int = 25) -> str:
+    """
+    The functions of a stored profile with the most time, in the "pstats" format
+    """
+    output = io.StringIO()
+    stats = pstats.Stats(os.path.join(settings.PROFILING['DIRECTORY'], f'{profile_id}.prof'), stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+
+    return output.getvalue()
@@ -0,0 +1,154 @@
+"""
+Versioned cache of the serialized responses of a drone (detail, loaded medication items).
+
+Every drone has a version counter in the cache, part of the keys of its responses. The writes
+bump it once they are committed, so the cached responses are reused until the drone or its
+medication items change, and the outdated ones just expire.
+"""
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+ALL_DRONES_VERSION_KEY = 'drone-version:all'
+
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(stat: str, value: int = 1) -> None:
+    with _stats_lock:
+        _stats[stat] += value
+
+
+def _get_cache():
+    return caches[settings.DRONE_RESPONSE_CACHE['ALIAS']]
+
+
+def _version_key(drone_id) -> str:
+    return f'drone-version:{drone_id}'
+
+
+def _new_version() -> int:
+    # Not reused if a version counter is evicted from the cache
+    return time.time_ns()
+
+
+def _bump(keys: list) -> None:
+    cache = _get_cache()
+
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+    _count('invalidations', len(keys))
+
+
+def invalidate_drones(drone_ids) -> None:
+    """
+    Bump the version of the drones once the current transaction is committed
+    """
+    if not settings.DRONE_RESPONSE_CACHE['ENABLED']:
+        return
+
+    keys = [_version_key(pk) for pk in {pk for pk in drone_ids if pk is not None}]
+
+    if keys:
+        transaction.on_commit(partial(_bump, keys))
+
+
+def invalidate_all_drones() -> None:
+    """
+    Bump the version of all the drones, for the writes not knowing the drones they change
+    """
+    if settings.DRONE_RESPONSE_CACHE['ENABLED']:
+        transaction.on_commit(partial(_bump, [ALL_DRONES_VERSION_KEY]))
+
+
+def _data_key(versions: dict, drone_id, name: str, variant: str) -> str:
+    return (
+        f'drone-response:{drone_id}:{versions[ALL_DRONES_VERSION_KEY]}:'
+        f'{versions[_version_key(drone_id)]}:{name}:{variant}'
+    )
+
+
+def request_variant(request) -> str:
+    """
+    Parts of the request the responses depend on: the host (absolute URLs) and the sparse fieldset
+    """
+    return f"{request.get_host()}|{request.GET.get('fields', '')}"
+
+
+def get_or_set_response(drone_id, name: str, build, variant: str = ''):
+    """
+    Serialized response of a drone, built once for every version of the drone
+
+        Parameters:
+            drone_id: ID of the drone
+            name (str): Name of the response
+            build: Function building the serialized response, never None
+            variant (str): Part of the request the response depends on (e.g. the host of the URLs)
+    """
+    if not settings.DRONE_RESPONSE_CACHE['ENABLED']:
+        return build()
+
+    cache = _get_cache()
+    version_keys = [ALL_DRONES_VERSION_KEY, _version_key(drone_id)]
+    # The version is read before the response is built, a response built while a write is
+    # committed is stored with the outdated version
+    versions = cache.get_many(version_keys)
+
+    for key in version_keys:
+        if key not in versions:
+            versions[key] = cache.get_or_set(key, _new_version, None)
+
+    key = _data_key(versions, drone_id, name, variant)
+    data = cache.get(key)
+
+    if data is not None:
+        _count('hits')
+        return data
+
+    _count('misses')
+    data = build()
+    cache.set(key, data, settings.DRONE_RESPONSE_CACHE['TIMEOUT'])
+    return data
+
+
+async def aget_or_set_response(drone_id, name: str, build, variant: str = ''):
+    """
+    Like "get_or_set_response", with a coroutine function building the response
+    """
+    if not settings.DRONE_RESPONSE_CACHE['ENABLED']:
+        return await build()
+
+    cache = _get_cache()
+    version_keys = [ALL_DRONES_VERSION_KEY, _version_key(drone_id)]
+    versions = await cache.aget_many(version_keys)
+
+    for key in version_keys:
+        if key not in versions:
+            versions[key] = await cache.aget_or_set(key, _new_version, None)
+
+    key = _data_key(versions, drone_id, name, variant)
+    data = await cache.aget(key)
+
+    if data is not None:
+        _count('hits')
+        return data
+
+    _count('misses')
+    data = await build()
+    await cache.aset(key, data, settings.DRONE_RESPONSE_CACHE['TIMEOUT'])
+    return data
+
+
+def stats() -> dict:
+    with _stats_lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return {**_stats, 'hit_ratio': _stats['hits'] / lookups if lookups else None}
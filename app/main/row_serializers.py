@@ -0,0 +1,141 @@
+"""
+Read-only serializers of "values()" rows for the list responses, with the same output as the model
+serializers without building model instances and field objects for every row.
+
+Every field is compiled once per response into an extractor of the row, in the order of the fields
+of the model serializer (which applies the sparse fieldset).
+"""
+from operator import itemgetter
+
+from .battery_buffer import get_battery_buffer
+from .models import Medication
+
+
+def _nullable(convert, column: str):
+    def extract(row):
+        value = row[column]
+        return None if value is None else convert(value)
+
+    return extract
+
+
+def _float(column: str):
+    return lambda context: _nullable(float, column)
+
+
+def _int(column: str):
+    return lambda context: _nullable(int, column)
+
+
+def _str(column: str):
+    return lambda context: _nullable(str, column)
+
+
+def _value(column: str):
+    return lambda context: itemgetter(column)
+
+
+def _battery_capacity(context):
+    battery_buffer = get_battery_buffer()
+    battery_capacity = _nullable(float, 'battery_capacity')
+
+    if battery_buffer is None:
+        return battery_capacity
+
+    def extract(row):
+        return float(battery_buffer.get_newest_battery_capacity(
+            row['id'], row['battery_capacity'], row['battery_updated_at']
+        ))
+
+    return extract
+
+
+def _build_url(context, url: str) -> str:
+    request = context.get('request')
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def _image(context):
+    storage = Medication._meta.get_field('image').storage
+
+    def extract(row):
+        return _build_url(context, storage.url(row['image'])) if row['image'] else None
+
+    return extract
+
+
+def _image_variants(context):
+    storage = Medication._meta.get_field('image').storage
+
+    def extract(row):
+        if not row['image_variants']:
+            return None
+
+        return {variant: _build_url(context, storage.url(name)) for variant, name in row['image_variants'].items()}
+
+    return extract
+
+
+class RowSerializer:
+    """
+    Serializer of "values()" rows
+
+        Parameters:
+            field_names (list): Names of the fields to represent, in order
+            context (dict): Context of the serializer ("request")
+    """
+
+    # Field name to the columns it reads and the factory of its extractor, called with the context
+    row_fields = {}
+
+    def __init__(self, field_names, context: dict) -> None:
+        unsupported = [name for name in field_names if name not in self.row_fields]
+
+        if unsupported:
+            raise ValueError(f'Fields without row extractor: {", ".join(unsupported)}')
+
+        self.extractors = [(name, self.row_fields[name][1](context)) for name in field_names]
+        self.columns = list(dict.fromkeys(
+            column for name in field_names for column in self.row_fields[name][0]
+        ))
+
+    @classmethod
+    def supports(cls, field_names) -> bool:
+        return all(name in cls.row_fields for name in field_names)
+
+    def to_representation(self, rows) -> list:
+        extractors = self.extractors
+        return [{name: extract(row) for name, extract in extractors} for row in rows]
+
+
+class DroneRowSerializer(RowSerializer):
+    """
+    Rows of "DroneSerializer"
+    """
+
+    row_fields = {
+        'id': (('id',), _int('id')),
+        'serial_number': (('serial_number',), _str('serial_number')),
+        'model': (('model',), _value('model')),
+        'weight_limit': (('weight_limit',), _float('weight_limit')),
+        'battery_capacity': (('id', 'battery_capacity', 'battery_updated_at'), _battery_capacity),
+        'state': (('state',), _value('state')),
+        'current_weight': (('payload_weight',), _float('payload_weight')),
+    }
+
+
+class MedicationRowSerializer(RowSerializer):
+    """
+    Rows of "MedicationSerializer"
+    """
+
+    row_fields = {
+        'id': (('id',), _int('id')),
+        'name': (('name',), _str('name')),
+        'weight': (('weight',), _float('weight')),
+        'code': (('code',), _str('code')),
+        'priority': (('priority',), _int('priority')),
+        'image': (('image',), _image),
+        'image_variants': (('image_variants',), _image_variants),
+        'drone': (('drone_id',), _value('drone_id')),
+    }
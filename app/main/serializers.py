@@ -1,8 +1,63 @@
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image
 from rest_framework import serializers
 
 from .models import Drone, Medication
+from .exports import FORMAT_CHOICES, FORMAT_NDJSON
+from .battery_buffer import get_battery_buffer
+from .battery_history import RESOLUTION_CHOICES
+from .planner import MODE_CHOICES, MODE_FIRST_FIT_DECREASING
 
-class DroneSerializer(serializers.ModelSerializer):
+
+class SparseFieldsetMixin:
+    """
+    Only represent the fields requested by the parameter "fields" (names separated by commas), on the reads
+    """
+
+    fields_query_param = 'fields'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        request = self.context.get('request')
+
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return
+
+        requested = request.GET.get(self.fields_query_param)
+
+        if not requested:
+            return
+
+        requested = {name.strip() for name in requested.split(',') if name.strip()}
+        unknown = requested - set(self.fields)
+
+        if unknown:
+            raise serializers.ValidationError({
+                self.fields_query_param: f'Unknown fields: {", ".join(sorted(unknown))}.'
+            })
+
+        for name in set(self.fields) - requested:
+            self.fields.pop(name)
+
+
+class BufferedBatteryMixin:
+    """
+    Represent the battery capacity of the drone with the reading of the write-behind buffer, if it's newer
+    """
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        battery_buffer = get_battery_buffer()
+
+        if battery_buffer is not None and 'battery_capacity' in data:
+            data['battery_capacity'] = battery_buffer.get_battery_capacity(instance)
+
+        return data
+
+
+class DroneSerializer(SparseFieldsetMixin, BufferedBatteryMixin, serializers.ModelSerializer):
     current_weight = serializers.FloatField(read_only=True)
 
     class Meta:
@@ -11,14 +66,92 @@ class DroneSerializer(serializers.ModelSerializer):
         read_only_fields = ['state', 'current_weight']
 
 
-class MedicationSerializer(serializers.ModelSerializer):
+class AvailableDroneSerializer(DroneSerializer):
+    """
+    Drone with the predicted seconds until its battery reaches the threshold, from the
+    forecasts of the context ("forecasts"), null if unknown or not draining
+    """
+
+    predicted_time_to_threshold = serializers.SerializerMethodField()
+
+    class Meta(DroneSerializer.Meta):
+        fields = [*DroneSerializer.Meta.fields, 'predicted_time_to_threshold']
+
+    def get_predicted_time_to_threshold(self, instance) -> float:
+        forecast = self.context.get('forecasts', {}).get(instance.pk)
+        return forecast.time_to_threshold if forecast is not None else None
+
+
+class CarrierDroneSerializer(DroneSerializer):
+    """
+    Drone with the weight it can still carry
+    """
+
+    free_capacity = serializers.FloatField(read_only=True)
+
+    class Meta(DroneSerializer.Meta):
+        fields = [*DroneSerializer.Meta.fields, 'free_capacity']
+
+
+class HeaderImageField(serializers.FileField):
+    """
+    Image upload checked only from its header (format and dimensions), the image is never decoded
+    """
+
+    default_error_messages = {
+        'invalid_image': 'Upload a valid image. The file you uploaded was either not an image or a corrupted image.',
+        'invalid_format': 'Unsupported image format, the supported ones are: {formats}.',
+        'too_large': 'The image dimensions exceed {max_dimension} pixels.',
+    }
+
+    def to_internal_value(self, data):
+        file = super().to_internal_value(data)
+
+        try:
+            # Only reads the header, the pixels are decoded lazily
+            with Image.open(file) as image:
+                image_format, size = image.format, image.size
+        except (OSError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        finally:
+            file.seek(0)
+
+        if image_format not in settings.MEDICATION_IMAGE_FORMATS:
+            self.fail('invalid_format', formats=', '.join(settings.MEDICATION_IMAGE_FORMATS))
+
+        if max(size) > settings.MEDICATION_IMAGE_MAX_DIMENSION:
+            self.fail('too_large', max_dimension=settings.MEDICATION_IMAGE_MAX_DIMENSION)
+
+        return file
+
+
+class MedicationSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     drone = serializers.PrimaryKeyRelatedField(read_only=True)
+    image = HeaderImageField(required=False)
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Medication
-        fields = ['id', 'name', 'weight', 'code', 'image', 'drone']
+        fields = ['id', 'name', 'weight', 'code', 'priority', 'image', 'image_variants', 'drone']
         read_only_fields = ['drone']
 
+    def get_image_variants(self, instance) -> dict:
+        """
+        URLs of the variants of the image (thumbnail, web optimized), null until they are generated
+        """
+        if not instance.image_variants:
+            return None
+
+        request = self.context.get('request')
+        storage = instance.image.storage
+        urls = {}
+
+        for variant, name in instance.image_variants.items():
+            url = storage.url(name)
+            urls[variant] = request.build_absolute_uri(url) if request is not None else url
+
+        return urls
+
 
 class IDMedicationSerializer(serializers.Serializer):
     medication_item_id = serializers.IntegerField()
@@ -30,7 +163,78 @@ class DronStateSerializer(serializers.ModelSerializer):
         fields = ['state']
 
 
-class DronBatterySerializer(serializers.ModelSerializer):
+class DronesStateSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+    state = serializers.ChoiceField(choices=Drone.STATE_CHOICES)
+
+
+class DronBatterySerializer(BufferedBatteryMixin, serializers.ModelSerializer):
     class Meta:
         model = Drone
         fields = ['battery_capacity']
+
+
+class AvailableDronesQuerySerializer(serializers.Serializer):
+    ORDERING_CHOICES = (
+        'id', '-id',
+        'free_capacity', '-free_capacity',
+        'battery_capacity', '-battery_capacity',
+    )
+
+    min_free_capacity = serializers.FloatField(required=False, min_value=0)
+    model = serializers.ChoiceField(choices=Drone.MODEL_CHOICES, required=False)
+    ordering = serializers.ChoiceField(choices=ORDERING_CHOICES, required=False, default='id')
+    min_time_to_threshold = serializers.FloatField(required=False, min_value=0)
+
+
+class CanCarryQuerySerializer(serializers.Serializer):
+    weight = serializers.FloatField(required=False, min_value=0)
+    medication_item_id = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=100, default=10)
+
+    def validate(self, attrs):
+        if ('weight' in attrs) == ('medication_item_id' in attrs):
+            raise serializers.ValidationError('Either "weight" or "medication_item_id" is required.')
+
+        if 'medication_item_id' in attrs:
+            weight = Medication.objects.filter(pk=attrs['medication_item_id']).values_list('weight', flat=True).first()
+
+            if weight is None:
+                raise serializers.ValidationError({'medication_item_id': 'Medication item does not exist.'})
+
+            attrs['weight'] = weight
+
+        return attrs
+
+
+class IDsMedicationSerializer(serializers.Serializer):
+    medication_item_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=500
+    )
+
+
+class PlanLoadsSerializer(serializers.Serializer):
+    medication_item_ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=10000)
+    drone_ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+    mode = serializers.ChoiceField(choices=MODE_CHOICES, required=False, default=MODE_FIRST_FIT_DECREASING)
+    apply = serializers.BooleanField(required=False, default=False)
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    export_format = serializers.ChoiceField(choices=FORMAT_CHOICES, required=False, default=FORMAT_NDJSON)
+
+
+class BatteryHistoryQuerySerializer(serializers.Serializer):
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField(required=False)
+    resolution = serializers.ChoiceField(choices=RESOLUTION_CHOICES, required=False)
+
+    def validate(self, attrs):
+        attrs.setdefault('end', timezone.now())
+
+        if attrs['start'] >= attrs['end']:
+            raise serializers.ValidationError({'end': 'The end must be after the start.'})
+
+        return attrs
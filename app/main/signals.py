@@ -1,9 +1,145 @@
-from django.db.models.signals import post_delete
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import BatteryReading, Drone, Medication
+from .images import image_variant_names, schedule_image_variants
+from .media_cleanup import queue_media_cleanup
+from .response_cache import invalidate_drones
+
+
+def _image_name(value) -> str:
+    return getattr(value, 'name', value) or ''
+
+
+def _save_image_variants(pk: int, name: str, variants: dict) -> None:
+    # Only if the medication item still has the same image
+    medications = Medication.objects.filter(pk=pk, image=name)
+
+    if medications.update(image_variants=variants, updated_at=timezone.now()):
+        invalidate_drones(medications.values_list('drone_id', flat=True))
+
+
+def _release_payload(drone_id: int, weight: float) -> None:
+    """
+    Remove a medication item from the payload of a drone
+    """
+    if weight is None:
+        # The weight was not loaded (deferred field), so recompute the whole payload
+        Drone.objects.filter(pk=drone_id).recompute_payload()
+    else:
+        Drone.objects.filter(pk=drone_id).adjust_payload(-weight, -1)
+
+
+@receiver(post_init, sender=Drone)
+def post_init_drone(sender, instance, *args, **kwargs):
+    # The battery capacity stored in the database, read from "__dict__" to don't trigger
+    # a query for deferred fields
+    instance._saved_battery_capacity = instance.__dict__.get('battery_capacity')
+
+
+@receiver(post_save, sender=Drone)
+@receiver(post_delete, sender=Drone)
+def invalidate_drone_responses(sender, instance, *args, **kwargs):
+    invalidate_drones([instance.pk])
+
+
+@receiver(post_save, sender=Drone)
+def post_save_drone(sender, instance, created, update_fields=None, raw=False, *args, **kwargs):
+    if raw or (update_fields is not None and 'battery_capacity' not in update_fields):
+        return
+
+    # Record every change of the battery in the history
+    if created or instance.battery_capacity != instance._saved_battery_capacity:
+        BatteryReading.objects.create(drone=instance, ts=timezone.now(), battery_capacity=instance.battery_capacity)
+
+    instance._saved_battery_capacity = instance.battery_capacity
+
+
+@receiver(post_init, sender=Medication)
+def post_init_medication(sender, instance, *args, **kwargs):
+    # The drone and weight accounted in the payload of the drone, read from "__dict__"
+    # to don't trigger a query for deferred fields
+    instance._accounted_payload = (instance.__dict__.get('drone_id'), instance.__dict__.get('weight'))
+    instance._saved_image = _image_name(instance.__dict__.get('image'))
+
 
-from .models import Medication
+@receiver(post_save, sender=Medication)
+@receiver(post_delete, sender=Medication)
+def invalidate_medication_responses(sender, instance, *args, **kwargs):
+    # Before the payload receivers, the drone where the medication item was loaded is still known
+    invalidate_drones([instance.drone_id, instance._accounted_payload[0]])
+
+
+@receiver(post_save, sender=Medication)
+def post_save_medication(sender, instance, update_fields=None, *args, **kwargs):
+    if update_fields is not None and not {'drone', 'weight'} & set(update_fields):
+        return
+
+    accounted_drone_id, accounted_weight = instance._accounted_payload
+
+    if (accounted_drone_id, accounted_weight) == (instance.drone_id, instance.weight):
+        return
+
+    if accounted_drone_id is not None:
+        _release_payload(accounted_drone_id, accounted_weight)
+
+    if instance.drone_id is not None:
+        Drone.objects.filter(pk=instance.drone_id).adjust_payload(instance.weight, 1)
+
+    instance._accounted_payload = (instance.drone_id, instance.weight)
+
+
+@receiver(post_save, sender=Medication)
+def post_save_medication_image(sender, instance, created, raw=False, *args, **kwargs):
+    name = _image_name(instance.image)
+
+    if raw or name == instance._saved_image:
+        return
+
+    previous_name, instance._saved_image = instance._saved_image, name
+
+    # The previous image and its variants are deleted later, and only if no other medication item
+    # shares them. The variants in memory can be outdated (generated in the background), the names
+    # of all of them are queued.
+    # (on creation, the previous name is the one of the upload)
+    if previous_name and not created:
+        queue_media_cleanup(previous_name, {**image_variant_names(previous_name), **instance.image_variants})
+
+    # The variants of the previous image are outdated
+    if instance.image_variants:
+        instance.image_variants = {}
+        Medication.objects.filter(pk=instance.pk).update(image_variants={})
+
+    if not name:
+        return
+
+    # The image can be shared with other medication items (same content), with the variants already generated
+    shared_variants = Medication.objects.filter(image=name).exclude(pk=instance.pk).exclude(
+        image_variants={}
+    ).values_list('image_variants', flat=True).first()
+
+    if shared_variants:
+        instance.image_variants = shared_variants
+        _save_image_variants(instance.pk, name, shared_variants)
+        return
+
+    # Generate the variants once the image is committed, off the request path
+    transaction.on_commit(partial(
+        schedule_image_variants, instance.image.storage, name, partial(_save_image_variants, instance.pk, name)
+    ))
 
 
 @receiver(post_delete, sender=Medication)
 def post_delete_medication(sender, instance, *args, **kwargs):
-    instance.image.delete(save=False)
+    accounted_drone_id, accounted_weight = instance._accounted_payload
+
+    if accounted_drone_id is not None:
+        _release_payload(accounted_drone_id, accounted_weight)
+
+    # The files are deleted later, and only if no other medication item shares them
+    if instance.image:
+        queue_media_cleanup(instance.image.name, instance.image_variants)
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, only the threads of the process are serialized
+    fcntl = None
+
+_lock = threading.Lock()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names the files by the SHA-256 of their content, under the directory
+    of the requested name: "uploads/medications/photo.png" -> "uploads/medications/ab/cd/abcd...ef.png".
+
+    Identical files are stored once, so a file can be shared by many rows and must only be
+    deleted when no row references it anymore. The saves and the deletions of the media cleanup
+    are serialized by "lock()", and a reused file is touched, so the cleanup can tell it's about to
+    be referenced by a row not committed yet.
+    """
+
+    lock_name = '.storage.lock'
+
+    @contextmanager
+    def lock(self):
+        """
+        Exclusive lock of the storage, shared by the threads and the processes of the host
+        """
+        with _lock:
+            if fcntl is None:
+                yield
+                return
+
+            os.makedirs(self.location, exist_ok=True)
+
+            with open(self.path(self.lock_name), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is the hash of the content, an existing file with that name is the same file
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+
+        incoming_directory = self.path(os.path.join(directory, '.incoming'))
+        os.makedirs(incoming_directory, exist_ok=True)
+
+        # Hash the content while it's streamed to a temporary file, never held in memory
+        digest = hashlib.sha256()
+
+        with tempfile.NamedTemporaryFile(dir=incoming_directory, delete=False) as temporary_file:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+
+                digest.update(chunk)
+                temporary_file.write(chunk)
+
+        digest = digest.hexdigest()
+        name = os.path.join(directory, digest[:2], digest[2:4], f'{digest}{extension}')
+        full_path = self.path(name)
+
+        with self.lock():
+            if os.path.exists(full_path):
+                # Reused, recently modified files are kept by the cleanup until the row is committed
+                os.utime(full_path)
+                os.remove(temporary_file.name)
+            else:
+                # Missing, or deleted by the cleanup in the meantime: materialized again from the upload
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(temporary_file.name, full_path)
+
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+
+        return name.replace('\\', '/')
@@ -0,0 +1,205 @@
+import datetime
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, FloatField, Q, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Drone
+from .battery_history import record_battery_readings
+from .response_cache import invalidate_drones
+
+BatteryTelemetry = namedtuple('BatteryTelemetry', ['drone_id', 'serial_number', 'battery_capacity', 'timestamp'])
+
+# Maximum number of drones updated by a single UPDATE statement
+UPDATE_BATCH_SIZE = 500
+
+# Range of the primary keys (64-bit signed integers), larger values can't be sent to the database
+MAX_DRONE_ID = 2 ** 63 - 1
+
+
+def _parse_timestamp(value):
+    """
+    Parse an ISO 8601 date/time or a UNIX timestamp (seconds), return None if invalid
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+
+    if not isinstance(value, str):
+        return None
+
+    try:
+        timestamp = parse_datetime(value)
+    except ValueError:
+        return None
+
+    if timestamp is not None and timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, datetime.timezone.utc)
+
+    return timestamp
+
+
+def validate_battery_telemetry(items: list) -> tuple:
+    """
+    Validate the raw battery readings in a single pass.
+
+        Parameters:
+            items (list): Dicts with "id" or "serial_number", "battery_capacity" (0 to 100) and "timestamp"
+                (not later than "TELEMETRY_MAX_CLOCK_SKEW" from now)
+
+        Returns:
+            tuple: List of valid BatteryTelemetry and list of errors with the index of the invalid items
+    """
+    readings = []
+    errors = []
+    latest_timestamp = timezone.now() + settings.TELEMETRY_MAX_CLOCK_SKEW
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'detail': 'Invalid reading.'})
+            continue
+
+        drone_id = item.get('id')
+        serial_number = item.get('serial_number')
+        battery_capacity = item.get('battery_capacity')
+        timestamp = _parse_timestamp(item.get('timestamp'))
+
+        if drone_id is None and serial_number is None:
+            errors.append({'index': index, 'detail': 'The drone "id" or "serial_number" is required.'})
+        elif drone_id is not None and (
+            not isinstance(drone_id, int) or isinstance(drone_id, bool) or not -MAX_DRONE_ID - 1 <= drone_id <= MAX_DRONE_ID
+        ):
+            errors.append({'index': index, 'detail': 'Invalid drone id.'})
+        elif drone_id is None and not isinstance(serial_number, str):
+            errors.append({'index': index, 'detail': 'Invalid drone serial number.'})
+        elif (
+            not isinstance(battery_capacity, (int, float)) or isinstance(battery_capacity, bool)
+            or not 0 <= battery_capacity <= 100
+        ):
+            errors.append({'index': index, 'detail': 'The battery capacity must be a number from 0 to 100.'})
+        elif timestamp is None or timestamp > latest_timestamp:
+            errors.append({'index': index, 'detail': 'Invalid timestamp.'})
+        else:
+            readings.append(BatteryTelemetry(drone_id, serial_number, float(battery_capacity), timestamp))
+
+    return readings, errors
+
+
+def coalesce_battery_telemetry(readings: list) -> tuple:
+    """
+    Resolve the drones of the readings with a single query and keep only the newest reading of every drone.
+
+        Returns:
+            tuple: Dict of drone ID to its newest BatteryTelemetry, list of all the readings of the known
+            drones as (drone ID, timestamp, battery capacity) and list of the unknown drones
+    """
+    ids = {reading.drone_id for reading in readings if reading.drone_id is not None}
+    serial_numbers = {reading.serial_number for reading in readings if reading.drone_id is None}
+
+    known_ids = set()
+    ids_by_serial_number = {}
+
+    for pk, serial_number in Drone.objects.filter(
+        Q(pk__in=ids) | Q(serial_number__in=serial_numbers)
+    ).values_list('pk', 'serial_number'):
+        known_ids.add(pk)
+        ids_by_serial_number.setdefault(serial_number, pk)
+
+    latest = {}
+    resolved = []
+    unknown = []
+
+    for reading in readings:
+        if reading.drone_id is not None:
+            drone_id = reading.drone_id if reading.drone_id in known_ids else None
+        else:
+            drone_id = ids_by_serial_number.get(reading.serial_number)
+
+        if drone_id is None:
+            unknown.append(reading.drone_id if reading.drone_id is not None else reading.serial_number)
+            continue
+
+        resolved.append((drone_id, reading.timestamp, reading.battery_capacity))
+
+        if drone_id not in latest or reading.timestamp > latest[drone_id].timestamp:
+            latest[drone_id] = reading
+
+    return latest, resolved, unknown
+
+
+def update_batteries(latest: dict) -> int:
+    """
+    Write the battery readings with a single CASE update by batch of drones, the readings
+    older than the last one stored for the drone are dropped by the database.
+
+        Parameters:
+            latest (dict): Drone ID to its newest BatteryTelemetry
+
+        Returns:
+            int: Number of updated drones
+    """
+    items = list(latest.items())
+    updated = 0
+    now = timezone.now()
+
+    for i in range(0, len(items), UPDATE_BATCH_SIZE):
+        batch = items[i:i + UPDATE_BATCH_SIZE]
+
+        battery_cases = [When(pk=pk, then=Value(reading.battery_capacity)) for pk, reading in batch]
+        timestamp_cases = [When(pk=pk, then=Value(reading.timestamp)) for pk, reading in batch]
+        timestamp = Case(*timestamp_cases, output_field=DateTimeField())
+
+        updated += Drone.objects.filter(
+            Q(battery_updated_at__isnull=True) | Q(battery_updated_at__lt=timestamp),
+            pk__in=[pk for pk, _ in batch]
+        ).update(
+            battery_capacity=Case(*battery_cases, output_field=FloatField()),
+            battery_updated_at=timestamp,
+            updated_at=now
+        )
+
+        invalidate_drones([pk for pk, _ in batch])
+
+    return updated
+
+
+def ingest_battery_telemetry(items: list, write_buffer: 'BatteryWriteBuffer' = None) -> dict:
+    """
+    Validate and apply a batch of raw battery readings, or add them to the write-behind buffer if given
+
+        Returns:
+            dict: Number of received, applied (or buffered) and stale readings, unknown drones and validation errors
+    """
+    readings, errors = validate_battery_telemetry(items)
+    latest, resolved, unknown = coalesce_battery_telemetry(readings)
+
+    if write_buffer is not None:
+        # Every reading counts as received, the coalescing ratio is the one of the writes saved
+        write_buffer.add(latest, history=resolved, received=len(resolved))
+        # The drones are represented with the buffered readings
+        invalidate_drones(latest)
+
+        return {
+            'received': len(items),
+            'buffered': len(latest),
+            'unknown': unknown,
+            'errors': errors,
+        }
+
+    with transaction.atomic():
+        applied = update_batteries(latest)
+        # Even the out-of-order readings are kept in the history
+        record_battery_readings(resolved)
+
+    return {
+        'received': len(items),
+        'applied': applied,
+        'stale': len(readings) - len(unknown) - applied,
+        'unknown': unknown,
+        'errors': errors,
+    }
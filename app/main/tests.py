@@ -1,12 +1,51 @@
+import csv
+import datetime
+import json
+import os
 import sys
-from io import StringIO
+import tempfile
+import threading
+import time
+import warnings
+from unittest import mock
+from io import BytesIO, StringIO
 
-from django.test import TestCase, Client
-from django.urls import reverse
+import numpy
+from PIL import Image
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, Client, RequestFactory, TransactionTestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.db import connection, transaction
+from django.urls import resolve, reverse
+from django.utils import timezone
 from django.core.management import call_command
+from drf_spectacular.generators import SchemaGenerator
+from rest_framework.request import Request
+from rest_framework.throttling import AnonRateThrottle
 
-from .models import Drone, Medication
-from .exceptions import DroneBatteryTooLowError, DroneInvalidStateError
+from .models import BatteryReading, BatteryRollup, Drone, MediaCleanup, Medication
+from .battery_history import get_battery_history, rollup_battery_history
+from .forecast import Epoch, fit_drain_rates, forecast_battery
+from .dispatcher import Dispatcher
+from .planner import apply_load_plan, branch_and_bound, first_fit_decreasing, plan_loads
+from .media_cleanup import process_media_cleanup, sweep_media_orphans
+from . import async_views, battery_history, images, metrics, response_cache
+from .middleware import profiling_middleware
+from .profiling import aprofile_request, list_profiles, load_profile, summarize_profile
+from .images import schedule_image_variants, variant_name
+from .battery_buffer import BatteryWriteBuffer
+from .management.commands import loadtest_reads
+from .views import DroneViewset
+from .serializers import DroneSerializer, MedicationSerializer
+from .notifications import LEVEL_LOW, BaseNotifier, BatteryNotification, NotificationDispatcher
+from .exceptions import DroneBatteryTooLowError, DroneInvalidStateError, LoadPlanOutdatedError, WeightExceededError
 
 class DroneTestCase(TestCase):
     """
@@ -15,6 +54,9 @@ class DroneTestCase(TestCase):
     fixtures = ['test_data.json']
 
     def setUp(self) -> None:
+        # The cached responses of the drones outlive the rolled back transactions of the tests
+        cache.clear()
+
         self.client = Client(
             HTTP_CONTENT_TYPE='text/json'
         )
@@ -123,6 +165,86 @@ class DroneTestCase(TestCase):
         with self.assertRaises(DroneBatteryTooLowError):
             self.dron_low_battery.set_state(Drone.STATE_LOADING)
 
+    def test_set_state_concurrent_change(self):
+        """
+        Test set new state fails if the drone changed since it was read
+        """
+        stale_drone = Drone.objects.get(pk=self.drone_1.pk)
+
+        self.drone_1.set_state(Drone.STATE_LOADING)
+
+        with self.assertRaises(DroneInvalidStateError):
+            stale_drone.set_state(Drone.STATE_LOADING)
+
+        self.assertEqual(stale_drone.state, Drone.STATE_LOADING)
+
+        # Only the state is written, a concurrent battery update is kept
+        Drone.objects.filter(pk=self.drone_1.pk).update(battery_capacity=60)
+        self.drone_1.set_state(Drone.STATE_LOADED)
+        self.drone_1.refresh_from_db()
+
+        self.assertEqual(self.drone_1.state, Drone.STATE_LOADED)
+        self.assertEqual(self.drone_1.battery_capacity, 60)
+
+    def test_set_state_deleted_drone(self):
+        """
+        Test set new state fails with "DoesNotExist" if the drone was deleted since it was read
+        """
+        stale_drone = Drone.objects.get(pk=self.drone_1.pk)
+        Drone.objects.filter(pk=self.drone_1.pk).delete()
+
+        with self.assertRaises(Drone.DoesNotExist):
+            stale_drone.set_state(Drone.STATE_LOADING)
+
+    def test_bulk_set_state_concurrent_change(self):
+        """
+        Test bulk set state skips the drones changed between the read and the UPDATE
+        """
+        now = timezone.now
+
+        def concurrent_change():
+            # Called between the read of the drones and the UPDATE
+            Drone.objects.filter(pk=self.drone_1.pk).update(state=Drone.STATE_DELIVERING)
+            return now()
+
+        with mock.patch.object(timezone, 'now', side_effect=concurrent_change):
+            updated_ids, skipped = Drone.objects.filter(pk=self.drone_1.pk).bulk_set_state(Drone.STATE_LOADING)
+
+        self.assertEqual(updated_ids, [])
+        self.assertEqual(skipped, {self.drone_1.pk: DroneInvalidStateError.message})
+        self.assertEqual(Drone.objects.get(pk=self.drone_1.pk).state, Drone.STATE_DELIVERING)
+
+    def test_drone_bulk_set_state_endpoint(self):
+        """
+        Test drone bulk set state endpoint
+        """
+        delivering_drone = Drone.objects.create(
+            serial_number='DRONE_DELIVERING', weight_limit=100, battery_capacity=80, state=Drone.STATE_DELIVERING
+        )
+
+        response = self.client.post(
+            reverse('drone-bulk-set-state'),
+            {
+                'ids': [self.drone_1.pk, self.dron_low_battery.pk, delivering_drone.pk, 0],
+                'state': Drone.STATE_LOADING
+            },
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {
+            'state': Drone.STATE_LOADING,
+            'updated': [self.drone_1.pk],
+            'skipped': [
+                {'id': self.dron_low_battery.pk, 'detail': DroneBatteryTooLowError.message},
+                {'id': delivering_drone.pk, 'detail': DroneInvalidStateError.message},
+                {'id': 0, 'detail': 'Drone does not exist.'},
+            ]
+        })
+
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.state, Drone.STATE_LOADING)
+
     def test_drone_list_view(self):
         """
         Test drone listing endpoint
@@ -131,9 +253,9 @@ class DroneTestCase(TestCase):
 
         self.assertEqual(response.status_code, 200)
 
-        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(len(response.json()['results']), 2)
 
-        ids, serial_number = zip(*map(lambda d: (d['id'], d['serial_number']), response.json()))
+        ids, serial_number = zip(*map(lambda d: (d['id'], d['serial_number']), response.json()['results']))
 
         self.assertIn(self.drone_1.id, ids)
         self.assertIn(self.dron_low_battery.id, ids)
@@ -141,6 +263,201 @@ class DroneTestCase(TestCase):
         self.assertIn(self.drone_1.serial_number, serial_number)
         self.assertIn(self.dron_low_battery.serial_number, serial_number)
 
+    def test_drone_list_view_cursor_pagination(self):
+        """
+        Test drone listing endpoint is paginated by cursor
+        """
+        response = self.client.get(reverse('drone-list'), {'page_size': 1})
+
+        self.assertEqual(response.json()['results'][0]['id'], self.drone_1.id)
+        self.assertIsNone(response.json()['previous'])
+
+        response = self.client.get(response.json()['next'])
+
+        self.assertEqual(response.json()['results'][0]['id'], self.dron_low_battery.id)
+        self.assertIsNone(response.json()['next'])
+
+    def test_drone_list_view_filters(self):
+        """
+        Test drone listing endpoint filtered by state, model, battery and free capacity
+        """
+        loading = Drone.objects.create(
+            serial_number='LOADING', model=Drone.MODEL_MIDDLEWEIGHT, weight_limit=200, battery_capacity=60,
+            state=Drone.STATE_LOADING
+        )
+        url = reverse('drone-list')
+
+        def ids(params):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            return [drone['id'] for drone in response.json()['results']]
+
+        self.assertEqual(ids({'state': [Drone.STATE_LOADING]}), [loading.pk])
+        self.assertEqual(
+            ids({'state': [Drone.STATE_IDLE, Drone.STATE_LOADING]}), [self.drone_1.pk, self.dron_low_battery.pk, loading.pk]
+        )
+        self.assertEqual(ids({'model': [Drone.MODEL_MIDDLEWEIGHT], 'battery_capacity_min': 50}), [loading.pk])
+        self.assertEqual(ids({'battery_capacity_max': 10}), [self.dron_low_battery.pk])
+        self.assertEqual(ids({'min_free_capacity': 120}), [self.dron_low_battery.pk, loading.pk])
+        self.assertEqual(ids({'serial_number': 'DRONE_1'}), [self.drone_1.pk])
+        self.assertEqual(self.client.get(url, {'state': ['FLYING']}).status_code, 400)
+
+    def test_drone_list_view_ordering(self):
+        """
+        Test drone listing endpoint ordered by many fields, through the pages of the cursor
+        """
+        for i in range(3):
+            Drone.objects.create(serial_number=f'DRONE_{i + 2}', weight_limit=100, battery_capacity=50)
+
+        expected = list(Drone.objects.order_by('-battery_capacity', 'serial_number').values_list('pk', flat=True))
+        ids = []
+        response = self.client.get(reverse('drone-list'), {'ordering': '-battery_capacity,serial_number', 'page_size': 2})
+
+        while True:
+            ids.extend(drone['id'] for drone in response.json()['results'])
+
+            if response.json()['next'] is None:
+                break
+
+            response = self.client.get(response.json()['next'])
+
+        self.assertEqual(ids, expected)
+
+        # And back through the previous pages
+        ids = [drone['id'] for drone in response.json()['results']]
+
+        while response.json()['previous'] is not None:
+            response = self.client.get(response.json()['previous'])
+            ids[:0] = [drone['id'] for drone in response.json()['results']]
+
+        self.assertEqual(ids, expected)
+
+        # The next pages are sought by the composite position, not skipped with an offset
+        response = self.client.get(reverse('drone-list'), {'ordering': 'state', 'page_size': 1})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(response.json()['next'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+
+        response = self.client.get(reverse('drone-list'), {'ordering': 'state', 'cursor': 'cD1bIklETEUiXQ=='})
+        self.assertEqual(response.status_code, 404)
+
+        # Not an ordering field, the default ordering is used
+        response = self.client.get(reverse('drone-list'), {'ordering': 'payload_weight'})
+        self.assertEqual(response.json()['results'][0]['id'], self.drone_1.pk)
+
+    def test_medication_list_view_filters(self):
+        """
+        Test medication listing endpoint filtered by code and drone assignment
+        """
+        self.drone_1.set_state(Drone.STATE_LOADING)
+        self.drone_1.load_medication_item(self.med_item)
+        url = reverse('medication-list')
+
+        def ids(params):
+            return [item['id'] for item in self.client.get(url, params).json()['results']]
+
+        self.assertEqual(ids({'code': 'ASP_755'}), [self.med_item.pk])
+        self.assertEqual(ids({'code__in': 'ASP_755,TO_HEAVY_ITEM'}), [self.med_item_to_heavy.pk, self.med_item.pk])
+        self.assertEqual(ids({'drone': self.drone_1.pk}), [self.med_item.pk])
+        self.assertEqual(ids({'loaded': 'false'}), [self.med_item_to_heavy.pk])
+        self.assertEqual(ids({'loaded': 'true', 'ordering': '-weight'}), [self.med_item.pk])
+
+    def test_sparse_fieldsets(self):
+        """
+        Test the "fields" parameter restricts the fields of the listings and the detail
+        """
+        response = self.client.get(reverse('drone-list'), {'fields': 'id,state'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0], {'id': self.drone_1.pk, 'state': Drone.STATE_IDLE})
+
+        response = self.client.get(reverse('drone-detail', kwargs={'pk': self.drone_1.pk}), {'fields': 'current_weight'})
+        self.assertJSONEqual(response.content, {'current_weight': 0.0})
+
+        response = self.client.get(reverse('medication-list'), {'fields': 'code'})
+        self.assertEqual(response.json()['results'][0], {'code': self.med_item_to_heavy.code})
+
+        response = self.client.get(reverse('drone-list'), {'fields': 'id,owner'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('owner', response.json()['fields'])
+        response = self.client.get(reverse('drone-detail', kwargs={'pk': self.drone_1.pk}), {'fields': 'owner'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_row_serializers_match_model_serializers(self):
+        """
+        Test the listings built from the rows are the same as the ones of the model serializers
+        """
+        self.drone_1.set_state(Drone.STATE_LOADING)
+        self.drone_1.load_medication_item(self.med_item)
+        context = {'request': Request(RequestFactory().get('/'))}
+
+        response = self.client.get(reverse('drone-list'), {'page_size': 100})
+        drones = Drone.objects.with_free_capacity().order_by('id')
+        self.assertEqual(response.json()['results'], DroneSerializer(drones, many=True, context=context).data)
+
+        response = self.client.get(reverse('medication-list'), {'page_size': 100})
+        medication_items = Medication.objects.order_by('id')
+        self.assertEqual(
+            response.json()['results'], MedicationSerializer(medication_items, many=True, context=context).data
+        )
+
+    def test_benchmark_serializers_command(self):
+        """
+        Test the serializers benchmark checks the JSON of both serializers and rolls back its rows
+        """
+        out = StringIO()
+        call_command('benchmark_serializers', rows=20, repeat=1, stdout=out)
+
+        self.assertIn('drone', out.getvalue())
+        self.assertIn('medication', out.getvalue())
+        self.assertFalse(Drone.objects.filter(serial_number__startswith='BENCHMARK').exists())
+
+    def test_filters_in_schema(self):
+        """
+        Test the filters and the ordering are documented in the OpenAPI schema
+        """
+        schema = SchemaGenerator().get_schema(request=None, public=True)
+        parameters = {
+            parameter['name'] for parameter in schema['paths']['/api/main/drone/']['get']['parameters']
+        }
+
+        self.assertTrue({'state', 'model', 'battery_capacity_min', 'min_free_capacity', 'ordering'} <= parameters)
+
+        # Only on the listings
+        for path in ('can_carry', 'get_available_drones_for_load', 'telemetry_stats'):
+            operation = schema['paths'][f'/api/main/drone/{path}/']['get']
+            parameters = {parameter['name'] for parameter in operation.get('parameters', [])}
+            self.assertFalse({'state', 'battery_capacity_min', 'cursor'} & parameters, path)
+
+    def test_drone_list_view_changed_since(self):
+        """
+        Test drone listing endpoint only with the drones changed since a checkpoint
+        """
+        checkpoint = timezone.now()
+
+        Drone.objects.filter(pk=self.dron_low_battery.pk).update(battery_capacity=50, updated_at=timezone.now())
+
+        response = self.client.get(reverse('drone-list'), {'changed_since': checkpoint.isoformat()})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d['id'] for d in response.json()['results']], [self.dron_low_battery.id])
+
+        # Without offset the checkpoint is in UTC, without "naive datetime" warning
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            response = self.client.get(
+                reverse('drone-list'), {'changed_since': checkpoint.replace(tzinfo=None).isoformat()}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d['id'] for d in response.json()['results']], [self.dron_low_battery.id])
+
+        response = self.client.get(reverse('drone-list'), {'changed_since': 'yesterday'})
+
+        self.assertEqual(response.status_code, 400)
+
     def test_get_available_drones_for_load(self):
         """
         Test drone listing endpoint
@@ -156,6 +473,45 @@ class DroneTestCase(TestCase):
         self.assertIn(self.drone_1.id, ids)
         self.assertIn(self.drone_1.serial_number, serial_number)
 
+    def test_get_available_drones_for_load_single_query(self):
+        """
+        Test available drones endpoint runs a constant number of queries no matter the number of drones
+        """
+        for i in range(10):
+            Drone.objects.create(serial_number=f'DRONE_BULK_{i}', weight_limit=200, battery_capacity=90)
+
+        # The drones and their battery history
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('drone-get-available-drones-for-load'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 11)
+
+    def test_get_available_drones_for_load_filters(self):
+        """
+        Test available drones endpoint filters, ordering and pagination
+        """
+        self.drone_1.set_state(Drone.STATE_LOADING)
+        self.drone_1.load_medication_item(self.med_item)
+
+        Drone.objects.create(serial_number='DRONE_HW', model=Drone.MODEL_HEAVYWEIGHT, weight_limit=500, battery_capacity=90)
+
+        url = reverse('drone-get-available-drones-for-load')
+
+        response = self.client.get(url, {'min_free_capacity': 50})
+        self.assertEqual([d['serial_number'] for d in response.json()], ['DRONE_HW'])
+
+        response = self.client.get(url, {'model': Drone.MODEL_LIGHTWEIGHT})
+        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(response.json()[0]['current_weight'], self.med_item.weight)
+
+        response = self.client.get(url, {'ordering': '-free_capacity', 'limit': 1})
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(response.json()['results'][0]['serial_number'], 'DRONE_HW')
+
+        response = self.client.get(url, {'min_free_capacity': -1})
+        self.assertEqual(response.status_code, 400)
+
     def test_get_drone_battery(self):
         """
         Test drone battery endpoint
@@ -168,6 +524,70 @@ class DroneTestCase(TestCase):
 
         self.assertJSONEqual(response.content, {"battery_capacity": 100.0})
     
+    def test_drone_telemetry_endpoint(self):
+        """
+        Test drone battery telemetry ingestion endpoint
+        """
+        readings = [
+            {'id': self.drone_1.pk, 'battery_capacity': 80, 'timestamp': '2023-03-03T18:00:00Z'},
+            {'id': self.drone_1.pk, 'battery_capacity': 90, 'timestamp': '2023-03-03T17:00:00Z'},
+            {'serial_number': 'DRON_LOW_BATTERY', 'battery_capacity': 60, 'timestamp': 1677862800},
+            {'serial_number': 'UNKNOWN', 'battery_capacity': 60, 'timestamp': 1677862800},
+            {'id': self.drone_1.pk, 'battery_capacity': 101, 'timestamp': 1677862800},
+        ]
+
+        with self.assertNumQueries(5):
+            response = self.client.post(reverse('drone-telemetry'), readings, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {
+            'received': 5,
+            'applied': 2,
+            'stale': 1,
+            'unknown': ['UNKNOWN'],
+            'errors': [{'index': 4, 'detail': 'The battery capacity must be a number from 0 to 100.'}],
+        })
+
+        self.drone_1.refresh_from_db()
+        self.dron_low_battery.refresh_from_db()
+        self.assertEqual(self.drone_1.battery_capacity, 80)
+        self.assertEqual(self.dron_low_battery.battery_capacity, 60)
+
+        # An older reading than the stored one is dropped
+        response = self.client.post(
+            reverse('drone-telemetry'),
+            '{"id": %d, "battery_capacity": 10, "timestamp": "2023-03-03T17:30:00Z"}\n' % self.drone_1.pk,
+            content_type='application/x-ndjson'
+        )
+
+        self.assertEqual(response.json()['stale'], 1)
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.battery_capacity, 80)
+
+        # Identifiers of other types or out of the range of the database, and a reading from the future
+        response = self.client.post(
+            reverse('drone-telemetry'),
+            [
+                {'serial_number': ['DRONE_1'], 'battery_capacity': 50, 'timestamp': 1677862800},
+                {'serial_number': {'a': 1}, 'battery_capacity': 50, 'timestamp': 1677862800},
+                {'id': 2 ** 70, 'battery_capacity': 50, 'timestamp': 1677862800},
+                {'id': '4', 'battery_capacity': 50, 'timestamp': 1677862800},
+                {'id': self.drone_1.pk, 'battery_capacity': 50, 'timestamp': '2100-01-01T00:00:00Z'},
+            ],
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['errors'], [
+            {'index': 0, 'detail': 'Invalid drone serial number.'},
+            {'index': 1, 'detail': 'Invalid drone serial number.'},
+            {'index': 2, 'detail': 'Invalid drone id.'},
+            {'index': 3, 'detail': 'Invalid drone id.'},
+            {'index': 4, 'detail': 'Invalid timestamp.'},
+        ])
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.battery_capacity, 80)
+
     def test_drone_set_state_endpoint(self):
         """
         Test drone set state endpoint
@@ -181,6 +601,15 @@ class DroneTestCase(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertJSONEqual(response.content, data)
+
+        # The drone is deleted after the view read it
+        with mock.patch.object(Drone, 'set_state', side_effect=Drone.DoesNotExist):
+            response = self.client.post(
+                reverse('drone-set-state', kwargs={'pk': self.drone_1.pk}),
+                {'state': Drone.STATE_LOADED},
+            )
+
+        self.assertEqual(response.status_code, 404)
     
     def test_drone_load_medication_item(self):
         """
@@ -210,6 +639,50 @@ class DroneTestCase(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertJSONEqual(response.content, {"detail":"Drone weight limit exceeded, can\'t load the item."})
 
+    def test_drone_load_medication_items(self):
+        """
+        Test drone batch load medication items endpoint
+        """
+        self.drone_1.set_state(Drone.STATE_LOADING)
+        other_item = Medication.objects.create(name='other', weight=20, code='OTHER')
+
+        with self.assertNumQueries(7):
+            response = self.client.post(
+                reverse('drone-load-medication-items', kwargs={'pk': self.drone_1.pk}),
+                {'medication_item_ids': [self.med_item.pk, other_item.pk, 0]},
+                content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [
+            {'medication_item_id': self.med_item.pk, 'result': Drone.LOAD_RESULT_LOADED},
+            {'medication_item_id': other_item.pk, 'result': Drone.LOAD_RESULT_LOADED},
+            {'medication_item_id': 0, 'result': Drone.LOAD_RESULT_NOT_FOUND},
+        ])
+
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.current_weight, self.med_item.weight + other_item.weight)
+        self.assertEqual(self.drone_1.medications.count(), 2)
+
+    def test_drone_load_medication_items_too_heavy(self):
+        """
+        Test drone batch load medication items endpoint rejects the whole batch if it is too heavy
+        """
+        self.drone_1.set_state(Drone.STATE_LOADING)
+        other_item = Medication.objects.create(name='other', weight=30, code='OTHER')
+
+        response = self.client.post(
+            reverse('drone-load-medication-items', kwargs={'pk': self.drone_1.pk}),
+            {'medication_item_ids': [self.med_item.pk, other_item.pk]},
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.drone_1.medications.count(), 0)
+
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.current_weight, 0)
+
     def test_drone_get_loaded_medication_items(self):
         """
         Test drone to get loaded med items
@@ -231,19 +704,1540 @@ class DroneTestCase(TestCase):
         self.assertEqual(response.json()[0]['name'], self.med_item.name)
         self.assertEqual(response.json()[0]['code'], self.med_item.code)
 
-    def test_check_drones_battery_command(self):
+    async def test_async_read_views(self):
         """
-        Test check_drones_battery command
+        Test the async read views respond like the sync views of the viewset
         """
-        stdout = sys.stdout
+        await Medication.objects.filter(pk=self.med_item.pk).aupdate(drone=self.drone_1)
+        factory = RequestFactory()
+        views = (
+            ('drone-detail', async_views.drone_detail),
+            ('drone-get-battery', async_views.drone_get_battery),
+            ('drone-get-loaded-medication-items', async_views.drone_get_loaded_medication_items),
+        )
 
-        sys.stdout = StringIO()
+        for name, view in views:
+            for pk in (self.drone_1.pk, 0):
+                url = reverse(name, kwargs={'pk': pk})
+                response = await self.async_client.get(url)
+                sync_response = await sync_to_async(view.sync_view)(factory.get(url), pk=pk)
+                await sync_to_async(sync_response.render)()
 
-        call_command('check_drones_battery')
-        
-        output = sys.stdout.getvalue()
-        
-        sys.stdout = stdout
+                self.assertEqual(response.status_code, sync_response.status_code)
+                self.assertEqual(response.json(), json.loads(sync_response.content))
 
-        self.assertIn('Drone DRONE_1 has enough battery to fly', output)
-        self.assertIn('Drone DRON_LOW_BATTERY has low battery', output)
+    async def test_async_detail_delegates_writes(self):
+        """
+        Test the other methods of the drone detail are still served by the viewset
+        """
+        url = reverse('drone-detail', kwargs={'pk': self.drone_1.pk})
+        response = await self.async_client.patch(url, {'battery_capacity': 50}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['battery_capacity'], 50)
+
+        response = await self.async_client.post(reverse('drone-get-battery', kwargs={'pk': self.drone_1.pk}))
+
+        self.assertEqual(response.status_code, 405)
+
+    async def test_async_views_apply_viewset_policies(self):
+        """
+        Test the requests depending on the authentication, throttling or content negotiation of the
+        viewset are served by it
+        """
+        url = reverse('drone-get-battery', kwargs={'pk': self.drone_1.pk})
+
+        # The async client of Django 4.1 sends the extra arguments as the raw headers
+        response = await self.async_client.get(url, authorization='Basic bm9ib2R5Ondyb25n')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {'detail': 'Invalid username/password.'})
+
+        response = await self.async_client.get(url, accept='application/xml')
+        self.assertEqual(response.status_code, 406)
+
+        response = await self.async_client.get(url, accept='application/xml, application/*;q=0.5')
+        self.assertEqual(response.status_code, 200)
+
+        with mock.patch.object(DroneViewset, 'throttle_classes', [AnonRateThrottle]), \
+                mock.patch.object(AnonRateThrottle, 'get_rate', return_value='1/min'):
+            await sync_to_async(cache.clear)()
+            statuses = [(await self.async_client.get(url)).status_code for _ in range(2)]
+
+        self.assertEqual(statuses, [200, 429])
+
+    def test_drone_payload_is_maintained(self):
+        """
+        Test the stored payload of the drone follows the load, detach and delete of medication items
+        """
+        self.drone_1.set_state(Drone.STATE_LOADING)
+        self.drone_1.load_medication_item(self.med_item)
+
+        self.assertEqual(self.drone_1.current_weight, self.med_item.weight)
+        self.assertEqual(self.drone_1.payload_count, 1)
+
+        # Loading it again must not count it twice
+        self.drone_1.load_medication_item(Medication.objects.get(pk=self.med_item.pk))
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.payload_count, 1)
+
+        item = Medication.objects.get(pk=self.med_item.pk)
+        item.drone = None
+        item.save()
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.current_weight, 0)
+        self.assertEqual(self.drone_1.payload_count, 0)
+
+        self.drone_1.load_medication_item(item)
+        item.delete()
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.current_weight, 0)
+        self.assertEqual(self.drone_1.payload_count, 0)
+
+    def test_concurrent_loads_of_the_same_item(self):
+        """
+        Test loading a stale copy of a medication item moves it from the drone it was loaded meanwhile,
+        its weight is only accounted once
+        """
+        drone_2 = Drone.objects.create(serial_number='DRONE_2', weight_limit=500, battery_capacity=100)
+        self.drone_1.set_state(Drone.STATE_LOADING)
+        drone_2.set_state(Drone.STATE_LOADING)
+        stale_item = Medication.objects.get(pk=self.med_item.pk)
+
+        self.drone_1.load_medication_item(Medication.objects.get(pk=self.med_item.pk))
+        drone_2.load_medication_item(stale_item)
+
+        self.drone_1.refresh_from_db()
+        self.assertEqual((self.drone_1.current_weight, self.drone_1.payload_count), (0, 0))
+        self.assertEqual((drone_2.current_weight, drone_2.payload_count), (self.med_item.weight, 1))
+        self.assertEqual(Medication.objects.get(pk=self.med_item.pk).drone_id, drone_2.pk)
+
+    def test_drone_load_rejected_by_stale_instance(self):
+        """
+        Test the weight check is done against the database and not the in-memory drone
+        """
+        self.drone_1.set_state(Drone.STATE_LOADING)
+        stale_drone = Drone.objects.get(pk=self.drone_1.pk)
+
+        self.drone_1.load_medication_item(self.med_item)
+
+        other_item = Medication.objects.create(name='other', weight=50, code='OTHER')
+
+        with self.assertRaises(WeightExceededError):
+            stale_drone.load_medication_item(other_item)
+
+        # Saving the stale instance must not overwrite the payload
+        stale_drone.save()
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.current_weight, self.med_item.weight)
+
+    def test_drone_serializer_without_aggregate(self):
+        """
+        Test drone detail doesn't aggregate the medication items
+        """
+        # The version of the drone (conditional request) and the drone
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('drone-detail', kwargs={'pk': self.drone_1.pk}))
+
+        self.assertEqual(response.json()['current_weight'], 0)
+
+    def test_conditional_get(self):
+        """
+        Test the drone and medication resources respond "304 Not Modified" until they change
+        """
+        urls = [
+            reverse('drone-detail', kwargs={'pk': self.drone_1.pk}),
+            reverse('drone-get-battery', kwargs={'pk': self.drone_1.pk}),
+            reverse('drone-get-loaded-medication-items', kwargs={'pk': self.drone_1.pk}),
+            reverse('drone-list'),
+            reverse('medication-detail', kwargs={'pk': self.med_item.pk}),
+            reverse('medication-list'),
+        ]
+        etags = {}
+        self.drone_1.set_state(Drone.STATE_LOADING)
+        self.drone_1.load_medication_item(self.med_item)
+
+        for url in urls:
+            response = self.client.get(url)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Last-Modified', response.headers)
+            etags[url] = response.headers['ETag']
+
+            # Only the version query
+            with self.assertNumQueries(1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+
+            self.assertEqual(response.status_code, 304)
+
+        # Changes the medication item and the payload of the drone
+        self.med_item.refresh_from_db()
+        self.med_item.weight = 10
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.med_item.save()
+
+        for url in urls:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etags[url])
+
+        response = self.client.get(reverse('drone-detail', kwargs={'pk': 0}), HTTP_IF_NONE_MATCH='*')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_get_query(self):
+        """
+        Test the list ETag depends on the filters, the page and the fields of the query
+        """
+        url = reverse('drone-list')
+        response = self.client.get(url, {'state': Drone.STATE_IDLE, 'fields': 'id'})
+        etag = response.headers['ETag']
+
+        self.assertEqual(response.status_code, 200)
+
+        queries = ({'state': Drone.STATE_LOADING, 'fields': 'id'}, {'state': Drone.STATE_IDLE}, {'page_size': 1}, {})
+
+        for query in queries:
+            response = self.client.get(url, query, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+        # The order of the parameters doesn't matter
+        response = self.client.get(f'{url}?fields=id&state={Drone.STATE_IDLE}', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_response_cache(self):
+        """
+        Test the drone detail and loaded medication items are cached until the drone or its items change
+        """
+        detail_url = reverse('drone-detail', kwargs={'pk': self.drone_1.pk})
+        items_url = reverse('drone-get-loaded-medication-items', kwargs={'pk': self.drone_1.pk})
+        before = response_cache.stats()
+
+        self.client.get(detail_url)
+
+        # Only the version query of the conditional request
+        with self.assertNumQueries(1):
+            response = self.client.get(detail_url)
+
+        self.assertEqual(response.json()['state'], Drone.STATE_IDLE)
+        self.assertEqual(response_cache.stats()['hits'], before['hits'] + 1)
+        self.assertEqual(response_cache.stats()['misses'], before['misses'] + 1)
+        self.assertEqual(self.client.get(items_url).json(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drone_1.set_state(Drone.STATE_LOADING)
+            self.drone_1.load_medication_item(self.med_item)
+
+        self.assertEqual(self.client.get(detail_url).json()['state'], Drone.STATE_LOADING)
+        self.assertEqual([item['id'] for item in self.client.get(items_url).json()], [self.med_item.pk])
+
+        # Bulk update of the batteries, without signals
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('drone-telemetry'),
+                [{'id': self.drone_1.pk, 'battery_capacity': 42, 'timestamp': timezone.now().isoformat()}],
+                content_type='application/json'
+            )
+
+        self.assertEqual(self.client.get(detail_url).json()['battery_capacity'], 42)
+
+        response = self.client.get(reverse('drone-response-cache-stats'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hit_ratio', response.json())
+
+    def test_plan_loads(self):
+        """
+        Test the planner endpoint only plans the items that fit and applies the plan
+        """
+        url = reverse('drone-plan-loads')
+        response = self.client.post(url, {'mode': 'exact'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['assignments'], [
+            {'drone_id': self.drone_1.pk, 'medication_item_ids': [self.med_item.pk]}
+        ])
+        self.assertEqual(response.json()['unassigned'], [self.med_item_to_heavy.pk])
+        self.assertFalse(Medication.objects.filter(drone__isnull=False).exists())
+
+        response = self.client.post(url, {'apply': True}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.state, Drone.STATE_LOADING)
+        self.assertEqual(list(self.drone_1.medications.all()), [self.med_item])
+        self.assertEqual(self.drone_1.current_weight, self.med_item.weight)
+
+    def test_apply_outdated_load_plan(self):
+        """
+        Test a plan with an item loaded in the meantime is rejected
+        """
+        plan = plan_loads()
+        self.drone_1.set_state(Drone.STATE_LOADING)
+        self.drone_1.load_medication_item(self.med_item)
+
+        with self.assertRaises(LoadPlanOutdatedError):
+            apply_load_plan(plan)
+
+    def test_dispatcher(self):
+        """
+        Test the dispatcher loads the pending items by priority into the drones where they still fit
+        """
+        urgent = Medication.objects.create(name='urgent', weight=50, code='URGENT', priority=5)
+        dispatcher = Dispatcher()
+
+        cycle = dispatcher.run_once()
+
+        self.assertEqual(cycle['assigned'], 1)
+        # The aspirin doesn't fit anymore, the heavy item never fits and is out of the queue
+        self.assertEqual(cycle['queue_depth'], 1)
+        self.assertEqual(cycle['dead_letter'], 1)
+        urgent.refresh_from_db()
+        self.assertEqual(urgent.drone, self.drone_1)
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.state, Drone.STATE_LOADING)
+
+        light = Medication.objects.create(name='light', weight=30, code='LIGHT')
+        cycle = dispatcher.run_once()
+
+        self.assertEqual(cycle['assigned'], 1)
+        light.refresh_from_db()
+        self.assertEqual(light.drone, self.drone_1)
+        self.assertEqual(dispatcher.stats()['assigned'], 2)
+
+    def test_dispatcher_drops_deleted_and_requeues_dead_letters(self):
+        """
+        Test the deleted items leave the queue, and the dead letters are queued again once they can fit
+        """
+        Medication.objects.create(name='urgent', weight=50, code='URGENT', priority=5)
+        dispatcher = Dispatcher()
+        dispatcher.run_once()
+
+        self.med_item.delete()
+        cycle = dispatcher.run_once()
+
+        self.assertEqual(cycle['queue_depth'], 0)
+        self.assertEqual(cycle['dead_letter'], 1)
+
+        # The unchanged dead letter read again by the overlap of the checkpoint stays out of the queue
+        self.assertEqual(dispatcher.run_once()['queue_depth'], 0)
+
+        # Fits next to the urgent item
+        Medication.objects.filter(pk=self.med_item_to_heavy.pk).update(weight=40, updated_at=timezone.now())
+        cycle = dispatcher.run_once()
+
+        self.assertEqual(cycle['assigned'], 1)
+        self.assertEqual((cycle['queue_depth'], cycle['dead_letter']), (0, 0))
+
+        Medication.objects.create(name='huge', weight=400, code='HUGE')
+
+        self.assertEqual(dispatcher.run_once()['dead_letter'], 1)
+
+        Drone.objects.create(serial_number='HEAVY', model=Drone.MODEL_HEAVYWEIGHT, weight_limit=500, battery_capacity=100)
+        cycle = dispatcher.run_once()
+
+        self.assertEqual(cycle['assigned'], 1)
+        self.assertEqual(cycle['dead_letter'], 0)
+
+    def test_dispatch_medications_command(self):
+        """
+        Test a single dispatch cycle by the command
+        """
+        out = StringIO()
+        call_command('dispatch_medications', '--once', stdout=out)
+
+        self.assertIn('1 items assigned to 1 drones', out.getvalue())
+        self.med_item.refresh_from_db()
+        self.assertEqual(self.med_item.drone, self.drone_1)
+
+    def test_can_carry(self):
+        """
+        Test the drones that can carry a weight are ordered best fit first
+        """
+        big = Drone.objects.create(
+            serial_number='BIG', model=Drone.MODEL_HEAVYWEIGHT, weight_limit=200, battery_capacity=100
+        )
+        small = Drone.objects.create(serial_number='SMALL', weight_limit=80, battery_capacity=100)
+        Drone.objects.create(serial_number='TINY', weight_limit=60, battery_capacity=100)
+        url = reverse('drone-can-carry')
+
+        response = self.client.get(url, {'weight': 70})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([drone['id'] for drone in response.json()], [small.pk, self.drone_1.pk, big.pk])
+        self.assertEqual(response.json()[0]['free_capacity'], 80)
+
+        response = self.client.get(url, {'medication_item_id': self.med_item.pk, 'limit': 1})
+
+        self.assertEqual([drone['id'] for drone in response.json()], [small.pk])
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'medication_item_id': 0}).status_code, 400)
+
+    def test_serial_number_is_unique(self):
+        """
+        Test a drone can't be registered with the serial number of another one
+        """
+        response = self.client.post(
+            reverse('drone-list'),
+            {'serial_number': self.drone_1.serial_number, 'model': 'LW', 'weight_limit': 100, 'battery_capacity': 100}
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('serial_number', response.json())
+
+    def test_if_match_write(self):
+        """
+        Test the writes with "If-Match" fail with "412 Precondition Failed" when the resource has changed
+        """
+        url = reverse('drone-detail', kwargs={'pk': self.drone_1.pk})
+        etag = self.client.get(url).headers['ETag']
+
+        response = self.client.patch(
+            url, {'battery_capacity': 90}, content_type='application/json', HTTP_IF_MATCH=etag
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        # Stale version
+        response = self.client.patch(
+            url, {'battery_capacity': 80}, content_type='application/json', HTTP_IF_MATCH=etag
+        )
+
+        self.assertEqual(response.status_code, 412)
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.battery_capacity, 90)
+
+        response = self.client.post(
+            reverse('drone-set-state', kwargs={'pk': self.drone_1.pk}),
+            {'state': Drone.STATE_LOADING}, HTTP_IF_MATCH=etag
+        )
+
+        self.assertEqual(response.status_code, 412)
+
+    def test_recompute_drone_payload_command(self):
+        """
+        Test recompute_drone_payload command
+        """
+        # Attach the item bypassing the payload accounting
+        Medication.objects.filter(pk=self.med_item.pk).update(drone=self.drone_1)
+
+        stdout = StringIO()
+        call_command('recompute_drone_payload', stdout=stdout)
+
+        self.assertIn('Drone DRONE_1 has a wrong payload', stdout.getvalue())
+
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.current_weight, self.med_item.weight)
+        self.assertEqual(self.drone_1.payload_count, 1)
+
+    def test_drone_export_ndjson(self):
+        """
+        Test drone export endpoint in NDJSON
+        """
+        response = self.client.get(reverse('drone-export'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual([row['serial_number'] for row in rows], ['DRONE_1', 'DRON_LOW_BATTERY'])
+        self.assertEqual(rows[0]['current_weight'], 0)
+
+    def test_medication_export_csv(self):
+        """
+        Test medication export endpoint in CSV
+        """
+        response = self.client.get(reverse('medication-export'), {'export_format': 'csv'})
+
+        self.assertEqual(response.status_code, 200)
+
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+
+        self.assertEqual([row['code'] for row in rows], ['TO_HEAVY_ITEM', 'ASP_755'])
+
+    def test_export_table_command(self):
+        """
+        Test export_table command
+        """
+        stdout = StringIO()
+        call_command('export_table', 'medication', '--format', 'csv', '--chunk-size', '1', stdout=stdout)
+
+        lines = stdout.getvalue().splitlines()
+
+        self.assertEqual(lines[0], 'id,name,weight,code,priority,image,drone_id,created_at,updated_at')
+        self.assertEqual(len(lines), 3)
+
+    def test_check_drones_battery_command(self):
+        """
+        Test check_drones_battery command
+        """
+        stdout = sys.stdout
+
+        sys.stdout = StringIO()
+
+        with self.assertLogs('main.notifications', 'WARNING'):
+            call_command('check_drones_battery', verbosity=2)
+        
+        output = sys.stdout.getvalue()
+        
+        sys.stdout = stdout
+
+        self.assertIn('Drone DRONE_1 has enough battery to fly', output)
+        self.assertIn('Drone DRON_LOW_BATTERY has critical battery', output)
+        self.assertIn('1 drones with critical battery, 0 with low battery, 1 with enough battery to fly', output)
+
+    def test_check_drones_battery_command_notifications(self):
+        """
+        Test check_drones_battery command sends the notifications through the configured backends
+        """
+        Drone.objects.create(serial_number='DRONE_LOW', weight_limit=100, battery_capacity=20)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'notifications.jsonl')
+            notifiers = [{'BACKEND': 'main.notifications.FileNotifier', 'OPTIONS': {'PATH': path}}]
+
+            with self.settings(DRONE_BATTERY_NOTIFIERS=notifiers):
+                stdout = StringIO()
+                call_command('check_drones_battery', stdout=stdout)
+
+            with open(path) as notifications_file:
+                notifications = [json.loads(line) for line in notifications_file]
+
+        self.assertNotIn('DRONE_1', stdout.getvalue())
+        self.assertIn('Drone DRONE_LOW has low battery', stdout.getvalue())
+        self.assertEqual(
+            sorted((n['serial_number'], n['level']) for n in notifications),
+            [('DRONE_LOW', 'LOW'), ('DRON_LOW_BATTERY', 'CRITICAL')]
+        )
+
+    def test_check_drones_battery_watch_notifies_changes(self):
+        """
+        Test check_drones_battery command watching the drones notifies them only when their level changes
+        """
+        drone_low = Drone.objects.create(serial_number='DRONE_LOW', weight_limit=100, battery_capacity=20)
+        # The battery of DRONE_LOW before the checks after the first one, then the command is stopped
+        batteries = iter([20, 2, 80, 20])
+
+        def sleep(seconds):
+            try:
+                Drone.objects.filter(pk=drone_low.pk).update(battery_capacity=next(batteries))
+            except StopIteration:
+                raise KeyboardInterrupt
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'notifications.jsonl')
+            notifiers = [{'BACKEND': 'main.notifications.FileNotifier', 'OPTIONS': {'PATH': path}}]
+
+            with self.settings(DRONE_BATTERY_NOTIFIERS=notifiers), \
+                    mock.patch('main.management.commands.check_drones_battery.time.sleep', sleep):
+                call_command('check_drones_battery', watch=1, stdout=StringIO())
+
+            with open(path) as notifications_file:
+                notifications = [json.loads(line) for line in notifications_file]
+
+        self.assertEqual(
+            sorted((n['serial_number'], n['level']) for n in notifications),
+            [('DRONE_LOW', 'CRITICAL'), ('DRONE_LOW', 'LOW'), ('DRONE_LOW', 'LOW'), ('DRON_LOW_BATTERY', 'CRITICAL')]
+        )
+
+
+class MetricsTestCase(TestCase):
+    """
+    Test the metrics of the requests and of the drones
+    """
+    fixtures = ['test_data.json']
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.drone_1 = Drone.objects.get(serial_number='DRONE_1')
+        self.med_item_to_heavy = Medication.objects.get(code='TO_HEAVY_ITEM')
+
+    def test_request_metrics(self):
+        """
+        Test the latency and the SQL queries of the requests are recorded by view
+        """
+        requests = metrics.REQUESTS.value('drone-list', 'GET', '200')
+        latencies = metrics.REQUEST_DURATION.count('drone-list', 'GET')
+        query_seconds = metrics.QUERY_DURATION.value('drone-list', 'GET')
+
+        self.client.get(reverse('drone-list'))
+
+        self.assertEqual(metrics.REQUESTS.value('drone-list', 'GET', '200'), requests + 1)
+        self.assertEqual(metrics.REQUEST_DURATION.count('drone-list', 'GET'), latencies + 1)
+        self.assertGreater(metrics.QUERY_DURATION.value('drone-list', 'GET'), query_seconds)
+
+        self.client.get('/not-found/')
+        self.assertGreater(metrics.REQUESTS.value(metrics.UNMATCHED_VIEW, 'GET', '404'), 0)
+
+    async def test_async_request_metrics(self):
+        """
+        Test the SQL queries of the async views are recorded
+        """
+        query_seconds = metrics.QUERY_DURATION.value('drone-get-battery', 'GET')
+
+        response = await self.async_client.get(reverse('drone-get-battery', kwargs={'pk': self.drone_1.pk}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(metrics.QUERY_DURATION.value('drone-get-battery', 'GET'), query_seconds)
+
+    def test_domain_counters(self):
+        """
+        Test the committed state transitions and loads, and the rejected operations, are counted
+        """
+        transitions = metrics.STATE_TRANSITIONS.value(Drone.STATE_IDLE, Drone.STATE_LOADING)
+        rejections = metrics.REJECTIONS.value('load_medication_item', 'WeightExceededError')
+        loaded = metrics.MEDICATION_ITEMS_LOADED.value()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('drone-set-state', kwargs={'pk': self.drone_1.pk}), {'state': Drone.STATE_LOADING}
+            )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('drone-load-medication-item', kwargs={'pk': self.drone_1.pk}),
+                {'medication_item_id': self.med_item_to_heavy.pk}
+            )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(metrics.STATE_TRANSITIONS.value(Drone.STATE_IDLE, Drone.STATE_LOADING), transitions + 1)
+        self.assertEqual(metrics.REJECTIONS.value('load_medication_item', 'WeightExceededError'), rejections + 1)
+        self.assertEqual(metrics.MEDICATION_ITEMS_LOADED.value(), loaded)
+
+    def test_metrics_endpoint(self):
+        """
+        Test the metrics are served in the Prometheus text format
+        """
+        self.client.get(reverse('drone-list'))
+
+        response = self.client.get(reverse('metrics'))
+        content = response.content.decode()
+
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn('# TYPE drones_http_request_duration_seconds histogram', content)
+        self.assertIn('drones_http_request_duration_seconds_bucket{view="drone-list",method="GET",le="+Inf"}', content)
+        self.assertIn('drones_http_requests_total{view="drone-list",method="GET",status="200"}', content)
+        self.assertIn('drones_response_cache_hits_total', content)
+
+
+class ProfilingTestCase(TestCase):
+    """
+    Test the profiling of single requests
+    """
+    fixtures = ['test_data.json']
+
+    def setUp(self) -> None:
+        profiles_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(profiles_directory.cleanup)
+
+        self.profiling = dict(
+            settings.PROFILING, ENABLED=True, SECRET='s3cret', DIRECTORY=profiles_directory.name, MAX_PROFILES=2
+        )
+        settings_override = override_settings(PROFILING=self.profiling)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_profile_with_secret(self):
+        """
+        Test a request with the secret is profiled with its SQL queries
+        """
+        response = self.client.get(reverse('drone-list'), HTTP_X_PROFILE='s3cret')
+
+        self.assertEqual(response.status_code, 200)
+        profile = load_profile(response['X-Profile-Id'])
+        self.assertEqual(profile['view'], 'drone-list')
+        self.assertGreater(profile['query_count'], 0)
+        self.assertEqual(len(profile['queries']), profile['query_count'])
+        self.assertIn('list', summarize_profile(response['X-Profile-Id']))
+
+        # Without the secret, or from a user not in the staff
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('drone-list'), HTTP_X_PROFILE='wrong'))
+
+        user = User.objects.create_user('operator')
+        self.client.force_login(user)
+        self.assertNotIn('X-Profile-Id', self.client.get(reverse('drone-list'), HTTP_X_PROFILE='1'))
+
+        user.is_staff = True
+        user.save()
+        self.assertIn('X-Profile-Id', self.client.get(reverse('drone-list'), HTTP_X_PROFILE='1'))
+
+    def test_sampled_profiles_ring(self):
+        """
+        Test the sampled requests are profiled and only the newest profiles are kept
+        """
+        self.profiling['SAMPLE_RATE'] = 1
+        profile_ids = [self.client.get(reverse('drone-list'))['X-Profile-Id'] for _ in range(3)]
+
+        self.assertEqual([profile['id'] for profile in list_profiles()], profile_ids[1:])
+        self.assertEqual(len(os.listdir(self.profiling['DIRECTORY'])), 4)
+
+    def test_other_files_are_skipped(self):
+        """
+        Test the files of the directory not named like a profile are not listed nor pruned
+        """
+        for name in ('notes.json', '1-2.json', '.1-2-3.json'):
+            with open(os.path.join(self.profiling['DIRECTORY'], name), 'w') as f:
+                f.write('{}')
+
+        profile_id = self.client.get(reverse('drone-list'), HTTP_X_PROFILE='s3cret')['X-Profile-Id']
+
+        self.assertEqual([profile['id'] for profile in list_profiles()], [profile_id])
+        self.assertTrue(os.path.exists(os.path.join(self.profiling['DIRECTORY'], 'notes.json')))
+
+    async def test_profile_async_request(self):
+        """
+        Test the requests served by the async views are profiled without leaving the event loop
+        """
+        with mock.patch('main.middleware.aprofile_request', wraps=aprofile_request) as profile:
+            # The async client of Django 4.1 sends the extra arguments as the raw headers
+            response = await self.async_client.get(
+                reverse('drone-get-battery', kwargs={'pk': 4}), **{'x-profile': 's3cret'}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        profile.assert_called_once()
+        profile = await sync_to_async(load_profile)(response['X-Profile-Id'])
+        self.assertEqual(profile['view'], 'drone-get-battery')
+        self.assertGreater(profile['query_count'], 0)
+
+    def test_profiles_command(self):
+        """
+        Test the command lists and summarises the stored profiles
+        """
+        profile_id = self.client.get(reverse('medication-list'), HTTP_X_PROFILE='s3cret')['X-Profile-Id']
+
+        out = StringIO()
+        call_command('profiles', stdout=out)
+        self.assertIn(profile_id, out.getvalue())
+
+        out = StringIO()
+        call_command('profiles', profile_id, sort='tottime', limit=5, stdout=out)
+        self.assertIn('SQL queries', out.getvalue())
+        self.assertIn('medication', out.getvalue())
+
+    def test_disabled(self):
+        """
+        Test the middleware is not installed when the profiling is disabled
+        """
+        self.profiling['ENABLED'] = False
+
+        with self.assertRaises(MiddlewareNotUsed):
+            profiling_middleware(lambda request: None)
+
+
+class LoadPlannerTestCase(SimpleTestCase):
+    """
+    Test the packing of the medication items into the drones
+    """
+
+    def test_first_fit_decreasing(self):
+        """
+        Test the heaviest items go first into the drones already carrying items, then the biggest ones
+        """
+        plan = first_fit_decreasing(
+            [(1, 60), (2, 50), (3, 30), (4, 600)],
+            [(10, 100, False), (11, 200, False), (12, 50, True)]
+        )
+
+        self.assertEqual(plan.assignments, {12: [2], 11: [1, 3]})
+        self.assertEqual(plan.unassigned, [4])
+        self.assertEqual(plan.drones_used, 2)
+
+    def test_branch_and_bound(self):
+        """
+        Test the exact mode packs the items left out by first-fit decreasing
+        """
+        items = [(1, 45), (2, 45), (3, 35), (4, 35), (5, 20), (6, 20)]
+        drones = [(10, 100, False), (11, 100, False)]
+
+        self.assertEqual(len(first_fit_decreasing(items, drones).unassigned), 1)
+
+        plan = branch_and_bound(items, drones)
+
+        self.assertEqual(plan.unassigned, [])
+        self.assertEqual(plan.drones_used, 2)
+
+        for item_ids in plan.assignments.values():
+            self.assertEqual(sum(dict(items)[pk] for pk in item_ids), 100)
+
+    def test_first_fit_decreasing_scale(self):
+        """
+        Test 10k items are packed into 1k drones quickly
+        """
+        items = [(pk, 1 + pk % 200) for pk in range(10000)]
+        drones = [(pk, (100, 150, 300, 500)[pk % 4], False) for pk in range(1000)]
+
+        start = time.perf_counter()
+        plan = first_fit_decreasing(items, drones)
+
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(len(plan.assignments), 1000)
+
+
+class LoadTestReadsTestCase(TransactionTestCase):
+    """
+    Test the load test of the read endpoints, its threads need the data committed
+    """
+    fixtures = ['test_data.json']
+
+    def test_loadtest_reads_command(self):
+        """
+        Test the load test reports both paths of the endpoints
+        """
+        out = StringIO()
+        call_command('loadtest_reads', '--requests', '4', '--concurrency', '2', '--endpoint', 'get_battery', stdout=out)
+
+        self.assertEqual(out.getvalue().count('get_battery'), 2)
+        self.assertIn('p99', out.getvalue())
+
+        # The paths are the ones of the async views
+        for url, view in loadtest_reads.ENDPOINTS.values():
+            self.assertIs(resolve(url.format(pk=1)).func, view)
+
+
+class MedicationImageTestCase(TestCase):
+    """
+    Test the variants of the medication images
+    """
+
+    def setUp(self) -> None:
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+
+        media_cleanup = dict(settings.MEDIA_CLEANUP, BACKGROUND=False, REUSE_GRACE_PERIOD=datetime.timedelta(0))
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root.name, MEDICATION_IMAGE_WORKERS=0, MEDIA_CLEANUP=media_cleanup
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def create_image(self, size=(800, 600), image_format='PNG') -> SimpleUploadedFile:
+        content = BytesIO()
+        Image.new('RGB', size, 'red').save(content, image_format)
+        return SimpleUploadedFile(f'photo.{image_format.lower()}', content.getvalue())
+
+    def post_medication(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('medication-list'),
+                {'name': 'aspirin', 'weight': 10, 'code': 'ASP', 'image': image}
+            )
+
+    def test_image_variants_are_generated(self):
+        """
+        Test the variants are generated after the medication item is created and deleted with it
+        """
+        response = self.post_medication(self.create_image())
+
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.json()['image_variants'])
+
+        medication = Medication.objects.get(pk=response.json()['id'])
+
+        self.assertEqual(set(medication.image_variants), {'thumbnail', 'web'})
+
+        with Image.open(medication.image.storage.path(medication.image_variants['thumbnail'])) as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+            self.assertEqual(thumbnail.size, (128, 96))
+
+        response = self.client.get(reverse('medication-detail', kwargs={'pk': medication.pk}))
+
+        self.assertTrue(response.json()['image_variants']['thumbnail'].endswith('.thumbnail.webp'))
+
+        paths = [medication.image.storage.path(name) for name in medication.image_variants.values()]
+        medication.delete()
+        process_media_cleanup()
+
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_replaced_image_is_deleted(self):
+        """
+        Test the previous image and its variants are deleted once the image is replaced
+        """
+        medication = Medication.objects.get(pk=self.post_medication(self.create_image()).json()['id'])
+        paths = [medication.image.path] + [
+            medication.image.storage.path(name) for name in medication.image_variants.values()
+        ]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse('medication-detail', kwargs={'pk': medication.pk}),
+                encode_multipart(BOUNDARY, {'image': self.create_image(size=(400, 300))}),
+                content_type=MULTIPART_CONTENT
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(process_media_cleanup(), 1)
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+        medication.refresh_from_db()
+
+        self.assertTrue(os.path.exists(medication.image.path))
+        self.assertEqual(set(medication.image_variants), {'thumbnail', 'web'})
+
+    def test_image_urls_in_listing(self):
+        """
+        Test the listing built from the rows has the absolute URLs of the image and its variants
+        """
+        self.post_medication(self.create_image())
+
+        response = self.client.get(reverse('medication-list'))
+        medication_item = response.json()['results'][0]
+
+        self.assertTrue(medication_item['image'].startswith('http://testserver/'))
+        self.assertEqual(set(medication_item['image_variants']), set(settings.MEDICATION_IMAGE_VARIANTS))
+        self.assertEqual(medication_item, MedicationSerializer(
+            Medication.objects.get(), context={'request': response.wsgi_request}
+        ).data)
+
+    def test_identical_images_are_shared(self):
+        """
+        Test identical images are stored once, and deleted with the last medication item using it
+        """
+        first = Medication.objects.get(pk=self.post_medication(self.create_image()).json()['id'])
+        second = Medication.objects.get(pk=self.post_medication(self.create_image()).json()['id'])
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^uploads/medications/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        # The variants of the first one are reused
+        self.assertEqual(first.image_variants, second.image_variants)
+
+        path = first.image.path
+
+        first.delete()
+        process_media_cleanup()
+        self.assertTrue(os.path.exists(path))
+
+        second.delete()
+        process_media_cleanup()
+        self.assertFalse(os.path.exists(path))
+
+    def test_reused_files_are_touched_or_restored(self):
+        """
+        Test saving a content already stored touches the file, and stores it again if it was deleted
+        """
+        storage = Medication._meta.get_field('image').storage
+        name = storage.save('uploads/medications/photo.png', BytesIO(b'content'))
+        past = time.time() - 3600
+        os.utime(storage.path(name), (past, past))
+
+        self.assertEqual(storage.save('uploads/medications/photo.png', BytesIO(b'content')), name)
+        self.assertGreater(os.path.getmtime(storage.path(name)), past)
+
+        # Deleted by the cleanup between the check of the references and the commit of the row
+        storage.delete(name)
+
+        self.assertEqual(storage.save('uploads/medications/photo.png', BytesIO(b'content')), name)
+        self.assertTrue(storage.exists(name))
+
+    def test_recently_reused_files_stay_queued(self):
+        """
+        Test a file reused by an upload in the grace period isn't deleted, its entry is kept for a later run
+        """
+        medication = Medication.objects.get(pk=self.post_medication(self.create_image()).json()['id'])
+        path = medication.image.path
+        medication.delete()
+
+        with override_settings(MEDIA_CLEANUP=dict(settings.MEDIA_CLEANUP, REUSE_GRACE_PERIOD=datetime.timedelta(hours=1))):
+            self.assertEqual(process_media_cleanup(), 0)
+
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(MediaCleanup.objects.count(), 1)
+
+        self.assertEqual(process_media_cleanup(), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_bulk_delete_queues_with_one_insert(self):
+        """
+        Test the media files of a bulk delete are queued with a single INSERT
+        """
+        for size in ((100, 100), (200, 100), (300, 100)):
+            self.post_medication(self.create_image(size))
+
+        with CaptureQueriesContext(connection) as queries:
+            Medication.objects.exclude(image='').delete()
+
+        inserts = [query for query in queries.captured_queries if query['sql'].startswith('INSERT INTO "main_mediacleanup"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(MediaCleanup.objects.count(), 3)
+
+    def test_media_cleanup_is_deferred(self):
+        """
+        Test the files are deleted after the delete is committed, not when it's rolled back
+        """
+        medication = Medication.objects.get(pk=self.post_medication(self.create_image()).json()['id'])
+        path = medication.image.path
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Medication.objects.get(pk=medication.pk).delete()
+            raise RuntimeError
+
+        self.assertFalse(MediaCleanup.objects.exists())
+
+        medication.delete()
+
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(MediaCleanup.objects.count(), 1)
+
+        # The file is used again before the queue is processed
+        again = Medication.objects.get(pk=self.post_medication(self.create_image()).json()['id'])
+
+        self.assertEqual(process_media_cleanup(), 0)
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(MediaCleanup.objects.exists())
+
+        again.delete()
+
+        self.assertEqual(process_media_cleanup(), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_cleanup_media_sweep(self):
+        """
+        Test the sweep deletes the orphan files older than the grace period only
+        """
+        medication = Medication.objects.get(pk=self.post_medication(self.create_image()).json()['id'])
+        orphan = default_storage.save('uploads/medications/orphan.png', BytesIO(b'orphan'))
+        recent = default_storage.save('uploads/medications/recent.png', BytesIO(b'recent'))
+        past = time.time() - 7200
+        os.utime(default_storage.path(orphan), (past, past))
+
+        out = StringIO()
+        call_command('cleanup_media', '--sweep', '--dry-run', stdout=out)
+
+        self.assertIn(orphan, out.getvalue())
+        self.assertTrue(default_storage.exists(orphan))
+
+        call_command('cleanup_media', '--sweep', stdout=StringIO())
+
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(recent))
+        self.assertTrue(os.path.exists(medication.image.path))
+        self.assertTrue(all(default_storage.exists(name) for name in medication.image_variants.values()))
+
+    def test_cleanup_media_sweep_rechecks_references(self):
+        """
+        Test the sweep keeps an orphan file referenced by a medication item after it was listed
+        """
+        orphan = default_storage.save('uploads/medications/orphan.png', BytesIO(b'orphan'))
+        variant = default_storage.save('uploads/medications/orphan.thumbnail.webp', BytesIO(b'variant'))
+        past = time.time() - 7200
+
+        for name in (orphan, variant):
+            os.utime(default_storage.path(name), (past, past))
+
+        walk = os.walk
+
+        def walk_then_reference(path):
+            yield from walk(path)
+            Medication.objects.create(name='late', weight=1, code='LATE', image=orphan)
+
+        with mock.patch('main.media_cleanup.os.walk', walk_then_reference):
+            self.assertEqual(sweep_media_orphans(), [])
+
+        self.assertTrue(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(variant))
+
+    def test_image_header_validation(self):
+        """
+        Test the format and dimensions of the image are validated
+        """
+        response = self.post_medication(SimpleUploadedFile('photo.png', b'not an image'))
+        self.assertEqual(response.status_code, 400)
+
+        response = self.post_medication(self.create_image(image_format='BMP'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unsupported image format', response.json()['image'][0])
+
+        with self.settings(MEDICATION_IMAGE_MAX_DIMENSION=500):
+            response = self.post_medication(self.create_image())
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Medication.objects.exists())
+
+    def test_image_variants_in_process_pool(self):
+        """
+        Test the variants are generated by the pool of processes
+        """
+        with self.settings(MEDICATION_IMAGE_WORKERS=1):
+            storage = Medication._meta.get_field('image').storage
+            name = storage.save('uploads/photo.png', self.create_image((64, 64)))
+            done = threading.Event()
+            generated = {}
+
+            def callback(variants):
+                generated.update(variants)
+                done.set()
+
+            schedule_image_variants(storage, name, callback)
+
+            self.assertTrue(done.wait(30))
+            images._executor.shutdown()
+            images._executor = None
+
+        self.assertEqual(generated['web'], variant_name(name, 'web', 'WEBP'))
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Test the hot queries are served by the indexes, not by full table scans
+    """
+
+    def assertIndexed(self, queryset, index=None, sorted_by_index=False):
+        plan = queryset.explain()
+
+        # Any scan of a table is a full scan ("SCAN main_x", "SCAN TABLE main_x", "SCAN main_x USING INDEX ..."
+        # reading the whole index), only the searches ("SEARCH main_x USING INDEX ...") read a range
+        self.assertNotRegex(plan, r'\bSCAN (TABLE )?main_\w+', f'Full table scan:\n{plan}')
+
+        if index is not None:
+            self.assertIn(index, plan)
+
+        if sorted_by_index:
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_drone_queries(self):
+        """
+        Test the availability, the state filters and the lookups by serial number
+        """
+        self.assertIndexed(Drone.objects.available_for_load(), 'drone_state_battery_idx')
+        self.assertIndexed(Drone.objects.available_for_load().filter(model=Drone.MODEL_LIGHTWEIGHT))
+        self.assertIndexed(Drone.objects.filter(state=Drone.STATE_IDLE))
+        self.assertIndexed(Drone.objects.filter(model=Drone.MODEL_HEAVYWEIGHT, state=Drone.STATE_IDLE))
+        self.assertIndexed(Drone.objects.filter(serial_number__in=['DRONE_1', 'DRONE_2']))
+
+    def test_changed_since_queries(self):
+        """
+        Test the listings of the rows changed since a checkpoint are read in the order of the index
+        """
+        now = timezone.now()
+
+        for model, index in ((Drone, 'drone_updated_at_id_idx'), (Medication, 'medication_updated_at_id_idx')):
+            self.assertIndexed(
+                model.objects.filter(updated_at__gte=now).order_by('updated_at', 'id')[:100], index, sorted_by_index=True
+            )
+
+    def test_medication_queries(self):
+        """
+        Test the loaded, pending and shared image medication items and the lookups by code
+        """
+        self.assertIndexed(Medication.objects.filter(drone_id=1))
+        self.assertIndexed(Medication.objects.filter(drone__isnull=True))
+        self.assertIndexed(Medication.objects.filter(code='ASP_755'), 'medication_code_idx')
+        self.assertIndexed(Medication.objects.filter(image='uploads/medications/photo.png'))
+
+    def test_battery_history_queries(self):
+        """
+        Test the battery readings and rollups of a drone by time range
+        """
+        now = timezone.now()
+
+        self.assertIndexed(BatteryReading.objects.filter(drone_id=1, ts__gte=now).order_by('ts'), sorted_by_index=True)
+        self.assertIndexed(BatteryRollup.objects.filter(drone_id=1, resolution=BatteryRollup.RESOLUTION_HOUR))
+
+    def test_can_carry_uses_free_capacity_index(self):
+        """
+        Test the best-fit lookup is a range scan of the free capacity index, without sorting, once
+        the database has the statistics of a fleet.
+
+        The plan depends on ANALYZE: without the statistics, SQLite assumes every index is as selective
+        and picks "drone_state_battery_idx" (then sorts), so the test runs the command "analyze_database"
+        on a fleet like the production one, as the deployments do after loading the drones.
+        """
+        Drone.objects.bulk_create([
+            Drone(
+                serial_number=f'DRONE_{i}',
+                weight_limit=100 + i % 4 * 100,
+                battery_capacity=i % 100,
+                state=(Drone.STATE_IDLE, Drone.STATE_LOADING, Drone.STATE_DELIVERING)[i % 3],
+                payload_weight=i % 90
+            )
+            for i in range(2000)
+        ])
+
+        # Required by the plan, see above
+        call_command('analyze_database', stdout=StringIO())
+
+        self.assertIndexed(
+            Drone.objects.available_for_load(min_free_capacity=50).order_by('free_capacity', 'id')[:10],
+            'drone_free_capacity_idx',
+            sorted_by_index=True
+        )
+
+
+class BatteryHistoryTestCase(TestCase):
+    """
+    Test the battery history of the drones
+    """
+    fixtures = ['test_data.json']
+
+    def setUp(self) -> None:
+        self.drone_1 = Drone.objects.get(serial_number='DRONE_1')
+        self.now = datetime.datetime(2023, 3, 10, 12, 0, tzinfo=datetime.timezone.utc)
+
+    def add_readings(self, *readings):
+        BatteryReading.objects.bulk_create([
+            BatteryReading(drone=self.drone_1, ts=self.now - age, battery_capacity=battery_capacity)
+            for age, battery_capacity in readings
+        ])
+
+    def test_battery_changes_are_recorded(self):
+        """
+        Test the battery changes of the drone are appended to the history
+        """
+        self.drone_1.battery_capacity = 90
+        self.drone_1.save()
+        self.drone_1.set_state(Drone.STATE_LOADING)
+
+        self.client.post(
+            reverse('drone-telemetry'),
+            [{'id': self.drone_1.pk, 'battery_capacity': 80, 'timestamp': '2023-03-03T18:00:00Z'}],
+            content_type='application/json'
+        )
+
+        self.assertEqual(
+            list(self.drone_1.battery_readings.order_by('id').values_list('battery_capacity', flat=True)),
+            [90, 80]
+        )
+
+    def test_rollup_battery_history(self):
+        """
+        Test the old readings are downsampled to minute buckets, and the old minute buckets to hour buckets
+        """
+        self.add_readings(
+            (datetime.timedelta(days=2, seconds=10), 80),
+            (datetime.timedelta(days=2, seconds=20), 90),
+            (datetime.timedelta(days=2, minutes=5), 70),
+            (datetime.timedelta(hours=1), 60),
+        )
+
+        result = rollup_battery_history(now=self.now)
+
+        self.assertEqual(result['minute_buckets'], 2)
+        self.assertEqual(BatteryReading.objects.count(), 1)
+        self.assertEqual(
+            list(BatteryRollup.objects.order_by('bucket').values_list(
+                'min_battery_capacity', 'avg_battery_capacity', 'max_battery_capacity', 'count'
+            )),
+            [(70, 70, 70, 1), (80, 85, 90, 2)]
+        )
+
+        result = rollup_battery_history(now=self.now + datetime.timedelta(days=40))
+
+        # The newest reading is downsampled to minute and hour buckets in the same run
+        self.assertEqual(result['hour_buckets'], 2)
+        self.assertEqual(
+            list(BatteryRollup.objects.order_by('bucket').values_list(
+                'resolution', 'min_battery_capacity', 'avg_battery_capacity', 'max_battery_capacity', 'count'
+            )),
+            [(BatteryRollup.RESOLUTION_HOUR, 70, 80, 90, 3), (BatteryRollup.RESOLUTION_HOUR, 60, 60, 60, 1)]
+        )
+
+        result = rollup_battery_history(now=self.now + datetime.timedelta(days=400))
+
+        self.assertEqual(result['deleted_hour_buckets'], 2)
+        self.assertFalse(BatteryRollup.objects.exists())
+
+    def test_rollup_battery_history_keeps_late_readings(self):
+        """
+        Test a reading written while the buckets are written isn't deleted with the downsampled readings
+        """
+        self.add_readings((datetime.timedelta(days=2, seconds=10), 80))
+        write_rollups = battery_history._write_rollups
+
+        def write_rollups_and_reading(resolution, rows):
+            write_rollups(resolution, rows)
+            self.add_readings((datetime.timedelta(days=2, seconds=20), 90))
+
+        with mock.patch('main.battery_history._write_rollups', side_effect=write_rollups_and_reading):
+            result = rollup_battery_history(now=self.now)
+
+        self.assertEqual(result['minute_buckets'], 1)
+        self.assertEqual(list(BatteryReading.objects.values_list('battery_capacity', flat=True)), [90])
+        self.assertEqual(BatteryRollup.objects.get().count, 1)
+
+    def test_battery_history_aligns_start_to_bucket(self):
+        """
+        Test the stored bucket containing the start of the window is returned
+        """
+        BatteryRollup.objects.create(
+            drone=self.drone_1, resolution=BatteryRollup.RESOLUTION_HOUR, bucket=self.now - datetime.timedelta(hours=2),
+            min_battery_capacity=60, avg_battery_capacity=70, max_battery_capacity=80, count=10
+        )
+        self.add_readings((datetime.timedelta(minutes=90), 50))
+
+        points = get_battery_history(
+            self.drone_1.pk, self.now - datetime.timedelta(minutes=100), self.now, BatteryRollup.RESOLUTION_HOUR
+        )
+
+        self.assertEqual(
+            [(point['bucket'], point['min'], point['max'], point['count']) for point in points],
+            [(self.now - datetime.timedelta(hours=2), 50, 80, 11)]
+        )
+
+    def test_battery_history_endpoint(self):
+        """
+        Test the battery history endpoint selects the resolution by the window
+        """
+        # In the middle of the previous hour, so both readings fall in the same hour bucket
+        now = timezone.now().replace(minute=30, second=30) - datetime.timedelta(hours=1)
+        self.now = now
+        self.add_readings((datetime.timedelta(seconds=10), 50), (datetime.timedelta(seconds=20), 40))
+
+        url = reverse('drone-battery-history', kwargs={'pk': self.drone_1.pk})
+
+        response = self.client.get(url, {'start': (now - datetime.timedelta(minutes=1)).isoformat()})
+
+        self.assertEqual(response.json()['resolution'], 'RAW')
+        self.assertEqual([p['battery_capacity'] for p in response.json()['points']], [40, 50])
+
+        response = self.client.get(url, {'start': (now - datetime.timedelta(days=2)).isoformat()})
+
+        self.assertEqual(response.json()['resolution'], 'HOUR')
+        self.assertEqual(len(response.json()['points']), 1)
+        self.assertEqual(response.json()['points'][0]['avg'], 45)
+        self.assertEqual(response.json()['points'][0]['count'], 2)
+
+        response = self.client.get(url, {'start': now.isoformat(), 'end': now.isoformat()})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class BatteryForecastTestCase(TestCase):
+    """
+    Test the battery drain forecast of the drones
+    """
+    fixtures = ['test_data.json']
+
+    def test_fit_drain_rates(self):
+        """
+        Test the drain rates of many drones are fit at once from their sums
+        """
+        readings = {
+            1: ([0, 60, 120], [90, 89, 88]),
+            2: ([0, 10, 20], [50, 50, 50]),
+            3: ([0], [70]),
+        }
+        sums = numpy.array([
+            [len(t), sum(t), sum(y), numpy.dot(t, t), numpy.dot(t, y)] for t, y in readings.values()
+        ], dtype=numpy.float64)
+
+        drain_rates = fit_drain_rates(*sums.T)
+
+        self.assertAlmostEqual(drain_rates[0], 1 / 60)
+        self.assertEqual(drain_rates[1], 0)
+        self.assertTrue(numpy.isnan(drain_rates[2]))
+
+    def test_epoch_keeps_the_microseconds(self):
+        """
+        Test the seconds since the epoch computed by the database aren't rounded to milliseconds
+        """
+        drone_1 = Drone.objects.get(serial_number='DRONE_1')
+        timestamps = [
+            datetime.datetime(2026, 10, 18, 12, 0, 3, microsecond, tzinfo=datetime.timezone.utc)
+            for microsecond in (0, 500, 999918)
+        ]
+        BatteryReading.objects.bulk_create(
+            BatteryReading(drone=drone_1, ts=ts, battery_capacity=50) for ts in timestamps
+        )
+
+        seconds = BatteryReading.objects.order_by('ts').annotate(seconds=Epoch('ts')).values_list('seconds', flat=True)
+
+        for value, ts in zip(seconds, timestamps):
+            self.assertAlmostEqual(value, ts.timestamp(), 6)
+
+    def test_forecast_from_window_sums(self):
+        """
+        Test the forecast fit from the sums of the database matches the fit of the readings
+        """
+        drone_1 = Drone.objects.get(serial_number='DRONE_1')
+        now = timezone.now()
+        readings = [
+            BatteryReading(drone=drone_1, ts=now - datetime.timedelta(seconds=seconds), battery_capacity=capacity)
+            for seconds, capacity in ((0, 80), (45.5, 81), (130.25, 83.5), (600, 90))
+        ]
+        BatteryReading.objects.bulk_create(readings)
+
+        slope, _ = numpy.polyfit(
+            [reading.ts.timestamp() - now.timestamp() for reading in readings],
+            [reading.battery_capacity for reading in readings],
+            1
+        )
+        forecast = forecast_battery({drone_1.pk: 80}, now=now)[drone_1.pk]
+
+        self.assertAlmostEqual(forecast.drain_rate, -slope)
+        self.assertAlmostEqual(forecast.time_to_threshold, (80 - settings.DRON_BATTERY_THRESHOLD) / -slope, 3)
+
+    def test_available_drones_time_to_threshold(self):
+        """
+        Test available drones endpoint with the predicted time to threshold
+        """
+        drone_1 = Drone.objects.get(serial_number='DRONE_1')
+        now = timezone.now()
+
+        # Draining 1% by minute, 75% until the threshold
+        BatteryReading.objects.bulk_create([
+            BatteryReading(drone=drone_1, ts=now - datetime.timedelta(minutes=minutes), battery_capacity=100 + minutes)
+            for minutes in range(3)
+        ])
+
+        url = reverse('drone-get-available-drones-for-load')
+
+        response = self.client.get(url)
+        self.assertAlmostEqual(response.json()[0]['predicted_time_to_threshold'], 4500)
+
+        response = self.client.get(url, {'min_time_to_threshold': 4000})
+        self.assertEqual(len(response.json()), 1)
+
+        response = self.client.get(url, {'min_time_to_threshold': 5000})
+        self.assertEqual(len(response.json()), 0)
+
+
+@override_settings(BATTERY_WRITE_BEHIND={'ENABLED': True, 'FLUSH_INTERVAL': None, 'MAX_PENDING': 100})
+class BatteryWriteBufferTestCase(TestCase):
+    """
+    Test the write-behind buffer of the battery telemetry
+    """
+    fixtures = ['test_data.json']
+
+    def setUp(self) -> None:
+        self.drone_1 = Drone.objects.get(serial_number='DRONE_1')
+        self.battery_buffer = BatteryWriteBuffer(flush_interval=None, max_pending=100)
+
+        buffer_patcher = mock.patch('main.battery_buffer._buffer', self.battery_buffer)
+        buffer_patcher.start()
+        self.addCleanup(buffer_patcher.stop)
+
+    def post_readings(self, *readings):
+        return self.client.post(
+            reverse('drone-telemetry'),
+            [
+                {'id': self.drone_1.pk, 'battery_capacity': battery_capacity, 'timestamp': timestamp}
+                for battery_capacity, timestamp in readings
+            ],
+            content_type='application/json'
+        )
+
+    def test_readings_are_coalesced(self):
+        """
+        Test only the newest reading of the drone is written on flush
+        """
+        response = self.post_readings((90, 1677862800), (70, 1677862860))
+        self.assertEqual(response.json()['buffered'], 1)
+
+        self.post_readings((80, 1677862830))
+
+        # Not written yet, but visible from the API
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.battery_capacity, 100)
+
+        response = self.client.get(reverse('drone-get-battery', kwargs={'pk': self.drone_1.pk}))
+        self.assertJSONEqual(response.content, {'battery_capacity': 70.0})
+
+        self.assertEqual(self.battery_buffer.flush(), 1)
+
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.battery_capacity, 70)
+
+        response = self.client.get(reverse('drone-telemetry-stats'))
+        self.assertEqual(response.json()['received'], 3)
+        self.assertEqual(response.json()['written'], 1)
+        self.assertEqual(response.json()['coalescing_ratio'], 3)
+
+    def test_readings_visible_until_committed(self):
+        """
+        Test the readings being written are still read from the buffer until they are committed
+        """
+        self.post_readings((55, 1677862800))
+        seen = []
+
+        def update_batteries(latest):
+            seen.append(self.battery_buffer.get_battery_capacity(Drone.objects.get(pk=self.drone_1.pk)))
+            return len(latest)
+
+        with mock.patch('main.battery_buffer.update_batteries', update_batteries):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.battery_buffer.flush()
+
+            self.assertEqual(seen, [55])
+            self.assertIsNotNone(self.battery_buffer.get(self.drone_1.pk))
+
+            for callback in callbacks:
+                callback()
+
+        self.assertIsNone(self.battery_buffer.get(self.drone_1.pk))
+
+    def test_buffered_battery_in_listing(self):
+        """
+        Test the listing built from the rows has the buffered battery of the drones
+        """
+        self.post_readings((40, 1677862800))
+
+        response = self.client.get(reverse('drone-list'), {'fields': 'id,battery_capacity'})
+        drone = next(drone for drone in response.json()['results'] if drone['id'] == self.drone_1.pk)
+
+        self.assertEqual(drone['battery_capacity'], 40.0)
+
+    def test_flush_when_full(self):
+        """
+        Test the buffer is written when the maximum pending drones is reached
+        """
+        self.battery_buffer.max_pending = 1
+
+        self.post_readings((60, 1677862800))
+
+        self.drone_1.refresh_from_db()
+        self.assertEqual(self.drone_1.battery_capacity, 60)
+        self.assertEqual(self.battery_buffer.stats()['pending'], 0)
+
+
+class NotificationDispatcherTestCase(SimpleTestCase):
+    """
+    Test the dispatch of the battery notifications
+    """
+
+    class FlakyNotifier(BaseNotifier):
+        def __init__(self, failures, **options):
+            super().__init__(**options)
+            self.failures = failures
+            self.batches = []
+
+        def send(self, notifications):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError()
+            self.batches.append(notifications)
+
+    def test_batches_and_retries(self):
+        """
+        Test the notifications are sent in batches and the failed batches are retried
+        """
+        notifier = self.FlakyNotifier(failures=1)
+        dispatcher = NotificationDispatcher([notifier], workers=1, batch_size=2, retry_delay=0)
+
+        with self.assertLogs('main.notifications', 'ERROR'):
+            for i in range(5):
+                dispatcher.notify(BatteryNotification(i, f'DRONE_{i}', 10, LEVEL_LOW))
+
+            dispatcher.close()
+
+        self.assertEqual(sorted(len(batch) for batch in notifier.batches), [1, 2, 2])
+        self.assertEqual((dispatcher.sent, dispatcher.failed), (5, 0))
+
+    def test_give_up_after_retries(self):
+        """
+        Test the notifications are dropped after the maximum number of retries
+        """
+        dispatcher = NotificationDispatcher([self.FlakyNotifier(failures=10)], max_retries=2, retry_delay=0)
+
+        with self.assertLogs('main.notifications', 'ERROR') as logs:
+            dispatcher.notify(BatteryNotification(1, 'DRONE_1', 10, LEVEL_LOW))
+            dispatcher.close()
+
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual((dispatcher.sent, dispatcher.failed), (0, 1))
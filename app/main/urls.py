@@ -1,12 +1,19 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from . import views
+from . import async_views, views
     
 router = routers.DefaultRouter()
 router.register('drone', views.DroneViewset)
 router.register('medication', views.MedicationViewset)
 
 urlpatterns = [
+    # Async read paths, before the routes of the viewsets for the same URLs (and with their names)
+    path('drone/<int:pk>/', async_views.drone_detail, name='drone-detail'),
+    path('drone/<int:pk>/get_battery/', async_views.drone_get_battery, name='drone-get-battery'),
+    path(
+        'drone/<int:pk>/get_loaded_medication_items/', async_views.drone_get_loaded_medication_items,
+        name='drone-get-loaded-medication-items'
+    ),
     path('', include(router.urls)),
 ]
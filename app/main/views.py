@@ -1,29 +1,163 @@
 from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status
+from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import JSONParser
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework.decorators import action
 
 from .models import Drone, Medication
+from .pagination import ChangedSinceCursorPagination
+from .filters import DroneFilter, MedicationFilter
+from .row_serializers import DroneRowSerializer, MedicationRowSerializer
+from .exports import CONTENT_TYPES, export_table
+from .parsers import NDJSONParser
+from .telemetry import ingest_battery_telemetry
+from .battery_buffer import get_battery_buffer
+from .battery_history import get_battery_history, select_resolution
+from .forecast import draining_before, forecast_battery
+from .planner import apply_load_plan, plan_loads
+from . import metrics, response_cache
+from .response_cache import get_or_set_response, request_variant
+from .conditional import conditional, detail_version, list_version, loaded_medication_items_version
 from .serializers import (
     DroneSerializer,
+    AvailableDroneSerializer,
     MedicationSerializer,
     IDMedicationSerializer,
+    IDsMedicationSerializer,
     DronStateSerializer,
-    DronBatterySerializer
+    DronesStateSerializer,
+    DronBatterySerializer,
+    AvailableDronesQuerySerializer,
+    CanCarryQuerySerializer,
+    CarrierDroneSerializer,
+    ExportQuerySerializer,
+    BatteryHistoryQuerySerializer,
+    PlanLoadsSerializer
 )
 from .exceptions import (
     WeightExceededError,
     DroneInvalidStateError,
-    DroneBatteryTooLowError
+    DroneBatteryTooLowError,
+    LoadPlanOutdatedError
 )
 
 
-class DroneViewset(viewsets.ModelViewSet):
+class ExportMixin:
+    """
+    Add the "export" action to stream the whole table of the viewset
+    """
+
+    export_table_name = None
+
+    @action(detail=False, methods=['get'], serializer_class=ExportQuerySerializer, pagination_class=None)
+    def export(self, request, *args, **kwargs):
+        """
+        Stream all the rows in NDJSON or CSV
+
+            Parameters on query string:
+                export_format (str): "ndjson" (default) or "csv"
+
+            Returns:
+                StreamingHttpResponse: The encoded rows
+        """
+        serializer_class = self.get_serializer_class()
+        serializer = serializer_class(data=request.query_params, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+
+        export_format = serializer.validated_data['export_format']
+
+        response = StreamingHttpResponse(
+            export_table(self.export_table_name, export_format),
+            content_type=CONTENT_TYPES[export_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.export_table_name}.{export_format}"'
+        return response
+
+
+class ConditionalMixin:
+    """
+    Conditional requests (ETag, Last-Modified, If-Match) on the list, the retrieve and the writes of the rows
+    """
+
+    @conditional(list_version)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional(detail_version)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    # Also the partial updates, which call "update"
+    @conditional(detail_version)
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    @conditional(detail_version)
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
+
+class RowListMixin:
+    """
+    Serve the list responses from "values()" rows with the row serializer ("row_serializer_class"),
+    when it supports all the fields to represent
+    """
+
+    row_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        # The fields of the model serializer, after the sparse fieldset
+        field_names = list(self.get_serializer().fields)
+
+        if self.row_serializer_class is None or not self.row_serializer_class.supports(field_names):
+            return super().list(request, *args, **kwargs)
+
+        row_serializer = self.row_serializer_class(field_names, self.get_serializer_context())
+        queryset = self.filter_queryset(self.get_queryset())
+        columns = row_serializer.columns
+
+        if self.paginator is not None:
+            # The cursor is read from the ordering fields of the rows
+            ordering = self.paginator.get_ordering(request, queryset, self)
+            columns = list(dict.fromkeys([*columns, *(field.lstrip('-') for field in ordering)]))
+
+        rows = queryset.values(*columns)
+        page = self.paginate_queryset(rows)
+
+        if page is not None:
+            return self.get_paginated_response(row_serializer.to_representation(page))
+
+        return Response(row_serializer.to_representation(rows), status=status.HTTP_200_OK)
+
+
+class DroneViewset(ConditionalMixin, RowListMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Drone.objects.all()
     serializer_class = DroneSerializer
+    pagination_class = ChangedSinceCursorPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = DroneFilter
+    row_serializer_class = DroneRowSerializer
+    ordering_fields = ['id', 'serial_number', 'model', 'state', 'battery_capacity', 'weight_limit', 'updated_at']
+    ordering = ['id']
+    export_table_name = 'drone'
+
+    @conditional(detail_version)
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Get a drone, the serialized drone is cached until it changes
+        """
+        data = get_or_set_response(
+            kwargs['pk'], 'detail', lambda: dict(self.get_serializer(self.get_object()).data), request_variant(request)
+        )
+        return Response(data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'], serializer_class=DronStateSerializer)
+    @conditional(detail_version)
     def set_state(self, request: Request, *args, **kwargs):
         drone: Drone = self.get_object()
         serializer_class = self.get_serializer_class()
@@ -38,9 +172,48 @@ class DroneViewset(viewsets.ModelViewSet):
                 {'detail': err.message},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        except Drone.DoesNotExist:
+            # Deleted after it was read
+            raise Http404()
 
         return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['post'], serializer_class=DronesStateSerializer)
+    def bulk_set_state(self, request: Request, *args, **kwargs):
+        """
+        Set a new state to many drones at once
+
+            Parameters on request:
+                ids (list): IDs of the drones
+                state (str): The new state
+
+            Returns:
+                Response: JSON response object with the updated and skipped drones
+        """
+        serializer_class = self.get_serializer_class()
+
+        serializer = serializer_class(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+
+        ids = list(dict.fromkeys(serializer.validated_data['ids']))
+
+        updated_ids, skipped = self.get_queryset().filter(pk__in=ids).bulk_set_state(
+            serializer.validated_data['state']
+        )
+
+        updated_ids = set(updated_ids)
+
+        return Response(
+            {
+                'state': serializer.validated_data['state'],
+                'updated': [pk for pk in ids if pk in updated_ids],
+                'skipped': [
+                    {'id': pk, 'detail': skipped.get(pk, 'Drone does not exist.')}
+                    for pk in ids if pk not in updated_ids
+                ]
+            },
+            status=status.HTTP_200_OK
+        )
 
     @action(detail=True, methods=['post'], serializer_class=IDMedicationSerializer)
     def load_medication_item(self, request, *args, **kwargs):
@@ -88,7 +261,52 @@ class DroneViewset(viewsets.ModelViewSet):
             status=status.HTTP_200_OK
         )
     
+    @action(detail=True, methods=['post'], serializer_class=IDsMedicationSerializer)
+    def load_medication_items(self, request, *args, **kwargs):
+        """
+        Load many medication items to the drone in a single transaction, the whole batch
+        is rejected if the total weight exceeds the drone's weight limit
+
+            Parameters on request:
+                medication_item_ids (list): IDs of existing medication items
+
+            Returns:
+                Response: JSON response object with the result of every item
+        """
+
+        drone: Drone = self.get_object()
+
+        # Before load a item to the drone the state must be "LOADING"
+        if drone.state != Drone.STATE_LOADING:
+            return Response(
+                {'detail': 'The drone state is invalid for this operation.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer_class = self.get_serializer_class()
+        serializer = serializer_class(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            results = drone.load_medication_items(serializer.validated_data['medication_item_ids'])
+        except WeightExceededError as err:
+            return Response(
+                {'detail': err.message},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(
+            {
+                'detail': 'The items have been loaded successfully.',
+                'results': [
+                    {'medication_item_id': pk, 'result': result} for pk, result in results.items()
+                ]
+            },
+            status=status.HTTP_200_OK
+        )
+
     @action(detail=True, methods=['get'], serializer_class=MedicationSerializer)
+    @conditional(loaded_medication_items_version)
     def get_loaded_medication_items(self, request, *args, **kwargs):
         """
         Get loaded medication items of a drone
@@ -96,31 +314,207 @@ class DroneViewset(viewsets.ModelViewSet):
             Returns:
                 Response: List of medication items
         """
-        drone: Drone = self.get_object()
-        serializer_class = self.get_serializer_class()
-        serializer = serializer_class(drone.medications.all(), many=True, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        def build():
+            drone: Drone = self.get_object()
+            serializer_class = self.get_serializer_class()
+            serializer = serializer_class(drone.medications.all(), many=True, context={'request': request})
+            return list(serializer.data)
+
+        data = get_or_set_response(kwargs['pk'], 'loaded_medication_items', build, request_variant(request))
+        return Response(data, status=status.HTTP_200_OK)
     
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], serializer_class=AvailableDroneSerializer, filter_backends=[])
     def get_available_drones_for_load(self, request, *args, **kwargs):
         """
-        Get available drones for load
+        Get available drones for load, filtered, ordered and paginated by the database
+
+            Parameters on query string:
+                min_free_capacity (float): Optional minimum weight the drone can still carry
+                model (str): Optional drone model
+                min_time_to_threshold (float): Optional minimum predicted seconds until the battery
+                    reaches the threshold, the drones without forecast are kept
+                ordering (str): Optional ordering, by default "id"
+                limit (int): Optional page size, the response is paginated when given
+                offset (int): Optional page offset
 
             Returns:
                 Response: List of drones
         """
-        available_drones = filter(
-            lambda drone: drone.state in [Drone.STATE_IDLE, Drone.STATE_LOADING] 
-                and drone.battery_capacity >= settings.DRON_BATTERY_THRESHOLD
-                and drone.current_weight < drone.weight_limit,
-            self.get_queryset()
+        query_serializer = AvailableDronesQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        params = query_serializer.validated_data
+
+        available_drones = self.get_queryset().available_for_load(
+            min_free_capacity=params.get('min_free_capacity')
         )
 
+        if 'model' in params:
+            available_drones = available_drones.filter(model=params['model'])
+
+        if 'min_time_to_threshold' in params:
+            # Skip the drones that will drop below the battery threshold too soon, evaluated by the database
+            available_drones = available_drones.exclude(pk__in=draining_before(params['min_time_to_threshold']))
+
+        available_drones = available_drones.order_by(params['ordering'], 'id')
+
         serializer_class = self.get_serializer_class()
-        serializer = serializer_class(available_drones, many=True, context={'request': request})
+
+        # Only paginate if the client asks for it ("limit" parameter)
+        paginator = LimitOffsetPagination()
+        page = paginator.paginate_queryset(available_drones, request, view=self)
+        drones = page if page is not None else list(available_drones)
+
+        forecasts = forecast_battery({drone.pk: drone.battery_capacity for drone in drones})
+
+        serializer = serializer_class(drones, many=True, context={'request': request, 'forecasts': forecasts})
+
+        if page is not None:
+            return paginator.get_paginated_response(serializer.data)
+
         return Response(serializer.data, status=status.HTTP_200_OK)
     
+    @action(detail=False, methods=['get'], serializer_class=CarrierDroneSerializer, filter_backends=[])
+    def can_carry(self, request, *args, **kwargs):
+        """
+        Get the drones available for load that can carry a weight or a medication item, best fit
+        first (the smallest sufficient free capacity), by a range scan of the free capacity index
+
+            Parameters on query string:
+                weight (float): Weight to carry, or
+                medication_item_id (int): Medication item to carry
+                limit (int): Optional maximum number of drones, by default 10
+
+            Returns:
+                Response: List of drones with their free capacity
+        """
+        query_serializer = CanCarryQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        params = query_serializer.validated_data
+
+        drones = self.get_queryset().available_for_load(
+            min_free_capacity=params['weight']
+        ).order_by('free_capacity', 'id')[:params['limit']]
+
+        serializer_class = self.get_serializer_class()
+        serializer = serializer_class(drones, many=True, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], serializer_class=PlanLoadsSerializer)
+    def plan_loads(self, request, *args, **kwargs):
+        """
+        Plan the loads of the unassigned medication items into the drones available for load,
+        minimizing the number of drones used, and optionally apply it
+
+            Parameters on request:
+                medication_item_ids (list): Optional IDs of the candidate medication items, all by default
+                drone_ids (list): Optional IDs of the candidate drones, all by default
+                mode (str): "ffd" (first-fit decreasing, default) or "exact" (branch and bound, small batches)
+                apply (bool): Load the items into the drones, all of them or none
+
+            Returns:
+                Response: JSON response object with the items of every drone and the items that don't fit
+        """
+        serializer_class = self.get_serializer_class()
+        serializer = serializer_class(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+
+        medication_items = Medication.objects.all()
+        drones = self.get_queryset()
+
+        if 'medication_item_ids' in serializer.validated_data:
+            medication_items = medication_items.filter(pk__in=serializer.validated_data['medication_item_ids'])
+
+        if 'drone_ids' in serializer.validated_data:
+            drones = drones.filter(pk__in=serializer.validated_data['drone_ids'])
+
+        plan = plan_loads(medication_items, drones, serializer.validated_data['mode'])
+
+        if serializer.validated_data['apply']:
+            try:
+                apply_load_plan(plan)
+            except (
+                LoadPlanOutdatedError, DroneInvalidStateError, DroneBatteryTooLowError, WeightExceededError
+            ) as err:
+                return Response(
+                    {'detail': err.message},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        return Response(
+            {
+                'mode': serializer.validated_data['mode'],
+                'applied': serializer.validated_data['apply'],
+                'drones_used': plan.drones_used,
+                'assignments': [
+                    {'drone_id': pk, 'medication_item_ids': item_ids} for pk, item_ids in plan.assignments.items()
+                ],
+                'unassigned': plan.unassigned
+            },
+            status=status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def telemetry(self, request, *args, **kwargs):
+        """
+        Ingest a batch of battery readings of many drones, as a JSON array or NDJSON.
+        The readings older than the last one applied to the drone are dropped.
+        If the setting "BATTERY_WRITE_BEHIND" is enabled the readings are buffered and written later.
+
+            Parameters on request (every reading):
+                id (int) or serial_number (str): The drone
+                battery_capacity (float): Battery level from 0 to 100
+                timestamp (str or float): Date/time of the reading, ISO 8601 or UNIX timestamp
+
+            Returns:
+                Response: Number of received, applied and stale readings, unknown drones and invalid readings
+        """
+        if not isinstance(request.data, list):
+            return Response(
+                {'detail': 'Expected a list of readings.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if len(request.data) > settings.TELEMETRY_MAX_READINGS:
+            return Response(
+                {'detail': f'Too many readings, the maximum is {settings.TELEMETRY_MAX_READINGS}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(
+            ingest_battery_telemetry(request.data, write_buffer=get_battery_buffer()),
+            status=status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['get'], filter_backends=[])
+    def response_cache_stats(self, request, *args, **kwargs):
+        """
+        Get the metrics of the cache of the drone detail and loaded medication items
+
+            Returns:
+                Response: Hits, misses, hit ratio and invalidations
+        """
+        return Response(response_cache.stats(), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], filter_backends=[])
+    def telemetry_stats(self, request, *args, **kwargs):
+        """
+        Get the metrics of the battery telemetry write-behind buffer
+
+            Returns:
+                Response: Pending, received and written readings, coalescing ratio and flush latency
+        """
+        battery_buffer = get_battery_buffer()
+
+        if battery_buffer is None:
+            return Response(
+                {'detail': 'The battery telemetry buffer is disabled.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response(battery_buffer.stats(), status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['get'], serializer_class=DronBatterySerializer)
+    @conditional(detail_version)
     def get_battery(self, request, *args, **kwargs):
         """
         Get batterry lavel of the drone
@@ -132,7 +526,54 @@ class DroneViewset(viewsets.ModelViewSet):
         serializer = serializer_class(self.get_object(), context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=['get'])
+    def battery_history(self, request, *args, **kwargs):
+        """
+        Get the battery history of the drone, by default in the finest resolution still stored
+        for the requested window
+
+            Parameters on query string:
+                start (str): Start date/time of the window
+                end (str): Optional end date/time of the window, by default now
+                resolution (str): Optional "RAW", "MINUTE" or "HOUR"
+
+            Returns:
+                Response: The resolution and the readings or buckets of the window
+        """
+        drone: Drone = self.get_object()
 
-class MedicationViewset(viewsets.ModelViewSet):
+        query_serializer = BatteryHistoryQuerySerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        params = query_serializer.validated_data
+
+        resolution = params.get('resolution') or select_resolution(params['start'], params['end'])
+
+        return Response(
+            {
+                'resolution': resolution,
+                'points': get_battery_history(drone.pk, params['start'], params['end'], resolution)
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+class MedicationViewset(ConditionalMixin, RowListMixin, ExportMixin, viewsets.ModelViewSet):
     queryset = Medication.objects.all()
     serializer_class = MedicationSerializer
+    pagination_class = ChangedSinceCursorPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_class = MedicationFilter
+    row_serializer_class = MedicationRowSerializer
+    ordering_fields = ['id', 'name', 'weight', 'code', 'priority', 'updated_at']
+    ordering = ['id']
+    export_table_name = 'medication'
+
+
+def metrics_view(request):
+    """
+    Metrics of the process in the Prometheus text format
+    """
+    if not settings.METRICS['ENABLED']:
+        raise Http404()
+
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)